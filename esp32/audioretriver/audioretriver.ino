@@ -5,6 +5,8 @@
 #define I2S_SAMPLE_RATE 44100
 #define I2S_BUFFER_SIZE 1024
 #define SERIAL_BAUD_RATE 115200
+#define FRAMED_OUTPUT 0    // 1 = send framed packets instead of raw samples
+#define OUTPUT_CODEC 0     // 1 = 12-bit packed, 2 = IMA-ADPCM; sends compressed frames (see below)
 
 // ADC configuration
 #define ADC_CHANNEL ADC1_CHANNEL_7
@@ -15,6 +17,138 @@
 #define DEFAULT_VREF 1100
 esp_adc_cal_characteristics_t *adc_chars;
 
+// Framed output: sync word, sequence number, sample count and CRC-32, so the
+// host can detect lost bytes and resynchronise (see pythoncode/framing.py)
+#define FRAME_SYNC_0 0xA5
+#define FRAME_SYNC_1 0x5A
+
+uint16_t frameSequence = 0;
+
+// CRC-32 (IEEE, same as zlib.crc32), chained by passing the previous result
+uint32_t crc32Update(uint32_t crc, const uint8_t *data, size_t length) {
+  crc = ~crc;
+  while (length--) {
+    crc ^= *data++;
+    for (int k = 0; k < 8; k++) {
+      crc = (crc >> 1) ^ (0xEDB88320UL & (0 - (crc & 1)));
+    }
+  }
+  return ~crc;
+}
+
+void sendFrame(const int16_t *samples, uint16_t count) {
+  uint8_t header[6] = {
+    FRAME_SYNC_0, FRAME_SYNC_1,
+    (uint8_t)(frameSequence & 0xFF), (uint8_t)(frameSequence >> 8),
+    (uint8_t)(count & 0xFF), (uint8_t)(count >> 8)
+  };
+  uint32_t crc = crc32Update(0, header + 2, 4);
+  crc = crc32Update(crc, (const uint8_t *)samples, count * sizeof(int16_t));
+  uint8_t trailer[4] = {
+    (uint8_t)(crc & 0xFF), (uint8_t)(crc >> 8), (uint8_t)(crc >> 16), (uint8_t)(crc >> 24)
+  };
+  Serial.write(header, sizeof(header));
+  Serial.write((const uint8_t *)samples, count * sizeof(int16_t));
+  Serial.write(trailer, sizeof(trailer));
+  frameSequence++;
+}
+
+// Compressed output (see pythoncode/audio_codecs.py). The ADC only gives
+// 10 or 12 bits, so packing them or ADPCM-coding them carries more samples
+// per second over the same link. Compressed frames are always framed; the
+// host decodes them with its usual framed setting.
+#define CODEC_PACKED12 1   // Two 12-bit samples in 3 bytes, lossless
+#define CODEC_ADPCM 2      // IMA-ADPCM, 4 bits per sample, lossy
+#define FRAME_COMPRESSED_SYNC_1 0x5C
+
+const int16_t adpcmStepTable[89] = {
+  7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+  50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+  253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+  1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+  3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+  11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+  32767
+};
+const int8_t adpcmIndexTable[16] = {-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8};
+
+int32_t adpcmPredictor = 0;
+int adpcmIndex = 0;
+uint8_t codecPayload[3 + (I2S_BUFFER_SIZE * 3 + 1) / 2];
+
+uint16_t packSamples12(const int16_t *samples, uint16_t count, uint8_t *out) {
+  uint16_t length = 0;
+  uint16_t i = 0;
+  for (; i + 1 < count; i += 2) {
+    uint16_t a = samples[i] & 0x0FFF;
+    uint16_t b = samples[i + 1] & 0x0FFF;
+    out[length++] = a & 0xFF;
+    out[length++] = (a >> 8) | ((b & 0x0F) << 4);
+    out[length++] = b >> 4;
+  }
+  if (i < count) {
+    uint16_t a = samples[i] & 0x0FFF;
+    out[length++] = a & 0xFF;
+    out[length++] = a >> 8;
+  }
+  return length;
+}
+
+// The state goes first so each frame decodes on its own
+uint16_t encodeAdpcm(const int16_t *samples, uint16_t count, uint8_t *out) {
+  out[0] = (uint16_t)adpcmPredictor & 0xFF;
+  out[1] = (uint16_t)adpcmPredictor >> 8;
+  out[2] = adpcmIndex;
+  uint16_t length = 3;
+  for (uint16_t i = 0; i < count; i++) {
+    int step = adpcmStepTable[adpcmIndex];
+    int32_t diff = samples[i] - adpcmPredictor;
+    uint8_t code = 0;
+    if (diff < 0) {
+      code = 8;
+      diff = -diff;
+    }
+    int32_t delta = step >> 3;
+    if (diff >= step) { code |= 4; diff -= step; delta += step; }
+    step >>= 1;
+    if (diff >= step) { code |= 2; diff -= step; delta += step; }
+    step >>= 1;
+    if (diff >= step) { code |= 1; delta += step; }
+    adpcmPredictor += (code & 8) ? -delta : delta;
+    if (adpcmPredictor > 32767) adpcmPredictor = 32767;
+    if (adpcmPredictor < -32768) adpcmPredictor = -32768;
+    adpcmIndex += adpcmIndexTable[code];
+    if (adpcmIndex < 0) adpcmIndex = 0;
+    if (adpcmIndex > 88) adpcmIndex = 88;
+    if (i & 1) {
+      out[length++] |= code << 4;  // High nibble holds the later sample
+    } else {
+      out[length] = code;
+    }
+  }
+  return length + (count & 1);
+}
+
+void sendCompressedFrame(const int16_t *samples, uint16_t count) {
+  uint16_t length = OUTPUT_CODEC == CODEC_ADPCM ? encodeAdpcm(samples, count, codecPayload)
+                                                : packSamples12(samples, count, codecPayload);
+  uint8_t header[7] = {
+    FRAME_SYNC_0, FRAME_COMPRESSED_SYNC_1,
+    (uint8_t)(frameSequence & 0xFF), (uint8_t)(frameSequence >> 8),
+    (uint8_t)(count & 0xFF), (uint8_t)(count >> 8),
+    OUTPUT_CODEC
+  };
+  uint32_t crc = crc32Update(0, header + 2, 5);
+  crc = crc32Update(crc, codecPayload, length);
+  uint8_t trailer[4] = {
+    (uint8_t)(crc & 0xFF), (uint8_t)(crc >> 8), (uint8_t)(crc >> 16), (uint8_t)(crc >> 24)
+  };
+  Serial.write(header, sizeof(header));
+  Serial.write(codecPayload, length);
+  Serial.write(trailer, sizeof(trailer));
+  frameSequence++;
+}
+
 // I2S configuration
 i2s_config_t i2s_config = {
     .mode = (i2s_mode_t)(I2S_MODE_MASTER | I2S_MODE_RX | I2S_MODE_ADC_BUILT_IN),
@@ -54,6 +188,14 @@ void loop() {
   // Read data from I2S
   i2s_read(I2S_NUM_0, (void *)i2s_buffer, I2S_BUFFER_SIZE * sizeof(int16_t), &bytes_read, portMAX_DELAY);
 
+#if OUTPUT_CODEC
+  sendCompressedFrame(i2s_buffer, bytes_read / sizeof(int16_t));
+  return;
+#elif FRAMED_OUTPUT
+  sendFrame(i2s_buffer, bytes_read / sizeof(int16_t));
+  return;
+#endif
+
   for (int i = 0; i < bytes_read / sizeof(int16_t); i++) {
     // Get the audio sample
     audio_sample = i2s_buffer[i];
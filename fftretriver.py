@@ -1,31 +1,185 @@
+import argparse
+import struct
+import threading
+import zlib
 import serial
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
 
 SERIAL_PORT = 'COM3'  # Change this to your ESP32's serial port (e.g., COM3)
 BAUD_RATE = 115200
+BINARY = False  # Set to True when the board sends binary spectrum frames
+RENDER_FPS = 30  # Spectra are parsed as fast as they arrive; only the latest is drawn
+READ_SIZE = 65536
+
+# Text format, one spectrum per line:
+#   [ "bin":value, "bin":value, ... ]
+#
+# Binary format, one spectrum per frame:
+#   sync      2 bytes  0xA5 0x5B
+#   count     uint16   number of bins, little-endian
+#   payload   count * float32, little-endian
+#   crc       uint32   zlib/IEEE CRC-32 of count and payload
+BINARY_SYNC = b'\xa5\x5b'
+MAX_BINS = 8192  # Larger counts are treated as corruption
+
+_COUNT = struct.Struct('<H')
+_CRC = struct.Struct('<I')
+
+# Function to build one binary spectrum frame, e.g. for testing without a board
+def encode_spectrum(values):
+    body = _COUNT.pack(len(values)) + np.asarray(values, dtype='<f4').tobytes()
+    return BINARY_SYNC + body + _CRC.pack(zlib.crc32(body))
+
+# Parses the text format from raw serial bytes. The bin labels are only
+# split out when the number of bins changes; values of every line are
+# converted in one NumPy call rather than one float() per pair.
+class TextSpectrumParser:
+    def __init__(self):
+        self.labels = []
+        self._buffer = b''
+
+    # Function to feed raw bytes; returns the spectra of all completed lines
+    def feed(self, data):
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()  # Incomplete last line
+        spectra = []
+        for line in lines:
+            line = line.strip()
+            if not (line.startswith(b'[') and line.endswith(b']')):
+                continue
+            fields = line[1:-1].replace(b':', b',').split(b',')
+            try:
+                values = np.array(fields[1::2]).astype(np.float32)
+            except ValueError:
+                continue  # Garbled line
+            if len(values) != len(self.labels):
+                self.labels = [label.strip().strip(b'"').decode(errors='replace') for label in fields[0::2]]
+            spectra.append(values)
+        return spectra
+
+# Parses binary spectrum frames; a corrupted frame is skipped by searching
+# for the next sync word
+class BinarySpectrumParser:
+    def __init__(self):
+        self.labels = []
+        self.frames_corrupt = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        spectra = []
+        pos = 0
+        while True:
+            start = buf.find(BINARY_SYNC, pos)
+            if start < 0:
+                pos = max(len(buf) - 1, pos)
+                break
+            pos = start
+            if len(buf) - pos < 4:
+                break
+            count, = _COUNT.unpack_from(buf, pos + 2)
+            crc_pos = pos + 4 + 4 * count
+            if count == 0 or count > MAX_BINS:
+                self.frames_corrupt += 1
+                pos += 1
+                continue
+            if crc_pos + 4 > len(buf):
+                break
+            if zlib.crc32(buf[pos + 2:crc_pos]) != _CRC.unpack_from(buf, crc_pos)[0]:
+                self.frames_corrupt += 1
+                pos += 1
+                continue
+            spectra.append(np.frombuffer(buf, dtype='<f4', count=count, offset=pos + 4).astype(np.float32))
+            if len(self.labels) != count:
+                self.labels = [str(i) for i in range(count)]
+            pos = crc_pos + 4
+        del buf[:pos]
+        return spectra
+
+# Reads the port on its own thread and keeps only the newest spectrum, so a
+# slow redraw never backs up the serial buffer
+class SpectrumReceiver:
+    def __init__(self, port, parser):
+        self.port = port
+        self.parser = parser
+        self.latest = None
+        self.spectra_received = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while self._running:
+            data = self.port.read(min(max(self.port.in_waiting, 1), READ_SIZE))
+            if not data:
+                continue
+            spectra = self.parser.feed(data)
+            if spectra:
+                self.spectra_received += len(spectra)
+                self.latest = spectra[-1]
 
 def main():
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
+    parser = argparse.ArgumentParser(description='Live spectrum display for the ESP32 FFT stream.')
+    parser.add_argument('--port', default=SERIAL_PORT)
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    parser.add_argument('--binary', action='store_true', default=BINARY, help='binary float32 frames instead of text lines')
+    args = parser.parse_args()
 
+    ser = serial.Serial(args.port, args.baud, timeout=0.1)
+    receiver = SpectrumReceiver(ser, BinarySpectrumParser() if args.binary else TextSpectrumParser())
+
+    fig, ax = plt.subplots()
+    ax.set_xlabel('Frequency Bins')
+    ax.set_ylabel('Magnitude')
+    ax.set_title('Spectrum Analysis')
+    bars = None  # One filled step artist, created when the bin count is known
+
+    # Function to update the bar heights in place with the newest spectrum
+    def update_plot(frame):
+        nonlocal bars
+        values = receiver.latest
+        if values is None:
+            return ()
+        if bars is None or len(bars.get_data().values) != len(values):
+            if bars is not None:
+                bars.remove()
+            bars = ax.stairs(values, np.arange(len(values) + 1) - 0.5, fill=True)
+            labels = receiver.parser.labels
+            ticks = np.linspace(0, len(values) - 1, min(len(values), 16)).astype(int)
+            ax.set_xticks(ticks, [labels[i] for i in ticks] if len(labels) == len(values) else ticks)
+            ax.set_xlim(-0.5, len(values) - 0.5)
+            ax.set_ylim(0, max(float(values.max()), 1e-6) * 1.1)
+            fig.canvas.draw_idle()
+        else:
+            bars.set_data(values)
+            # Grow the axis for louder spectra; never shrink, it would flicker
+            if values.max() > ax.get_ylim()[1]:
+                ax.set_ylim(0, float(values.max()) * 1.1)
+                fig.canvas.draw_idle()
+        return bars,
+
+    receiver.start()
+    animation = FuncAnimation(fig, update_plot, interval=1000 / RENDER_FPS, blit=True, cache_frame_data=False)
     try:
-        while True:
-            line = ser.readline().decode().strip()
-            if line.startswith('[') and line.endswith(']'):
-                # Extract FFT data from the line
-                data_str = line[1:-1]
-                data_pairs = [pair.split(':') for pair in data_str.split(',')]
-                bins = [pair[0].strip()[1:-1] for pair in data_pairs]
-                values = [float(pair[1].strip()) for pair in data_pairs]
-
-                # Plot the spectrum
-                plt.bar(bins, values)
-                plt.xlabel('Frequency Bins')
-                plt.ylabel('Magnitude')
-                plt.title('Spectrum Analysis')
-                plt.show()
+        plt.show()
     except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
         ser.close()
+        print(f"Received {receiver.spectra_received} spectra")
 
 if __name__ == '__main__':
     main()
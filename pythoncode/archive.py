@@ -0,0 +1,369 @@
+import argparse
+import lzma
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from wavwriter import StreamingWavWriter, map_wav
+
+# Compressed archive format for long captures, and a sink that writes it
+# off the capture thread.
+#
+# ArchiveSink only copies samples into the current block on the capture
+# thread. Full blocks go through a bounded queue to a writer thread that
+# compresses and writes them (zlib and lzma release the GIL while they
+# work), so a slow or stalled disk fills the queue instead of holding up
+# the capture. When the queue is full the overflow policy decides:
+#
+#   drop_newest  discard the block that does not fit (the default)
+#   drop_oldest  discard the longest-waiting block to make room
+#   block        wait for the writer; nothing is lost, capture may stall
+#
+# Dropped blocks are counted, and each block records its absolute sample
+# offset, so a drop leaves a visible gap (read back as silence) rather
+# than shifting the rest of the recording.
+#
+# Blocks are lossless: each channel is delta coded (int16 arithmetic, so
+# wrap-around decodes exactly), the low and high bytes are split into two
+# planes (the high bytes of small deltas are nearly constant), and the
+# result is compressed with zlib or lzma. Audio from the 10-bit ADCs
+# shrinks about 3x, noisy 12-bit audio about 2x, quiet passages far more.
+# File layout, little-endian:
+#
+#   header   'AUDZ', version u8, codec u8, channels u16, sample_rate u32,
+#            start_time f64 (wall clock of sample 0)
+#   block    sync 0xA5 0x5E, start_sample u64, frames u32, size u32,
+#            crc32 u32 of the payload, then size bytes of payload
+#   index    per block: file offset u64, start_sample u64, frames u32
+#   trailer  'AIDX', index offset u64, block count u32
+#
+# The index is written on close; a file cut short by a crash is read by
+# scanning the blocks, stopping at the first incomplete or corrupt one.
+ARCHIVE_SUFFIX = '.audz'
+BLOCK_SECONDS = 1.0   # Seek granularity, and the most a crash can lose besides the queue
+QUEUE_BLOCKS = 30     # Blocks waiting for the writer before the overflow policy applies
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+CODECS = {'zlib': 1, 'lzma': 2}
+DEFAULT_LEVELS = {'zlib': 6, 'lzma': 1}
+
+MAGIC = b'AUDZ'
+VERSION = 1
+BLOCK_SYNC = b'\xa5\x5e'
+INDEX_MAGIC = b'AIDX'
+_HEADER = struct.Struct('<4sBBHId')
+_BLOCK = struct.Struct('<2sQIII')
+_TRAILER = struct.Struct('<4sQI')
+_INDEX_ENTRY = np.dtype([('offset', '<u8'), ('start', '<u8'), ('frames', '<u4')])
+
+# Function to turn a (frames, channels) int16 block into a payload
+def encode_block(samples, codec='zlib', level=None):
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    deltas = np.diff(samples, axis=0, prepend=np.zeros((1, samples.shape[1]), dtype=np.int16))
+    planes = deltas.astype('<i2').view(np.uint8).reshape(-1, 2).T.tobytes()
+    if codec == 'lzma':
+        return lzma.compress(planes, preset=level)
+    return zlib.compress(planes, level)
+
+# Function to turn a payload back into a (frames, channels) int16 block
+def decode_block(payload, frames, channels, codec='zlib'):
+    planes = lzma.decompress(payload) if codec == 'lzma' else zlib.decompress(payload)
+    deltas = np.frombuffer(planes, dtype=np.uint8).reshape(2, -1).T.copy().view('<i2')
+    return np.cumsum(deltas.reshape(frames, channels), axis=0, dtype=np.int16)
+
+class ArchiveSink:
+    def __init__(self, path, sample_rate, channels=1, codec='zlib', level=None, block_seconds=BLOCK_SECONDS,
+                 max_queue=QUEUE_BLOCKS, overflow='drop_newest'):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {overflow}")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.codec = codec
+        self.level = level
+        self.block_frames = max(int(block_seconds * sample_rate), 1)
+        self.overflow = overflow
+        self.position = 0         # Absolute offset of the next sample received
+        self.blocks_written = 0
+        self.blocks_dropped = 0
+        self.samples_dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.blocked_seconds = 0.0   # Capture time spent waiting with overflow='block'
+        self.compress_seconds = 0.0
+        self.write_seconds = 0.0
+        self.max_queued = 0
+        self.error = None
+        self._queue = queue.Queue(max_queue)
+        self._block = None
+        self._filled = 0
+        self._file = None
+        self._index = []
+        self._thread = None
+
+    def open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, CODECS[self.codec], self.channels, self.sample_rate, time.time()))
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._new_block()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _new_block(self):
+        self._block = np.empty((self.block_frames, self.channels), dtype=np.int16)
+        self._filled = 0
+
+    # Runs on the capture thread: copy only, the writer thread does the rest
+    def write(self, samples):
+        samples = samples.reshape(len(samples), self.channels)
+        offset = 0
+        while offset < len(samples):
+            part = min(len(samples) - offset, self.block_frames - self._filled)
+            self._block[self._filled:self._filled + part] = samples[offset:offset + part]
+            self._filled += part
+            offset += part
+            if self._filled == self.block_frames:
+                self._submit()
+
+    def _submit(self, wait=False):
+        item = (self.position, self._block[:self._filled])
+        self.position += self._filled
+        self._new_block()
+        if wait or self.overflow == 'block':
+            started = time.perf_counter()
+            self._queue.put(item)
+            self.blocked_seconds += time.perf_counter() - started
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self.overflow == 'drop_oldest':
+                    try:
+                        self._count_dropped(self._queue.get_nowait())
+                    except queue.Empty:
+                        pass  # The writer just took it
+                    self._queue.put_nowait(item)
+                else:
+                    self._count_dropped(item)
+        self.max_queued = max(self.max_queued, self._queue.qsize())
+
+    def _count_dropped(self, item):
+        self.blocks_dropped += 1
+        self.samples_dropped += len(item[1])
+
+    def _run(self):
+        clock = time.perf_counter
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                self._count_dropped(item)  # Keep draining so capture never blocks on a dead disk
+                continue
+            start, samples = item
+            try:
+                started = clock()
+                payload = encode_block(samples, self.codec, self.level)
+                compressed = clock()
+                offset = self._file.tell()
+                self._file.write(_BLOCK.pack(BLOCK_SYNC, start, len(samples), len(payload), zlib.crc32(payload)))
+                self._file.write(payload)
+                self._file.flush()
+                self.write_seconds += clock() - compressed
+                self.compress_seconds += compressed - started
+            except (OSError, zlib.error, lzma.LZMAError) as exc:
+                self.error = exc
+                self._count_dropped(item)
+                continue
+            self._index.append((offset, start, len(samples)))
+            self.blocks_written += 1
+            self.bytes_in += samples.nbytes
+            self.bytes_out += _BLOCK.size + len(payload)
+
+    def close(self):
+        if self._file is None:
+            return
+        # Waits for room even under a drop policy: nothing is dropped at the end
+        if self._filled:
+            self._submit(wait=True)
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        try:
+            if self.error is None:
+                index_offset = self._file.tell()
+                self._file.write(np.array(self._index, dtype=_INDEX_ENTRY).tobytes())
+                self._file.write(_TRAILER.pack(INDEX_MAGIC, index_offset, len(self._index)))
+        finally:
+            self._file.close()
+            self._file = None
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return {
+            'queued_blocks': self._queue.qsize(),
+            'max_queued_blocks': self.max_queued,
+            'blocks_written': self.blocks_written,
+            'dropped_blocks': self.blocks_dropped,
+            'dropped_samples': self.samples_dropped,
+            'compression_ratio': self.bytes_in / self.bytes_out if self.bytes_out else 0.0,
+            'compress_ms': self.compress_seconds * 1000,
+            'write_ms': self.write_seconds * 1000,
+            'blocked_ms': self.blocked_seconds * 1000,
+            'errors': int(self.error is not None),
+        }
+
+# Reads sample ranges of an archive, decompressing only the blocks they
+# touch. Same interface as SegmentStore: mono archives read as 1-D arrays,
+# others as (frames, channels).
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{path}: not an archive")
+        magic, version, codec, self.channels, self.sample_rate, self.start_time = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an archive")
+        self.codec = {number: name for name, number in CODECS.items()}[codec]
+        self.complete = True  # False when the index was missing and the blocks were scanned
+        entries = self._read_index()
+        if entries is None:
+            self.complete = False
+            entries = self._scan()
+        self.offsets = entries['offset'].astype(np.int64)
+        self.starts = entries['start'].astype(np.int64)
+        self.frames = entries['frames'].astype(np.int64)
+        self._frame_shape = () if self.channels == 1 else (self.channels,)
+        self._cached = (None, None)  # Last decoded block, for reads that walk forward
+
+    def _read_index(self):
+        size = os.path.getsize(self.path)
+        if size < _HEADER.size + _TRAILER.size:
+            return None
+        self._file.seek(size - _TRAILER.size)
+        magic, offset, count = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != INDEX_MAGIC or offset + count * _INDEX_ENTRY.itemsize + _TRAILER.size != size:
+            return None
+        self._file.seek(offset)
+        return np.frombuffer(self._file.read(count * _INDEX_ENTRY.itemsize), dtype=_INDEX_ENTRY)
+
+    def _scan(self):
+        entries = []
+        offset = _HEADER.size
+        self._file.seek(offset)
+        while True:
+            header = self._file.read(_BLOCK.size)
+            if len(header) < _BLOCK.size:
+                break
+            sync, start, frames, size, crc = _BLOCK.unpack(header)
+            payload = self._file.read(size)
+            if sync != BLOCK_SYNC or len(payload) < size or zlib.crc32(payload) != crc:
+                break
+            entries.append((offset, start, frames))
+            offset += _BLOCK.size + size
+        return np.array(entries, dtype=_INDEX_ENTRY)
+
+    @property
+    def total_samples(self):
+        return int(self.starts[-1] + self.frames[-1]) if len(self.starts) else 0
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    # Samples lost to queue overflows, read back as silence
+    @property
+    def missing_samples(self):
+        return self.total_samples - int(self.frames.sum())
+
+    def _block(self, number):
+        if self._cached[0] == number:
+            return self._cached[1]
+        self._file.seek(self.offsets[number])
+        _, _, frames, size, _ = _BLOCK.unpack(self._file.read(_BLOCK.size))
+        samples = decode_block(self._file.read(size), frames, self.channels, self.codec)
+        self._cached = (number, samples)
+        return samples
+
+    # Function to read count samples starting at an absolute sample offset
+    def read(self, start, count):
+        start = max(start, 0)
+        count = max(min(count, self.total_samples - start), 0)
+        out = np.zeros((count, self.channels), dtype=np.int16)
+        number = max(int(np.searchsorted(self.starts, start, 'right')) - 1, 0)
+        while number < len(self.starts) and self.starts[number] < start + count:
+            first = max(start, self.starts[number])
+            last = min(start + count, self.starts[number] + self.frames[number])
+            if last > first:
+                block = self._block(number)
+                out[first - start:last - start] = block[first - self.starts[number]:last - self.starts[number]]
+            number += 1
+        return out.reshape((count,) + self._frame_shape)
+
+    # Function to read by seconds from the start of the archive
+    def read_seconds(self, start, duration):
+        return self.read(int(start * self.sample_rate), int(duration * self.sample_rate))
+
+    def close(self):
+        self._file.close()
+
+# Function to compress a WAV file into an archive
+def compress_wav(wav_path, path, codec='zlib', level=None):
+    samples, sample_rate = map_wav(wav_path)
+    sink = ArchiveSink(path, sample_rate, samples.shape[1], codec, level, overflow='block')
+    sink.open()
+    for start in range(0, len(samples), sink.block_frames):
+        sink.write(samples[start:start + sink.block_frames])
+    sink.close()
+    return sink
+
+# Function to write (part of) an archive back out as a WAV file
+def extract_wav(path, wav_path, start=0.0, duration=None):
+    reader = ArchiveReader(path)
+    first = int(start * reader.sample_rate)
+    end = reader.total_samples if duration is None else min(first + int(duration * reader.sample_rate), reader.total_samples)
+    step = int(BLOCK_SECONDS * reader.sample_rate) * 8
+    with StreamingWavWriter(wav_path, reader.sample_rate, reader.channels) as writer:
+        for position in range(first, end, step):
+            writer.write(reader.read(position, min(step, end - position)))
+    reader.close()
+    return max(end - first, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect, create or extract compressed audio archives.')
+    parser.add_argument('archive')
+    parser.add_argument('--from-wav', metavar='WAV', help='compress WAV into the archive')
+    parser.add_argument('--codec', choices=sorted(CODECS), default='zlib')
+    parser.add_argument('--level', type=int)
+    parser.add_argument('--extract', metavar='WAV', help='write the archive (or --start/--duration of it) to WAV')
+    parser.add_argument('--start', type=float, default=0.0)
+    parser.add_argument('--duration', type=float)
+    args = parser.parse_args()
+
+    if args.from_wav:
+        started = time.monotonic()
+        sink = compress_wav(args.from_wav, args.archive, args.codec, args.level)
+        print(f"Compressed {sink.position} samples {sink.stats()['compression_ratio']:.2f}x "
+              f"in {time.monotonic() - started:.1f} s")
+    if args.extract:
+        count = extract_wav(args.archive, args.extract, args.start, args.duration)
+        print(f"Wrote {count} samples to {args.extract}")
+    reader = ArchiveReader(args.archive)
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.start_time))
+    size = os.path.getsize(args.archive)
+    raw = reader.total_samples * reader.channels * 2
+    print(f"{args.archive}: {reader.codec}, {reader.channels} channel(s) at {reader.sample_rate} Hz, started {stamp}")
+    print(f"{reader.duration:.1f} s in {len(reader.starts)} blocks, {size} bytes "
+          f"({raw / size if size else 0:.2f}x), {reader.missing_samples} samples missing"
+          + ('' if reader.complete else ', no index (recovered by scanning)'))
+    reader.close()
+
+if __name__ == '__main__':
+    main()
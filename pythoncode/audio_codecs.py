@@ -0,0 +1,164 @@
+import numpy as np
+
+# Sample codecs for the compressed frame format (see framing.py).
+#
+# The ADCs only deliver 10 or 12 bits, so sending every sample as int16
+# wastes a quarter or more of the link:
+#
+#   CODEC_PACKED12  two 12-bit samples in 3 bytes, lossless for the ADC
+#                   values (4/3 the samples per second of raw int16)
+#   CODEC_ADPCM     IMA-ADPCM, 4 bits per sample (4x), lossy
+#
+# An ADPCM payload starts with the encoder state (predictor int16, step
+# index uint8) so every frame decodes on its own and a lost frame does not
+# corrupt the next one. The sketches implement the same encoder in C.
+#
+# Decoding is vectorized over whole frames and over every frame of the same
+# length received in one read. IMA-ADPCM looks sequential, but its step
+# index only depends on the codes, and both the index and the predictor
+# are running sums clamped to a range: a sum with a floor is the plain
+# cumulative sum lifted by its deepest dip so far, and hitting the ceiling
+# (rare; only on full-scale jumps) restarts that calculation from there.
+CODEC_PACKED12 = 1
+CODEC_ADPCM = 2
+ADPCM_HEADER_SIZE = 3  # Predictor int16, step index uint8
+
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767], dtype=np.int32)
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+MAX_INDEX = len(STEP_TABLE) - 1
+
+_STEPS = STEP_TABLE.tolist()
+_INDEX_STEPS = INDEX_TABLE.tolist()
+
+# Function to get the payload length of a frame, or None for an unknown codec
+def payload_size(codec, count):
+    if codec == CODEC_PACKED12:
+        return (3 * count + 1) // 2
+    if codec == CODEC_ADPCM:
+        return ADPCM_HEADER_SIZE + (count + 1) // 2
+    return None
+
+# Function to pack samples into 12 bits each; an odd last sample takes 2 bytes
+def pack12(samples):
+    values = np.asarray(samples).astype(np.uint16) & 0x0FFF
+    pairs = len(values) // 2
+    out = np.empty(payload_size(CODEC_PACKED12, len(values)), dtype=np.uint8)
+    first = values[0:2 * pairs:2]
+    second = values[1:2 * pairs:2]
+    out[0:3 * pairs:3] = first & 0xFF
+    out[1:3 * pairs:3] = (first >> 8) | ((second & 0x0F) << 4)
+    out[2:3 * pairs:3] = second >> 4
+    if len(values) % 2:
+        out[-2] = values[-1] & 0xFF
+        out[-1] = values[-1] >> 8
+    return out.tobytes()
+
+# Function to unpack k payloads of `count` samples, given as a (k, size)
+# uint8 array, into a (k, count) int16 array
+def unpack12(payloads, count):
+    data = payloads.astype(np.uint16)
+    pairs = count // 2
+    out = np.empty((len(data), count), dtype=np.int16)
+    out[:, 0:2 * pairs:2] = data[:, 0:3 * pairs:3] | ((data[:, 1:3 * pairs:3] & 0x0F) << 8)
+    out[:, 1:2 * pairs:2] = (data[:, 1:3 * pairs:3] >> 4) | (data[:, 2:3 * pairs:3] << 4)
+    if count % 2:
+        out[:, -1] = data[:, -2] | (data[:, -1] << 8)
+    return out
+
+# IMA-ADPCM encoder with the same state handling as the sketches. Plain
+# Python, one sample at a time: it is for emulators and tests, not capture.
+class AdpcmEncoder:
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    # Function to encode samples into one frame payload, state header first
+    def encode(self, samples):
+        predictor, index = self.predictor, self.index
+        header = np.array([predictor], dtype='<i2').tobytes() + bytes([index])
+        codes = bytearray()
+        for sample in np.asarray(samples, dtype=np.int64).tolist():
+            step = _STEPS[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = min(max(predictor, -32768), 32767)
+            index = min(max(index + _INDEX_STEPS[code], 0), MAX_INDEX)
+            codes.append(code)
+        self.predictor, self.index = predictor, index
+        if len(codes) % 2:
+            codes.append(0)
+        nibbles = np.frombuffer(codes, dtype=np.uint8)
+        return header + (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+# Function to run x[n] = max(lo, x[n-1] + deltas[n]) along the last axis
+def _floored_sum(start, deltas, lo):
+    totals = np.asarray(start)[..., None] + np.cumsum(deltas, axis=-1)
+    return totals - np.minimum(np.minimum.accumulate(totals, axis=-1) - lo, 0)
+
+# Function to run x[n] = min(hi, max(lo, x[n-1] + deltas[n])) for each row
+def _clamped_sum(start, deltas, lo, hi):
+    values = _floored_sum(start, deltas, lo)
+    for row in np.flatnonzero((values > hi).any(axis=1)):
+        line = values[row]
+        over = np.flatnonzero(line > hi)
+        while len(over):
+            first = over[0]
+            line[first] = hi
+            line[first + 1:] = _floored_sum(hi, deltas[row, first + 1:], lo)
+            over = first + 1 + np.flatnonzero(line[first + 1:] > hi)
+    return values
+
+# Function to decode k ADPCM payloads of `count` samples, given as a (k, size)
+# uint8 array, into a (k, count) int16 array
+def decode_adpcm(payloads, count):
+    predictors = payloads[:, 0:2].copy().view('<i2')[:, 0].astype(np.int32)
+    indices = np.minimum(payloads[:, 2], MAX_INDEX).astype(np.int32)
+    packed = payloads[:, ADPCM_HEADER_SIZE:]
+    codes = np.empty((len(payloads), 2 * packed.shape[1]), dtype=np.int32)
+    codes[:, 0::2] = packed & 0x0F
+    codes[:, 1::2] = packed >> 4
+    codes = codes[:, :count]
+
+    # Step index in force for each code: the header's, then the running sum
+    after = _clamped_sum(indices, INDEX_TABLE[codes], 0, MAX_INDEX)
+    before = np.empty_like(after)
+    before[:, 0] = indices
+    before[:, 1:] = after[:, :-1]
+    steps = STEP_TABLE[before]
+
+    diffs = (steps >> 3) + ((codes >> 2) & 1) * steps + ((codes >> 1) & 1) * (steps >> 1) + (codes & 1) * (steps >> 2)
+    diffs = np.where(codes & 8, -diffs, diffs)
+    return _clamped_sum(predictors, diffs, -32768, 32767).astype(np.int16)
+
+# Function to decode k payloads of the same codec and count, concatenated
+# in `data`, into a (k, count) int16 array
+def decode_payloads(codec, count, data):
+    payloads = np.frombuffer(data, dtype=np.uint8).reshape(-1, payload_size(codec, count))
+    if codec == CODEC_PACKED12:
+        return unpack12(payloads, count)
+    return decode_adpcm(payloads, count)
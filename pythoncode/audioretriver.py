@@ -1,13 +1,32 @@
-import serial
-import serial.tools.list_ports
 import tkinter as tk
 from tkinter import ttk
-import wave
-import pyaudio
-import threading
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from peak_pyramid import PeakPyramid
+from render_scheduler import RenderScheduler
+from metrics import Metrics
+from stats_panel import StatsPanel
+from jitter_buffer import MonitorSink
+from resample import RateEstimator
+from event_capture import EventRecorder, make_trigger
+from archive import ArchiveSink
+from port_discovery import PortChooser
+from capture import CapturePipeline, FileSource, PyAudioSource, SerialSource, WavSink, CallbackSink, terminate_pyaudio
+
+RENDER_FPS = 20  # Maximum oscilloscope redraws per second
+FRAMED = False  # Set to True when the sketch is built with FRAMED_OUTPUT 1
+SAMPLE_RATE = 44100
+SERIAL_SAMPLE_RATE = 5760  # Starting guess for the serial rate (115200 baud carries at most ~5760 int16 samples/s); the monitor follows the measured rate
+MONITOR_LATENCY = 0.1  # Seconds of serial audio buffered before the speakers
+HISTORY_SECONDS = 600  # Audio the oscilloscope can zoom out to
+MIN_VIEW_SAMPLES = 1000
+WAV_FILENAME = "recorded_audio.wav"
+ARCHIVE_FILE = None  # Set to a .audz path to record compressed on a background thread instead of WAV_FILENAME
+EVENTS_DIR = None  # Set to a directory to keep only triggered events instead of one continuous WAV
+TRIGGER = 'rms'  # What starts an event: 'rms', 'peak', 'band' or 'flux' (see event_capture.py)
+REPLAY_FILE = None  # Set to a recorded WAV, archive or segment directory to analyse it instead of the microphone
+REPLAY_SPEED = 1.0  # Times real time for REPLAY_FILE, None for as fast as possible
+SHOW_STATS = True  # Live capture and render timings under the plot; False removes the instrumentation
 
 class AudioRecorderApp:
     def __init__(self):
@@ -16,14 +35,16 @@ class AudioRecorderApp:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         self.is_recording = False
-        self.my_port = None
-        self.audio = pyaudio.PyAudio()
-        self.audio_stream = None
-        self.playback_stream = None
-        self.wave_file = None
-        self.audio_data = np.zeros(44100)  # Initialize with zeros to avoid errors
+        self.recorder = None  # Microphone -> WAV file and oscilloscope
+        self.player = None    # Serial port -> speakers
+        self.recorder_metrics = Metrics('recorder') if SHOW_STATS else None
+        self.player_metrics = Metrics('player') if SHOW_STATS else None
+        self.pyramid = PeakPyramid(HISTORY_SECONDS * SAMPLE_RATE)  # Min/max levels for drawing
+        self.view_samples = SAMPLE_RATE  # Width of the plotted window, changed with the mouse wheel
 
         self.setup_ui()
+
+    def run(self):
         self.root.mainloop()
 
     def setup_ui(self):
@@ -31,16 +52,14 @@ class AudioRecorderApp:
         self.setup_record_button()
         self.setup_canvas()
 
+    # Ports are listed and probed in the background; the window opens at once
     def setup_serial_ports(self):
-        ports = list(serial.tools.list_ports.comports())
-        self.port_names = [port.device for port in ports]
-
         self.port_label = tk.Label(self.root, text="Select Serial Port:")
         self.port_label.pack()
 
-        self.port_combobox = ttk.Combobox(self.root, values=self.port_names)
+        self.port_combobox = ttk.Combobox(self.root, state='readonly')
         self.port_combobox.pack()
-        self.port_combobox.current(0)
+        self.port_chooser = PortChooser(self.root, self.port_combobox, self.port_label)
 
     def setup_record_button(self):
         self.record_button = tk.Button(self.root, text="Record", command=self.toggle_recording)
@@ -52,77 +71,93 @@ class AudioRecorderApp:
         self.ax.set_title("Sound Oscilloscope")
         self.ax.set_xlabel("Time")
         self.ax.set_ylabel("Amplitude")
-        self.ax.set_xlim(0, 44100)  # Set initial x-axis limit
+        self.ax.set_xlim(0, self.view_samples)  # Set initial x-axis limit
         self.ax.set_ylim(-32768, 32768)  # Set initial y-axis limit
         self.fig_canvas = FigureCanvasTkAgg(self.fig, master=self.root)
         self.fig_canvas.get_tk_widget().pack()
+        self.fig_canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.render_scheduler = RenderScheduler(self.root, self.update_plot, fps=RENDER_FPS)
+        if SHOW_STATS:
+            self.render_scheduler.timer = self.recorder_metrics.timer('render')
+            self.recorder_metrics.watch('scheduler', self.render_scheduler)
+            self.stats_panel = StatsPanel(self.root, [self.recorder_metrics, self.player_metrics])
+            self.stats_panel.label.pack(fill=tk.X)
+            self.stats_panel.start()
 
     def toggle_recording(self):
         self.is_recording = not self.is_recording
         if self.is_recording:
             self.record_button.config(text="Stop Recording")
-            selected_port = self.port_combobox.get()
-            self.my_port = serial.Serial(selected_port, 115200)
             self.start_recording()
             self.play_audio()
         else:
             self.record_button.config(text="Record")
             self.stop_recording()
             self.stop_audio()
-            self.my_port.close()
 
     def start_recording(self):
-        self.wave_file = wave.open("recorded_audio.wav", 'wb')
-        self.wave_file.setnchannels(1)  # Mono
-        self.wave_file.setsampwidth(2)   # 2 bytes (16-bit)
-        self.wave_file.setframerate(44100)  # Sample rate
-        self.audio_stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
-        stream_thread = threading.Thread(target=self.record_audio)
-        stream_thread.start()
+        self.pyramid = PeakPyramid(HISTORY_SECONDS * SAMPLE_RATE)
+        sinks = [self.pyramid, CallbackSink(self.publish_plot)]
+        if EVENTS_DIR:
+            sinks.insert(0, EventRecorder(EVENTS_DIR, SAMPLE_RATE, make_trigger(TRIGGER, SAMPLE_RATE)))
+        elif ARCHIVE_FILE:
+            sinks.insert(0, ArchiveSink(ARCHIVE_FILE, SAMPLE_RATE))
+        elif not REPLAY_FILE:
+            sinks.insert(0, WavSink(WAV_FILENAME, SAMPLE_RATE))  # A replay is only analysed, not recorded again
+        source = FileSource(REPLAY_FILE, 1024, REPLAY_SPEED) if REPLAY_FILE else PyAudioSource(SAMPLE_RATE, 1024)
+        self.recorder = CapturePipeline(source, sinks, metrics=self.recorder_metrics)
+        self.recorder.start()
+        self.render_scheduler.start()
 
     def stop_recording(self):
-        if self.audio_stream:
-            self.audio_stream.stop_stream()
-            self.audio_stream.close()
-            self.audio_stream = None
-        if self.wave_file:
-            self.wave_file.close()
-            self.wave_file = None
-
-    def record_audio(self):
-        while self.is_recording:
-            data = self.audio_stream.read(1024)
-            self.wave_file.writeframes(data)
-            new_audio_data = np.frombuffer(data, dtype=np.int16)
-            self.audio_data = np.roll(self.audio_data, -len(new_audio_data))
-            self.audio_data[-len(new_audio_data):] = new_audio_data
-            self.line.set_xdata(np.arange(len(self.audio_data)))
-            self.line.set_ydata(self.audio_data)
-            self.ax.set_ylim(np.min(self.audio_data), np.max(self.audio_data))
-            self.fig_canvas.draw()
+        self.render_scheduler.stop()
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+
+    # Runs on the capture thread; only signal new data, drawing happens on
+    # the Tk main loop
+    def publish_plot(self, samples):
+        self.render_scheduler.publish(self.pyramid.total_written)
+
+    # Called by the render scheduler on the Tk main thread. Draws about one
+    # min/max pair per pixel from the pyramid instead of every sample.
+    def update_plot(self, total_written):
+        end = self.pyramid.total_written
+        start = end - self.view_samples
+        x, y = self.pyramid.envelope(start, end, int(self.ax.bbox.width))
+        self.line.set_data(x - start, y)
+        peaks = self.pyramid.peaks(start, end)
+        if peaks and peaks[0] < peaks[1]:
+            self.ax.set_ylim(*peaks)
+        self.fig_canvas.draw_idle()
+
+    # Mouse wheel zooms the time window in or out by a factor of two
+    def on_scroll(self, event):
+        scale = 0.5 if event.button == 'up' else 2
+        self.view_samples = int(min(max(self.view_samples * scale, MIN_VIEW_SAMPLES), HISTORY_SECONDS * SAMPLE_RATE))
+        self.ax.set_xlim(0, self.view_samples)
+        self.update_plot(self.pyramid.total_written)
 
     def play_audio(self):
-        self.playback_stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=44100, output=True)
-        play_thread = threading.Thread(target=self.play_audio_thread)
-        play_thread.start()
-
-    def play_audio_thread(self):
-        while self.is_recording:
-            if self.my_port:
-                data = self.my_port.read(1024)
-                self.playback_stream.write(data)
+        if not self.port_combobox.get():
+            return  # No board to monitor
+        source = SerialSource(self.port_combobox.get(), 115200, SERIAL_SAMPLE_RATE, framed=FRAMED)
+        estimator = RateEstimator()
+        monitor = MonitorSink(SERIAL_SAMPLE_RATE, SAMPLE_RATE, MONITOR_LATENCY, rate_estimator=estimator)
+        self.player = CapturePipeline(source, [monitor], [estimator], metrics=self.player_metrics)
+        self.player.start()
 
     def stop_audio(self):
-        if self.playback_stream:
-            self.playback_stream.stop_stream()
-            self.playback_stream.close()
-            self.playback_stream = None
+        if self.player:
+            self.player.stop()
+            self.player = None
 
     def on_closing(self):
         if self.is_recording:
             self.toggle_recording()
-        self.audio.terminate()
+        terminate_pyaudio()
         self.root.destroy()
 
 if __name__ == "__main__":
-    AudioRecorderApp()
+    AudioRecorderApp().run()
@@ -0,0 +1,171 @@
+import argparse
+import multiprocessing
+import os
+import time
+import numpy as np
+from stft import STFT
+from wavwriter import map_wav
+from features import band_matrix
+
+# Offline analysis of a directory of recorded WAV files.
+#
+# Each file is analysed by one worker process. Samples are read through a
+# memory map in blocks of BLOCK_SECONDS, so memory per worker stays flat
+# whatever the file length, and the worker writes one compressed .npz of
+# results next to the others in the output directory:
+#
+#   spectrogram   mean STFT magnitude per summary slice, (slices, bins)
+#   band_energy   mean energy per octave band per slice, (slices, bands)
+#   rms, peak     level envelopes, one value per envelope window
+#   clip_counts   clipped samples per envelope window
+#
+# plus the scalar totals. Results are written under a temporary name and
+# renamed when complete, so an interrupted run leaves no partial files and
+# rerunning skips every file whose result is newer than the WAV.
+FFT_SIZE = 1024
+SUMMARY_SECONDS = 1.0
+ENVELOPE_SECONDS = 0.05
+BLOCK_SECONDS = 30
+CLIP_LEVEL = 32767
+SUMMARY_FILENAME = 'summary.npz'
+
+def _result_path(path, input_dir, output_dir):
+    relative = os.path.relpath(path, input_dir)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + '.npz')
+
+def _is_done(path, result):
+    return os.path.exists(result) and os.path.getmtime(result) >= os.path.getmtime(path)
+
+# Function to analyse one WAV file; runs in a worker process
+def analyze_file(job):
+    path, result, settings = job
+    started = time.perf_counter()
+    samples, sample_rate = map_wav(path)
+    samples = samples[:, 0]  # First channel only, like FileSource
+    fft_size = settings['fft_size']
+    hop = fft_size // 2
+    stft = STFT(sample_rate, fft_size=fft_size, hop_size=hop)
+    bands, centres = band_matrix(stft.freqs, sample_rate)
+
+    envelope = max(int(ENVELOPE_SECONDS * sample_rate), 1)
+    frames_per_slice = max(int(settings['summary_seconds'] * sample_rate) // hop, 1)
+    # Blocks are whole envelope windows and whole hops so nothing straddles them
+    block = max(int(BLOCK_SECONDS * sample_rate) // (envelope * hop), 1) * envelope * hop
+
+    rms, peak, clips = [], [], []
+    slices, slice_bands = [], []
+    pending = np.zeros((0, stft.n_bins), dtype=np.float32)
+    sum_squares = 0.0
+    for start in range(0, len(samples), block):
+        chunk = np.asarray(samples[start:start + block])
+        whole = len(chunk) - len(chunk) % envelope
+        windows = chunk[:whole].reshape(-1, envelope).astype(np.float32)
+        if len(chunk) > whole:
+            windows = np.vstack((windows, np.pad(chunk[whole:], (0, envelope - len(chunk) + whole)).astype(np.float32)))
+        power = np.einsum('ij,ij->i', windows, windows)
+        sum_squares += float(power.sum())
+        rms.append(np.sqrt(power / envelope))
+        peak.append(np.abs(windows).max(axis=1))
+        clips.append((np.abs(windows) >= CLIP_LEVEL).sum(axis=1))
+
+        pending = np.concatenate((pending, stft.process(chunk)))
+        complete = len(pending) - len(pending) % frames_per_slice
+        if complete:
+            grouped = pending[:complete].reshape(-1, frames_per_slice, stft.n_bins)
+            slices.append(grouped.mean(axis=1))
+            slice_bands.append((grouped ** 2).mean(axis=1) @ bands)
+            pending = pending[complete:]
+    if len(pending):
+        slices.append(pending.mean(axis=0, keepdims=True))
+        slice_bands.append((pending ** 2).mean(axis=0, keepdims=True) @ bands)
+
+    def stack(parts, columns):
+        return np.concatenate(parts) if parts else np.zeros((0, columns), dtype=np.float32)
+
+    spectrogram = stack(slices, stft.n_bins)
+    clip_counts = np.concatenate(clips) if clips else np.zeros(0, dtype=np.int64)
+    peaks = np.concatenate(peak).astype(np.uint16) if peak else np.zeros(0, dtype=np.uint16)
+    os.makedirs(os.path.dirname(result), exist_ok=True)
+    temporary = result + '.tmp.npz'
+    np.savez_compressed(
+        temporary,
+        sample_rate=sample_rate,
+        samples=len(samples),
+        fft_size=fft_size,
+        summary_seconds=settings['summary_seconds'],
+        envelope_seconds=envelope / sample_rate,
+        freqs=stft.freqs.astype(np.float32),
+        band_centres=centres,
+        spectrogram=spectrogram.astype(np.float16),
+        band_energy=stack(slice_bands, len(centres)).astype(np.float32),
+        rms=np.concatenate(rms).astype(np.float32) if rms else np.zeros(0, dtype=np.float32),
+        peak=peaks,  # uint16, so a window that hit -32768 keeps its 32768
+        clip_counts=clip_counts.astype(np.uint32),
+        total_rms=(sum_squares / len(samples)) ** 0.5 if len(samples) else 0.0,
+        total_peak=int(peaks.max()) if len(peaks) else 0,
+        total_clipped=int(clip_counts.sum()),
+    )
+    os.replace(temporary, result)
+    return path, len(samples) / sample_rate, time.perf_counter() - started
+
+# Function to gather the per-file totals into one columnar summary
+def write_summary(results, output_dir):
+    columns = {'path': [], 'duration': [], 'rms': [], 'peak': [], 'clipped': []}
+    for path, result in results:
+        with np.load(result) as data:
+            columns['path'].append(path)
+            columns['duration'].append(int(data['samples']) / int(data['sample_rate']))
+            columns['rms'].append(float(data['total_rms']))
+            columns['peak'].append(int(data['total_peak']))
+            columns['clipped'].append(int(data['total_clipped']))
+    np.savez(os.path.join(output_dir, SUMMARY_FILENAME), **{k: np.array(v) for k, v in columns.items()})
+
+def find_wavs(directory):
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith('.wav'):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse a directory of WAV recordings in parallel.')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--fft-size', type=int, default=FFT_SIZE)
+    parser.add_argument('--summary-seconds', type=float, default=SUMMARY_SECONDS)
+    parser.add_argument('--force', action='store_true', help='redo files that already have results')
+    args = parser.parse_args()
+
+    settings = {'fft_size': args.fft_size, 'summary_seconds': args.summary_seconds}
+    paths = find_wavs(args.input_dir)
+    results = [(path, _result_path(path, args.input_dir, args.output_dir)) for path in paths]
+    jobs = [(path, result, settings) for path, result in results if args.force or not _is_done(path, result)]
+    # Largest first so one long file does not hold up the end of the run
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+    print(f"{len(paths)} files, {len(paths) - len(jobs)} already done, {len(jobs)} to analyse")
+
+    started = time.perf_counter()
+    audio_seconds = 0.0
+    with multiprocessing.Pool(args.workers) as pool:
+        for done, (path, duration, _) in enumerate(pool.imap_unordered(_analyze_or_skip, jobs), 1):
+            if duration is None:
+                continue
+            audio_seconds += duration
+            print(f"[{done}/{len(jobs)}] {path}: {duration:.1f} s of audio")
+    elapsed = time.perf_counter() - started
+    if jobs:
+        print(f"Analysed {audio_seconds:.0f} s of audio in {elapsed:.1f} s ({audio_seconds / max(elapsed, 1e-9):.0f}x real time)")
+    write_summary([(p, r) for p, r in results if os.path.exists(r)], args.output_dir)
+
+# Keeps one bad file from stopping the whole run
+def _analyze_or_skip(job):
+    try:
+        return analyze_file(job)
+    except (ValueError, OSError) as exc:
+        print(f"Skipping: {exc}")
+        return job[0], None, 0.0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import pty
+import socket
+import sys
+import tempfile
+import time
+import tty
+import numpy as np
+import serial
+from capture import CapturePipeline, FileSource, SerialSource, TCPSource, RawSamples
+from framing import FrameDecoder, encode_compressed_frame, encode_frame
+from audio_codecs import CODEC_ADPCM, CODEC_PACKED12, AdpcmEncoder, pack12
+from stft import STFT
+from features import FeatureExtractor
+from wavwriter import StreamingWavWriter
+import linuxcode
+
+# Benchmarks for the host capture paths.
+#
+# Each scenario starts a device emulator in a separate process, so its CPU is
+# not charged to the reader, and replays the byte format of the sketches
+# (raw little-endian int16 in 512-sample buffers, or FRAMED_OUTPUT packets)
+# over a pseudo-terminal or a local TCP socket. The samples are a 15-bit
+# ramp: the reader checks every value, so gaps give an exact dropped-sample
+# count, and the emulator logs when each buffer was sent, so the time a
+# sample arrives gives end-to-end latency.
+SAMPLE_RATE = 40000
+BLOCK_SAMPLES = 512
+DURATION = 5.0
+RAMP_MODULO = 1 << 15
+GRACE = 0.5  # Seconds the reader keeps going after the emulator is done
+RESULTS_FILE = 'bench_results.json'
+
+def ramp_block(block_number):
+    start = block_number * BLOCK_SAMPLES
+    return (np.arange(start, start + BLOCK_SAMPLES) % RAMP_MODULO).astype('<i2')
+
+# Emulators (run in child processes)
+
+def _paced_blocks(rate, duration, send_times):
+    started = time.monotonic()
+    total = len(send_times)
+    for block in range(total):
+        if rate:
+            delay = started + block * BLOCK_SAMPLES / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        elif time.monotonic() - started > duration:
+            return
+        send_times[block] = time.monotonic()
+        yield block
+
+def serial_emulator(fd, rate, duration, framed, send_times):
+    for block in _paced_blocks(rate, duration, send_times):
+        samples = ramp_block(block)
+        data = encode_frame(block, samples) if framed else samples.tobytes()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+def tcp_emulator(listener, rate, duration, send_times):
+    connection, _ = listener.accept()
+    with connection:
+        for block in _paced_blocks(rate, duration, send_times):
+            connection.sendall(ramp_block(block).tobytes())
+
+# Reader-side checks
+
+class RampChecker:
+    def __init__(self, send_times):
+        self.send_times = send_times
+        self.position = 0  # Absolute index of the next expected sample
+        self.samples = 0
+        self.dropped = 0
+        self.latencies = []
+        self.first_arrival = None
+        self.last_arrival = None
+        self._last = None
+        self._raw = RawSamples()
+
+    def write(self, samples):
+        now = time.monotonic()
+        if not isinstance(samples, np.ndarray):
+            samples = self._raw.convert(samples)
+        if not len(samples):
+            return
+        if self.first_arrival is None:
+            self.first_arrival = now
+        self.last_arrival = now
+        values = samples.astype(np.int32)
+        gaps = 0
+        if self._last is not None:
+            gaps += (int(values[0]) - self._last - 1) % RAMP_MODULO
+        gaps += int(((np.diff(values) - 1) % RAMP_MODULO).sum())
+        self._last = int(values[-1])
+        self.dropped += gaps
+        self.samples += len(samples)
+        self.position += len(samples) + gaps
+        block = (self.position - 1) // BLOCK_SAMPLES
+        if block < len(self.send_times) and self.send_times[block] > 0:
+            self.latencies.append(now - self.send_times[block])
+
+def _summary(name, checker, wall, cpu, **extra):
+    latencies = np.array(checker.latencies) * 1000 if checker.latencies else np.zeros(1)
+    # Rate over the time data was actually flowing, not the idle grace period
+    active = (checker.last_arrival or 0) - (checker.first_arrival or 0)
+    result = {
+        'scenario': name,
+        'samples': checker.samples,
+        'dropped_samples': checker.dropped,
+        'throughput_sps': checker.samples / active if active > 0 else 0.0,
+        'cpu_percent': 100 * cpu / wall,
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+        'latency_ms_p99': float(np.percentile(latencies, 99)),
+        'wall_seconds': wall,
+    }
+    result.update(extra)
+    return result
+
+def _send_times(rate, duration):
+    blocks = int(duration * (rate or 2_000_000) / BLOCK_SAMPLES) + 1
+    return multiprocessing.Array('d', blocks, lock=False)
+
+def _measure(name, run, checker, emulator):
+    emulator.start()
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    run()
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    emulator.join(GRACE)
+    if emulator.is_alive():
+        emulator.terminate()  # Still blocked writing to a reader that stopped
+        emulator.join()
+    return _summary(name, checker, wall, cpu)
+
+# Scenarios
+
+def _open_pty():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+def bench_serial(name, rate, duration, framed):
+    send_times = _send_times(rate, duration)
+    master, slave, port = _open_pty()
+    emulator = multiprocessing.Process(target=serial_emulator, args=(master, rate, duration, framed, send_times))
+    checker = RampChecker(send_times)
+    source = SerialSource(port, sample_rate=rate, block_size=4096, framed=framed, timeout=0.05)
+    pipeline = CapturePipeline(source, [checker])
+    try:
+        return _measure(name, lambda: pipeline.run(duration + GRACE), checker, emulator)
+    finally:
+        os.close(master)
+        os.close(slave)
+
+# The headless recorder in linuxcode.py, including its WAV writes
+def bench_linuxcode(name, rate, duration):
+    send_times = _send_times(rate, duration)
+    master, slave, port = _open_pty()
+    emulator = multiprocessing.Process(target=serial_emulator, args=(master, rate, duration, False, send_times))
+    checker = RampChecker(send_times)
+    ser = serial.Serial(port, timeout=linuxcode.read_timeout)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.wav')
+    writer = StreamingWavWriter(path, rate or SAMPLE_RATE)
+
+    class Tee:
+        def write(self, data):
+            writer.write(data)
+            checker.write(data)
+
+    try:
+        return _measure(name, lambda: linuxcode.record(ser, Tee(), duration=duration + GRACE), checker, emulator)
+    finally:
+        ser.close()
+        writer.close()
+        os.remove(path)
+        os.close(master)
+        os.close(slave)
+
+# The TCP receive path used by webaudio.py
+def bench_tcp(name, rate, duration):
+    send_times = _send_times(rate, duration)
+    listener = socket.create_server(('127.0.0.1', 0))
+    host, port = listener.getsockname()
+    emulator = multiprocessing.Process(target=tcp_emulator, args=(listener, rate, duration, send_times))
+    checker = RampChecker(send_times)
+    pipeline = CapturePipeline(TCPSource(host, port, rate, timeout=0.05), [checker])
+    try:
+        # Ends early when the emulator closes the socket
+        return _measure(name, lambda: pipeline.run(duration + GRACE), checker, emulator)
+    finally:
+        listener.close()
+
+# The spectrum update, fed as fast as it will go
+def bench_stft(name, rate, duration):
+    rate = rate or 44100
+    stft = STFT(rate, fft_size=1024, hop_size=512, averaging=0.5)
+    signal = (np.random.default_rng(0).normal(0, 3000, int(rate * duration))).astype(np.int16)
+    frames = 0
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    for start in range(0, len(signal), 1024):
+        frames += len(stft.process(signal[start:start + 1024]))
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    # The whole signal in one call must give every frame, not just the last batch
+    errors = []
+    one_call = STFT(rate, fft_size=1024, hop_size=512).process(signal)
+    reference = stft.analyze(signal)
+    if one_call.shape != reference.shape or not np.allclose(one_call, reference, atol=1e-3):
+        errors.append(f"one {len(signal)}-sample call gave {len(one_call)} frames, expected {len(reference)}")
+    return {
+        'scenario': name,
+        'samples': len(signal),
+        'throughput_sps': len(signal) / wall,
+        'realtime_factor': len(signal) / rate / wall,
+        'cpu_percent_of_realtime': 100 * cpu / duration,
+        'frames': frames,
+        'wall_seconds': wall,
+        'errors': errors,
+    }
+
+# Per-second band levels and loudness for `streams` devices in one process,
+# fed in capture-sized chunks; the filterbank matrix is shared by all of them
+def bench_features(name, rate, duration, streams=16):
+    rate = rate or SAMPLE_RATE
+    signal = (np.random.default_rng(0).normal(0, 3000, int(rate * duration))).astype(np.int16)
+    extractors = [FeatureExtractor(rate, fraction=3) for _ in range(streams)]
+    rows = 0
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    for start in range(0, len(signal), 1024):
+        for extractor in extractors:
+            rows += len(extractor.process(signal[start:start + 1024]))
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {
+        'scenario': name,
+        'samples': len(signal) * streams,
+        'streams': streams,
+        'rows': rows,
+        'throughput_sps': len(signal) * streams / wall,
+        'realtime_factor': len(signal) / rate / wall,
+        'cpu_percent_of_realtime': 100 * cpu / duration,
+        'wall_seconds': wall,
+    }
+
+# A recorded WAV replayed through the pipeline as fast as it will go: the
+# ceiling for any stage or sink measured behind a live source
+def bench_replay(name, rate, duration):
+    rate = rate or SAMPLE_RATE
+    blocks = int(rate * duration / BLOCK_SAMPLES)
+    path = os.path.join(tempfile.mkdtemp(), 'replay.wav')
+    with StreamingWavWriter(path, rate) as writer:
+        for block in range(blocks):
+            writer.write(ramp_block(block))
+    checker = RampChecker(np.zeros(0))
+    pipeline = CapturePipeline(FileSource(path, chunk_size=4096), [checker])
+    try:
+        wall_start = time.monotonic()
+        cpu_start = time.process_time()
+        pipeline.run()
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        os.remove(path)
+    return {
+        'scenario': name,
+        'samples': checker.samples,
+        'dropped_samples': checker.dropped,
+        'throughput_sps': checker.samples / wall,
+        'realtime_factor': checker.samples / rate / wall,
+        'cpu_percent_of_realtime': 100 * cpu / duration,
+        'wall_seconds': wall,
+    }
+
+# Decoding compressed frames, fed in serial-sized reads as fast as it will
+# go; `streams` decoders share the process like a multi-board capture
+def bench_codec(name, rate, duration, codec, streams=4):
+    rate = rate or SAMPLE_RATE
+    t = np.arange(int(rate * duration)) / rate
+    signal = (1500 * np.sin(2 * np.pi * 440 * t) + 2048 + np.random.default_rng(0).normal(0, 20, len(t))).astype(np.int16)
+    encoder = AdpcmEncoder()
+    frames = []
+    for block, start in enumerate(range(0, len(signal) - BLOCK_SAMPLES + 1, BLOCK_SAMPLES)):
+        samples = signal[start:start + BLOCK_SAMPLES]
+        payload = encoder.encode(samples) if codec == CODEC_ADPCM else pack12(samples)
+        frames.append(encode_compressed_frame(block, BLOCK_SAMPLES, codec, payload))
+    data = memoryview(b''.join(frames))
+    decoders = [FrameDecoder() for _ in range(streams)]
+    samples = 0
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    for offset in range(0, len(data), 4096):
+        for decoder in decoders:
+            samples += len(decoder.feed(data[offset:offset + 4096]))
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {
+        'scenario': name,
+        'samples': samples,
+        'streams': streams,
+        'throughput_sps': samples / wall,
+        'realtime_factor': samples / streams / rate / wall,
+        'cpu_percent_of_realtime': 100 * cpu / duration,
+        'bytes_per_sample': len(data) * streams / samples,
+        'wall_seconds': wall,
+    }
+
+SCENARIOS = {
+    'serial_raw': lambda rate, duration: bench_serial('serial_raw', rate, duration, False),
+    'serial_framed': lambda rate, duration: bench_serial('serial_framed', rate, duration, True),
+    'linuxcode': lambda rate, duration: bench_linuxcode('linuxcode', rate, duration),
+    'tcp': lambda rate, duration: bench_tcp('tcp', rate, duration),
+    'stft': lambda rate, duration: bench_stft('stft', rate, duration),
+    'features': lambda rate, duration: bench_features('features', rate, duration),
+    'replay': lambda rate, duration: bench_replay('replay', rate, duration),
+    'decode_packed12': lambda rate, duration: bench_codec('decode_packed12', rate, duration, CODEC_PACKED12),
+    'decode_adpcm': lambda rate, duration: bench_codec('decode_adpcm', rate, duration, CODEC_ADPCM),
+}
+
+# Function to list scenarios that got worse than a saved run.
+# Throughput may drop by at most `tolerance`; dropped samples may not rise.
+def compare(results, baseline, tolerance):
+    previous = {r['scenario']: r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+        if result['throughput_sps'] < old['throughput_sps'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: throughput {old['throughput_sps']:.0f} -> {result['throughput_sps']:.0f} samples/s")
+        if result.get('dropped_samples', 0) > old.get('dropped_samples', 0):
+            regressions.append(f"{result['scenario']}: dropped samples {old['dropped_samples']} -> {result['dropped_samples']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the serial, TCP and FFT paths against emulated boards.')
+    parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--rate', type=int, default=SAMPLE_RATE, help='emulated sample rate, 0 = unpaced')
+    parser.add_argument('--duration', type=float, default=DURATION)
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--compare', metavar='BASELINE', help='fail if results regress against this file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        result = SCENARIOS[name](args.rate, args.duration)
+        results.append(result)
+        print(json.dumps(result))
+
+    report = {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'rate': args.rate,
+        'duration': args.duration,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    failures = [f"{r['scenario']}: {error}" for r in results for error in r.get('errors', ())]
+    for line in failures:
+        print('FAILED', line)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        failures += regressions
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
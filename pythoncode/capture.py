@@ -0,0 +1,630 @@
+import argparse
+import os
+import queue
+import socket
+import threading
+import time
+import numpy as np
+from framing import FrameDecoder, FramedReader
+from wavwriter import StreamingWavWriter, map_wav
+from segment_store import SegmentStore, SegmentWriter
+from archive import ARCHIVE_SUFFIX, OVERFLOW_POLICIES, ArchiveReader, ArchiveSink
+from features import FeatureSink
+from metrics import Metrics, MetricsReporter
+from resample import AdaptiveResampler, RateEstimator
+from event_capture import DEFAULT_THRESHOLDS, EventRecorder, make_trigger
+
+# Headless capture engine: source -> stages -> sinks.
+#
+# A source's read() returns the next chunk of int16 samples (possibly empty)
+# or None at the end of the stream. Stages are callables that take a chunk
+# and return a chunk. Sinks are anything with a write(samples) method, such
+# as a RingBuffer; open() and close() are called when a sink has them.
+# Chunks may be views into a source's reusable buffer, so a sink that keeps
+# samples beyond its write() call must copy them.
+#
+# Only NumPy and the standard library are imported here. pyserial and
+# PyAudio are imported when a source or sink that needs them is opened, and
+# no GUI toolkit is ever imported, so this runs on machines without a display.
+#
+# Sources and sinks may also have stats() (counters such as overflows) and
+# sources backlog() (data waiting to be read); a pipeline given a Metrics
+# object reports them along with its stage timings.
+
+SAMPLE_WIDTH = 2
+
+_pyaudio = None
+_pyaudio_lock = threading.Lock()
+
+# Function to get the process-wide PyAudio instance, created on first use
+def get_pyaudio():
+    global _pyaudio
+    with _pyaudio_lock:
+        if _pyaudio is None:
+            import pyaudio
+            _pyaudio = pyaudio.PyAudio()
+        return _pyaudio
+
+def terminate_pyaudio():
+    global _pyaudio
+    with _pyaudio_lock:
+        if _pyaudio is not None:
+            _pyaudio.terminate()
+            _pyaudio = None
+
+# Turns raw bytes into int16 samples, holding an odd trailing byte until the
+# next read so sample alignment survives short reads
+class RawSamples:
+    def __init__(self):
+        self._carry = b''
+
+    def convert(self, data):
+        if self._carry:
+            data = self._carry + data
+        usable = len(data) - len(data) % SAMPLE_WIDTH
+        self._carry = bytes(data[usable:])
+        return np.frombuffer(data, dtype='<i2', count=usable // SAMPLE_WIDTH)
+
+# Sources
+
+class SerialSource:
+    def __init__(self, port, baudrate=115200, sample_rate=44100, block_size=1024, framed=False, timeout=0.1):
+        self.port = port
+        self.baudrate = baudrate
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.framed = framed
+        self.timeout = timeout
+        self.serial = None
+        self._reader = None
+        self._raw = RawSamples()
+        self.bytes_read = 0
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    def open(self):
+        if self.is_open:
+            return
+        import serial
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+        self._reader = FramedReader(self.serial, self.block_size) if self.framed else None
+        self._raw = RawSamples()
+
+    def read(self):
+        if self._reader:
+            return self._reader.read()
+        data = self.serial.read(self.block_size)
+        self.bytes_read += len(data)
+        return self._raw.convert(data)
+
+    # Bytes the OS has received that we have not read yet
+    def backlog(self):
+        return self.serial.in_waiting if self.is_open else 0
+
+    def stats(self):
+        if self._reader:
+            return self._reader.decoder.stats()
+        return {'bytes_read': self.bytes_read}
+
+    # Function to send a command byte such as b'R' or b'S' to the sketch
+    def send(self, data):
+        self.open()
+        self.serial.write(data)
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+class TCPSource:
+    def __init__(self, host, port, sample_rate=40000, recv_size=512 * 2 * 16, timeout=0.5, framed=False,
+                 connect_timeout=5.0):
+        self.host = host
+        self.port = port
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout  # An unreachable board fails after this instead of the OS timeout
+        self.framed = framed
+        self._decoder = None
+        self.socket = None
+        self._buffer = bytearray(recv_size)
+        self._view = memoryview(self._buffer)
+        self._raw = RawSamples()
+
+    def open(self):
+        self.socket = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        self.socket.settimeout(self.timeout)
+        self._raw = RawSamples()
+        self._decoder = FrameDecoder() if self.framed else None
+
+    def read(self):
+        try:
+            received = self.socket.recv_into(self._buffer)
+        except socket.timeout:
+            return self._raw.convert(b'')
+        if not received:
+            return None
+        if self._decoder:
+            return self._decoder.feed(self._view[:received])
+        # A view into the reusable buffer, valid until the next read
+        return self._raw.convert(self._view[:received])
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+# Records in PyAudio's callback mode: PortAudio's thread only queues each
+# buffer, so a slow sink delays the capture thread rather than the device,
+# and the callback's status flags tell us about input overflows, which
+# blocking reads hide.
+class PyAudioSource:
+    def __init__(self, sample_rate=44100, frames_per_buffer=1024, device_index=None, max_buffers=64):
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.device_index = device_index
+        self.stream = None
+        self.overflows = 0        # PortAudio lost input before our callback ran
+        self.buffers_dropped = 0  # The queue was full because the reader fell behind
+        self._queue = queue.Queue(max_buffers)
+
+    def open(self):
+        import pyaudio
+        self._overflow_flag = pyaudio.paInputOverflow
+        self._continue = pyaudio.paContinue
+        self._queue = queue.Queue(self._queue.maxsize)
+        self.stream = get_pyaudio().open(format=pyaudio.paInt16, channels=1, rate=self.sample_rate,
+                                         input=True, input_device_index=self.device_index,
+                                         frames_per_buffer=self.frames_per_buffer,
+                                         stream_callback=self._callback)
+
+    # Runs on PortAudio's thread
+    def _callback(self, data, frame_count, time_info, status):
+        if status & self._overflow_flag:
+            self.overflows += 1
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self.buffers_dropped += 1
+        return None, self._continue
+
+    def read(self):
+        try:
+            data = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return np.zeros(0, dtype=np.int16)
+        return np.frombuffer(data, dtype='<i2')
+
+    # Samples queued by the callback and not read yet
+    def backlog(self):
+        return self._queue.qsize() * self.frames_per_buffer
+
+    def stats(self):
+        return {'overflows': self.overflows, 'dropped_buffers': self.buffers_dropped}
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+# Replays a WAV file, an archive or a SegmentWriter directory, through the same chunked
+# path as the live sources, e.g. to rerun the analyzers on yesterday's
+# recording or to reproduce a glitch sample for sample. The file is
+# memory-mapped (map_wav, SegmentStore), or for archives only the blocks
+# read are decompressed, and WAV chunks are read-only views of the file. speed paces the chunks
+# against the clock like a board would deliver them: 1.0 is real time, 8 is
+# eight times faster, None is as fast as the pipeline takes them, which is
+# the throughput ceiling of the stages and sinks behind it.
+class FileSource:
+    def __init__(self, path, chunk_size=1024, speed=None, start=0.0, duration=None, channel=0, loop=False):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.start = start        # Seconds into the file
+        self.duration = duration  # Seconds to replay, None for the rest of the file
+        self.channel = channel    # Multichannel files replay one channel
+        self.loop = loop
+        self.sample_rate = None
+        self.channels = None
+        self.position = 0  # Next sample to be read
+        self.sent = 0      # Samples returned, counting every loop
+        self.late = 0.0    # Longest the pipeline has been behind the pacing, in seconds
+        self._read_range = None
+        self._first = self._end = 0
+        self._started = None
+
+    def open(self):
+        if self._read_range is not None:
+            return
+        if os.path.isdir(self.path):
+            store = SegmentStore(self.path)
+            self.sample_rate, self.channels, total = store.sample_rate, store.channels, store.total_samples
+            self._read_range = store.read
+        elif self.path.endswith(ARCHIVE_SUFFIX):
+            reader = ArchiveReader(self.path)
+            self.sample_rate, self.channels, total = reader.sample_rate, reader.channels, reader.total_samples
+            self._read_range = reader.read
+        else:
+            samples, self.sample_rate = map_wav(self.path)
+            self.channels, total = samples.shape[1], len(samples)
+            self._read_range = lambda first, count: samples[first:first + count]
+        if self.channel >= self.channels:
+            raise ValueError(f"{self.path}: no channel {self.channel} in {self.channels}")
+        self._first = min(int(self.start * self.sample_rate), total)
+        self._end = total if self.duration is None else min(self._first + int(self.duration * self.sample_rate), total)
+        self.position = self._first
+        self.sent = 0
+        self.late = 0.0
+
+    def read(self):
+        if self.position >= self._end:
+            if not self.loop or self._end == self._first:
+                return None
+            self.position = self._first
+        count = min(self.chunk_size, self._end - self.position)
+        samples = np.asarray(self._read_range(self.position, count))
+        if samples.ndim > 1:
+            samples = np.ascontiguousarray(samples[:, self.channel])
+        self.position += count
+        if self.speed:
+            # A chunk is ready once its last sample would have arrived
+            if self._started is None:
+                self._started = time.monotonic()
+            delay = self._started + (self.sent + count) / (self.sample_rate * self.speed) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late = max(self.late, -delay)
+        self.sent += count
+        return samples
+
+    # Samples the pacing has made available but the pipeline has not read
+    def backlog(self):
+        if not self.speed or self._started is None:
+            return 0
+        due = (time.monotonic() - self._started) * self.sample_rate * self.speed
+        return max(int(due) - self.sent, 0)
+
+    def stats(self):
+        return {
+            'position_seconds': self.position / self.sample_rate if self.sample_rate else 0.0,
+            'late_ms': self.late * 1000,
+        }
+
+    def close(self):
+        self._read_range = None
+        self._started = None
+
+# Sinks
+
+# With a RateEstimator, the header gets the measured rate instead of the
+# nominal one, updated about once a second. The sink only reads the
+# estimator; pass it to the pipeline as a stage too so it is fed.
+class WavSink:
+    def __init__(self, path, sample_rate, rate_estimator=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.rate_estimator = rate_estimator
+        self.writer = None
+        self._since_update = 0
+
+    def open(self):
+        self.writer = StreamingWavWriter(self.path, self.sample_rate)
+
+    def write(self, samples):
+        self.writer.write(samples)
+        if self.rate_estimator:
+            self._since_update += len(samples)
+            if self._since_update >= self.writer.sample_rate:
+                self._since_update = 0
+                self._update_rate()
+
+    def _update_rate(self):
+        rate = self.rate_estimator.estimate()
+        if rate:
+            self.writer.sample_rate = int(round(rate))
+
+    def close(self):
+        if self.writer is not None:
+            if self.rate_estimator:
+                self._update_rate()
+            self.writer.close()
+            self.writer = None
+
+class PyAudioSink:
+    def __init__(self, sample_rate=44100):
+        self.sample_rate = sample_rate
+        self.stream = None
+        self.underflows = 0  # The device ran dry before a write
+
+    def open(self):
+        import pyaudio
+        self._underflow_code = pyaudio.paOutputUnderflowed
+        self.stream = get_pyaudio().open(format=pyaudio.paInt16, channels=1,
+                                         rate=self.sample_rate, output=True)
+
+    def write(self, samples):
+        # PortAudio reports an underflow after it has played the data, so
+        # catching it only counts the glitch, nothing is lost
+        try:
+            self.stream.write(samples.tobytes(), exception_on_underflow=True)
+        except OSError as exc:
+            if exc.args[-1] != self._underflow_code:
+                raise
+            self.underflows += 1
+
+    def stats(self):
+        return {'underflows': self.underflows}
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+# on_spectrum gets the display spectrum after each chunk that completed a
+# frame; on_frames gets every completed frame, e.g. for a Waterfall
+class AnalyzerSink:
+    def __init__(self, stft, on_spectrum=None, on_frames=None):
+        self.stft = stft
+        self.on_spectrum = on_spectrum
+        self.on_frames = on_frames
+
+    def open(self):
+        self.stft.reset()
+
+    def write(self, samples):
+        frames = self.stft.process(samples)
+        if not len(frames):
+            return
+        if self.on_frames:
+            self.on_frames(frames)
+        if self.on_spectrum:
+            self.on_spectrum(self.stft.current)
+
+class CallbackSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, samples):
+        self.callback(samples)
+
+# Pipeline
+
+def _name(thing):
+    return getattr(thing, '__name__', type(thing).__name__)
+
+class CapturePipeline:
+    def __init__(self, source, sinks=(), stages=(), on_finished=None, metrics=None):
+        self.source = source
+        self.sinks = list(sinks)
+        self.stages = list(stages)
+        self.on_finished = on_finished  # Called from the capture thread at the end
+        self.metrics = metrics  # Optional Metrics; None runs the uninstrumented loop
+        self.running = False
+        self.samples_captured = 0
+        self.chunks_captured = 0
+        self.error = None
+        self._thread = None
+
+    # Opens everything in the calling thread, so a missing port or device is
+    # reported to the caller, then captures on a background thread
+    def start(self):
+        self._open()
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    # Captures in the calling thread until the source ends, stop() is called
+    # or the duration (seconds) has passed
+    def run(self, duration=None):
+        self._open()
+        self.running = True
+        if duration is not None:
+            timer = threading.Timer(duration, self.stop, kwargs={'join': False})
+            timer.daemon = True
+            timer.start()
+        self._loop()
+
+    def stop(self, join=True):
+        self.running = False
+        if join and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    # If a sink fails to open, whatever did open is closed again before the
+    # error reaches the caller, so the port or device is free for a retry
+    def _open(self):
+        self.source.open()
+        opened = []
+        try:
+            for sink in self.sinks:
+                if hasattr(sink, 'open'):
+                    sink.open()
+                opened.append(sink)
+        except Exception:
+            for sink in opened:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            self.source.close()
+            raise
+
+    def _loop(self):
+        try:
+            if self.metrics is None:
+                self._capture()
+            else:
+                self._capture_instrumented()
+        except Exception as exc:
+            self.error = exc
+            raise
+        finally:
+            self.running = False
+            self.source.close()
+            for sink in self.sinks:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            if self.on_finished:
+                self.on_finished(self)
+
+    def _capture(self):
+        while self.running:
+            samples = self.source.read()
+            if samples is None:
+                break
+            for stage in self.stages:
+                samples = stage(samples)
+            if not len(samples):
+                continue
+            self.samples_captured += len(samples)
+            self.chunks_captured += 1
+            for sink in self.sinks:
+                sink.write(samples)
+
+    # Same loop, timing the read (including its wait), every stage and every
+    # sink, and sampling the source's backlog once per chunk
+    def _capture_instrumented(self):
+        metrics = self.metrics
+        clock = time.perf_counter
+        read_timer = metrics.timer('source.read')
+        stages = [(stage, metrics.timer('stage.' + _name(stage))) for stage in self.stages]
+        sinks = [(sink, metrics.timer('sink.' + _name(sink))) for sink in self.sinks]
+        chunk_timer = metrics.timer('chunk')
+        samples_rate = metrics.rate('samples')
+        backlog = getattr(self.source, 'backlog', None)
+        metrics.watch('source', self.source)
+        for sink in self.sinks:
+            metrics.watch(_name(sink), sink)
+        while self.running:
+            started = clock()
+            samples = self.source.read()
+            read_done = clock()
+            read_timer.record(read_done - started)
+            if samples is None:
+                break
+            for stage, timer in stages:
+                stage_started = clock()
+                samples = stage(samples)
+                timer.record(clock() - stage_started)
+            if backlog:
+                metrics.gauge('source.backlog', backlog())
+            if not len(samples):
+                metrics.count('empty_reads')
+                continue
+            self.samples_captured += len(samples)
+            self.chunks_captured += 1
+            samples_rate.add(len(samples))
+            for sink, timer in sinks:
+                sink_started = clock()
+                sink.write(samples)
+                timer.record(clock() - sink_started)
+            chunk_timer.record(clock() - read_done)  # Processing time, excluding the wait
+
+def make_source(kind, target, args):
+    if kind == 'serial':
+        return SerialSource(target, args.baud, args.rate, framed=args.framed)
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        return TCPSource(host, int(port), args.rate, framed=args.framed)
+    if kind == 'pyaudio':
+        return PyAudioSource(args.rate)
+    if kind == 'file':
+        return FileSource(target, speed=args.replay_speed, start=args.replay_start)
+    raise ValueError(f"unknown source {kind}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless audio capture.')
+    parser.add_argument('source', choices=['serial', 'tcp', 'pyaudio', 'file'])
+    parser.add_argument('target', nargs='?', default='', help='serial port, host:port, WAV or archive path, or segment directory')
+    parser.add_argument('--replay-speed', type=float, metavar='N',
+                        help='replay a file at N times real time (default: as fast as possible)')
+    parser.add_argument('--replay-start', type=float, default=0.0, metavar='SECONDS', help='replay a file from here')
+    parser.add_argument('--wav', default='recorded_audio.wav', help='output WAV file')
+    parser.add_argument('--segments', metavar='DIR', help='write rotating segments to DIR instead of one WAV')
+    parser.add_argument('--segment-seconds', type=float, default=600)
+    parser.add_argument('--archive', metavar='FILE', help=f'write a compressed archive ({ARCHIVE_SUFFIX}) instead of one WAV')
+    parser.add_argument('--archive-codec', choices=['zlib', 'lzma'], default='zlib')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='drop_newest',
+                        help='what the archive writer does when the disk falls behind')
+    parser.add_argument('--events', metavar='DIR', help='write only triggered events to DIR instead of one WAV')
+    parser.add_argument('--trigger', choices=sorted(DEFAULT_THRESHOLDS), default='rms')
+    parser.add_argument('--threshold', type=float,
+                        help='dBFS for rms/peak/band, multiple of the running average for flux')
+    parser.add_argument('--band', type=float, nargs=2, metavar=('LOW', 'HIGH'), default=(300, 3000))
+    parser.add_argument('--pre-roll', type=float, default=1.0)
+    parser.add_argument('--post-roll', type=float, default=2.0)
+    parser.add_argument('--features', metavar='FILE', help='also log per-second band levels, loudness and dominant frequency')
+    parser.add_argument('--third-octave', action='store_true', help='third-octave instead of octave bands in --features')
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--framed', action='store_true')
+    parser.add_argument('--duration', type=float)
+    parser.add_argument('--measure-rate', action='store_true',
+                        help='write the measured incoming rate to the WAV header instead of --rate')
+    parser.add_argument('--resample-to', type=int, metavar='RATE',
+                        help='resample from the measured incoming rate to RATE')
+    parser.add_argument('--metrics', nargs='?', const='-', metavar='FILE',
+                        help='append a JSON stats line every --metrics-interval seconds (to stderr without FILE)')
+    parser.add_argument('--metrics-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    source = make_source(args.source, args.target, args)
+    if args.source == 'file':
+        source.open()  # The output rate comes from the input file
+    stages = []
+    estimator = None
+    output_rate = source.sample_rate
+    if args.resample_to:
+        stages.append(AdaptiveResampler(source.sample_rate, args.resample_to, RateEstimator()))
+        output_rate = args.resample_to
+    elif args.measure_rate:
+        estimator = RateEstimator()
+        stages.append(estimator)
+    if args.events:
+        trigger = make_trigger(args.trigger, output_rate, args.threshold, args.band)
+        sink = EventRecorder(args.events, output_rate, trigger, args.pre_roll, args.post_roll)
+    elif args.segments:
+        sink = SegmentWriter(args.segments, output_rate, args.segment_seconds)
+    elif args.archive:
+        sink = ArchiveSink(args.archive, output_rate, codec=args.archive_codec, overflow=args.overflow)
+    else:
+        sink = WavSink(args.wav, output_rate, estimator)
+    metrics = reporter = None
+    if args.metrics:
+        metrics = Metrics(args.source)
+        reporter = MetricsReporter(metrics, None if args.metrics == '-' else args.metrics, args.metrics_interval)
+        reporter.start()
+    sinks = [sink]
+    if args.features:
+        sinks.append(FeatureSink(args.features, output_rate, fraction=3 if args.third_octave else 1, source=args.target))
+    pipeline = CapturePipeline(source, sinks, stages, metrics=metrics)
+    started = time.monotonic()
+    try:
+        pipeline.run(args.duration)
+    except KeyboardInterrupt:
+        pipeline.stop(join=False)
+    finally:
+        terminate_pyaudio()
+        if reporter:
+            reporter.stop()
+    elapsed = time.monotonic() - started
+    print(f"Captured {pipeline.samples_captured} samples in {elapsed:.1f} s to {args.events or args.segments or args.archive or args.wav}")
+    if args.source == 'file' and elapsed > 0:
+        print(f"Replayed at {pipeline.samples_captured / source.sample_rate / elapsed:.1f}x real time"
+              + (f", up to {source.late * 1000:.0f} ms behind" if args.replay_speed else ''))
+    if args.events:
+        stats = sink.stats()
+        print(f"{stats['events']} events, {stats['kept_fraction']:.1%} of the audio kept")
+    elif args.archive:
+        stats = sink.stats()
+        print(f"Compressed {stats['compression_ratio']:.2f}x, {stats['dropped_blocks']} blocks dropped, "
+              f"writer queue peaked at {stats['max_queued_blocks']} blocks")
+    for stage in stages:
+        rate = stage.stats()['measured_rate']
+        print(f"Measured input rate: {rate:.1f} samples/s" if rate else "Measured input rate: not enough data")
+
+if __name__ == '__main__':
+    main()
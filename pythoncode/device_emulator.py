@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import numpy as np
+
+# Local stand-in for the ESP32 TCP sketch: every connection receives the raw
+# little-endian int16 stream in 512-sample buffers, paced to the sample rate.
+SAMPLE_RATE = 40000
+BUFFER_SIZE = 512
+TONE_SECONDS = 1  # Length of the precomputed signal that is sent in a loop
+
+def make_signal(frequency, sample_rate=SAMPLE_RATE):
+    t = np.arange(TONE_SECONDS * sample_rate) / sample_rate
+    noise = np.random.default_rng(int(frequency)).normal(0, 200, len(t))
+    return (8000 * np.sin(2 * np.pi * frequency * t) + noise).astype('<i2').tobytes()
+
+class EmulatedDevice:
+    def __init__(self, port, frequency, sample_rate=SAMPLE_RATE, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+        self.sample_rate = sample_rate
+        self.signal = make_signal(frequency, sample_rate)
+        self.bytes_sent = 0
+
+    async def start(self):
+        return await asyncio.start_server(self._stream, self.host, self.port)
+
+    async def _stream(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        view = memoryview(self.signal)
+        block = BUFFER_SIZE * 2
+        started = loop.time()
+        sent_samples = 0
+        offset = 0
+        try:
+            while True:
+                if offset + block > len(view):
+                    offset = 0
+                writer.write(view[offset:offset + block])
+                offset += block
+                sent_samples += BUFFER_SIZE
+                self.bytes_sent += block
+                await writer.drain()
+                # Pace against the start time so sleep jitter does not drift
+                delay = started + sent_samples / self.sample_rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+async def run(count, base_port, sample_rate, host):
+    devices = [EmulatedDevice(base_port + i, 200 + 10 * i, sample_rate, host) for i in range(count)]
+    servers = [await device.start() for device in devices]
+    print(f"Emulating {count} devices on {host}:{base_port}-{base_port + count - 1}")
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        for server in servers:
+            server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate ESP32 boards streaming int16 audio over TCP.')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--base-port', type=int, default=9000)
+    parser.add_argument('--rate', type=int, default=SAMPLE_RATE)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.count, args.base_port, args.rate, args.host))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from ringbuffer import RingBuffer
+from stft import STFT
+from wavwriter import StreamingWavWriter
+
+# Triggered event capture for always-on boards.
+#
+# EventRecorder is a capture sink that keeps the last pre_roll seconds in a
+# RingBuffer and writes nothing until its trigger fires. The event file then
+# gets that pre-roll, everything while the trigger keeps firing, and
+# post_roll seconds after it last fired. events.json lists every event with
+# its wall-clock start, absolute sample offset, trigger position and level,
+# and peak/RMS, like the index SegmentWriter keeps.
+#
+# Triggers are evaluated once per chunk and return a level compared against
+# their threshold:
+#
+#   LevelTrigger  RMS or peak of the chunk, in dBFS, after removing the
+#                 ADC's DC offset (a running mean over about DC_SECONDS;
+#                 the sketches send unsigned counts centred near 512 or
+#                 2048, which alone would read louder than the threshold)
+#   BandTrigger   energy between two frequencies, in dBFS (a full-scale
+#                 sine in the band reads 0 dB), from an STFT
+#   FluxTrigger   spectral flux (how much the spectrum rose since the
+#                 previous frame) as a multiple of its running average,
+#                 so onsets fire whatever the background level
+EVENTS_FILENAME = 'events.json'
+PRE_ROLL = 1.0            # Seconds kept before the trigger
+POST_ROLL = 2.0           # Seconds recorded after the trigger stops firing
+MAX_EVENT_SECONDS = 300   # Longer events are split
+FULL_SCALE = 32768.0
+DC_SECONDS = 1.0          # Time constant of LevelTrigger's DC offset estimate
+DEFAULT_THRESHOLDS = {'rms': -35.0, 'peak': -20.0, 'band': -40.0, 'flux': 3.0}
+
+def _db(value):
+    return 20 * np.log10(max(value, 1e-9) / FULL_SCALE)
+
+class LevelTrigger:
+    def __init__(self, threshold=DEFAULT_THRESHOLDS['rms'], mode='rms', sample_rate=44100):
+        if mode not in ('rms', 'peak'):
+            raise ValueError(f"unknown level mode {mode}")
+        self.threshold = threshold
+        self.name = mode
+        self.sample_rate = sample_rate
+        self._dc = None
+
+    def level(self, samples):
+        if not len(samples):
+            return -np.inf
+        as_float = samples.astype(np.float32)
+        mean = float(as_float.mean())
+        if self._dc is None:
+            self._dc = mean
+        else:
+            self._dc += (1 - np.exp(-len(samples) / (DC_SECONDS * self.sample_rate))) * (mean - self._dc)
+        as_float -= self._dc
+        if self.name == 'peak':
+            return _db(float(np.abs(as_float).max()))
+        return _db(np.sqrt(np.dot(as_float, as_float) / len(as_float)))
+
+class BandTrigger:
+    def __init__(self, sample_rate, low, high, threshold=DEFAULT_THRESHOLDS['band'], fft_size=1024):
+        self.threshold = threshold
+        self.name = 'band'
+        self.stft = STFT(sample_rate, fft_size)
+        self._bins = slice(int(np.searchsorted(self.stft.freqs, low)), int(np.searchsorted(self.stft.freqs, high, 'right')))
+        self._level = -np.inf  # Held until the next frame completes
+
+    def level(self, samples):
+        frames = self.stft.process(samples)
+        if len(frames):
+            band = frames[:, self._bins]
+            power = np.einsum('ij,ij->i', band, band).max()
+            self._level = 10 * np.log10(max(float(power), 1e-18) / FULL_SCALE ** 2)
+        return self._level
+
+class FluxTrigger:
+    def __init__(self, sample_rate, threshold=DEFAULT_THRESHOLDS['flux'], fft_size=1024, adapt=0.05, min_flux=0.1):
+        self.threshold = threshold
+        self.name = 'flux'
+        self.adapt = adapt        # Weight of each frame in the running average
+        self.min_flux = min_flux  # Floor for the average, so faint noise does not fire
+        self.stft = STFT(sample_rate, fft_size)
+        self._previous = None
+        self._average = min_flux
+        self._level = 0.0
+
+    def level(self, samples):
+        frames = self.stft.process(samples)
+        if not len(frames):
+            return self._level
+        logs = np.log1p(frames)
+        if self._previous is None:
+            self._previous = logs[0].copy()
+        rises = np.diff(logs, axis=0, prepend=self._previous[None])
+        flux = np.maximum(rises, 0).mean(axis=1)
+        self._previous[:] = logs[-1]
+        level = 0.0
+        for value in flux:
+            level = max(level, value / max(self._average, self.min_flux))
+            self._average += self.adapt * (value - self._average)
+        self._level = level
+        return level
+
+# Function to build a trigger from command-line style settings
+def make_trigger(kind, sample_rate, threshold=None, band=(300, 3000)):
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLDS[kind]
+    if kind in ('rms', 'peak'):
+        return LevelTrigger(threshold, kind, sample_rate)
+    if kind == 'band':
+        return BandTrigger(sample_rate, band[0], band[1], threshold)
+    if kind == 'flux':
+        return FluxTrigger(sample_rate, threshold)
+    raise ValueError(f"unknown trigger {kind}")
+
+def load_events(directory):
+    path = os.path.join(directory, EVENTS_FILENAME)
+    if not os.path.exists(path):
+        return {'events': []}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_events(directory, index):
+    path = os.path.join(directory, EVENTS_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+class EventRecorder:
+    def __init__(self, directory, sample_rate, trigger, pre_roll=PRE_ROLL, post_roll=POST_ROLL,
+                 max_event_seconds=MAX_EVENT_SECONDS, prefix='event'):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.trigger = trigger
+        self.prefix = prefix
+        self.pre_samples = int(pre_roll * sample_rate)
+        self.post_samples = int(post_roll * sample_rate)
+        self.max_samples = int(max_event_seconds * sample_rate)
+        self.history = RingBuffer(max(self.pre_samples, 1))
+        self.index = None
+        self.position = 0        # Absolute offset of the next sample received
+        self.samples_written = 0
+        self.last_level = -np.inf
+        self._writer = None
+        self._entry = None
+        self._quiet = 0          # Samples since the trigger last fired
+        self._last_end = 0       # Pre-roll never reaches back into the previous event
+        self._sum_squares = 0.0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = load_events(self.directory)
+        self.index['sample_rate'] = self.sample_rate
+
+    @property
+    def in_event(self):
+        return self._writer is not None
+
+    def write(self, samples):
+        level = self.trigger.level(samples)
+        fired = level >= self.trigger.threshold
+        self.last_level = level
+        if self._writer is None and fired:
+            self._start_event(level, len(samples))
+        if self._writer is not None:
+            self._write_event(samples)
+            if fired:
+                self._quiet = 0
+                self._entry['trigger_level'] = max(self._entry['trigger_level'], float(level))
+            else:
+                self._quiet += len(samples)
+        self.history.write(samples)
+        self.position += len(samples)
+        if self._writer is not None and (self._quiet >= self.post_samples or self._entry['samples'] >= self.max_samples):
+            self._finish_event()
+
+    def close(self):
+        if self._writer is not None:
+            self._finish_event()
+
+    def _start_event(self, level, chunk):
+        pre = self.history.latest(min(len(self.history), self.pre_samples, self.position - self._last_end))
+        now = time.time()
+        number = len(self.index['events'])
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(now))
+        filename = f"{self.prefix}_{stamp}_{number:06d}.wav"
+        self._writer = StreamingWavWriter(os.path.join(self.directory, filename), self.sample_rate)
+        self._entry = {
+            'file': filename,
+            'start_time': now - (len(pre) + chunk) / self.sample_rate,  # The chunk arrived just now
+            'start_sample': self.position - len(pre),
+            'samples': 0,
+            'trigger_offset': len(pre),  # Samples of pre-roll before the trigger
+            'trigger': self.trigger.name,
+            'trigger_level': float(level),
+            'peak': 0,
+            'rms': 0.0,
+        }
+        self._quiet = 0
+        self._sum_squares = 0.0
+        self.index['events'].append(self._entry)
+        _save_events(self.directory, self.index)
+        self._write_event(pre)
+
+    def _write_event(self, samples):
+        if not len(samples):
+            return
+        self._writer.write(samples)
+        self.samples_written += len(samples)
+        self._entry['samples'] += len(samples)
+        peak = max(int(samples.max()), -int(samples.min()))
+        self._entry['peak'] = max(self._entry['peak'], peak)
+        as_float = samples.astype(np.float32)
+        self._sum_squares += float(np.dot(as_float, as_float))
+
+    def _finish_event(self):
+        self._writer.close()
+        self._writer = None
+        if self._entry['samples']:
+            self._entry['rms'] = (self._sum_squares / self._entry['samples']) ** 0.5
+        _save_events(self.directory, self.index)
+        self._entry = None
+        self._last_end = self.position
+
+    def stats(self):
+        return {
+            'events': len(self.index['events']) if self.index else 0,
+            'in_event': self.in_event,
+            'level': float(self.last_level),
+            'kept_fraction': self.samples_written / self.position if self.position else 0.0,
+        }
+
+# Function to list the events recorded in a directory
+def main():
+    parser = argparse.ArgumentParser(description='List the events in an event capture directory.')
+    parser.add_argument('directory')
+    args = parser.parse_args()
+    index = load_events(args.directory)
+    rate = index.get('sample_rate', 0) or 1
+    for event in index['events']:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['start_time']))
+        print(f"{stamp}  {event['samples'] / rate:7.2f} s  {event['trigger']} {event['trigger_level']:6.1f}  "
+              f"peak {event['peak']:5d}  rms {event['rms']:7.1f}  {event['file']}")
+
+if __name__ == '__main__':
+    main()
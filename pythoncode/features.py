@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from stft import STFT
+from wavwriter import map_wav
+
+# Streaming band levels, loudness and dominant frequency, one row per
+# interval (a second by default), for ingest hosts that keep features
+# rather than audio.
+#
+# Every feature is linear in the power spectrum, so all of them come from
+# one (bins, columns) matrix: a column per octave or third-octave band, an
+# A-weighted column and an unweighted one, each scaled so a full-scale sine
+# reads 0 dBFS. The matrix is built once per (sample rate, FFT size, band
+# fraction) and shared by every stream in the process. Each stream only adds
+# up the power spectra of its STFT frames; the intervals a batch of samples
+# completes then go through the matrix in a single multiply, and the
+# dominant frequency is the interpolated peak of the same summed spectrum.
+#
+# The ADCs' DC offset is tracked from chunk means (over about DC_SECONDS)
+# and subtracted before the STFT, so it neither inflates the levels nor
+# wins the dominant frequency. Levels are in dBFS; calibration (dB) shifts them to dB SPL for a
+# measured microphone. Rows are appended to a FeatureLog: a JSON header
+# line, then fixed-size little-endian records (time float64, then one
+# float32 per column), about 60 bytes per second per device for octaves.
+FFT_SIZE = 1024
+INTERVAL_SECONDS = 1.0
+FULL_SCALE = 32768.0
+FLOOR_DB = -120.0
+DC_SECONDS = 1.0  # Time constant of the DC offset estimate
+OCTAVE_CENTRES = [31.5, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000]
+THIRD_OCTAVE_CENTRES = [25, 31.5, 40, 50, 63, 80, 100, 125, 160, 200, 250, 315, 400, 500, 630, 800, 1000,
+                        1250, 1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000, 10000, 12500, 16000, 20000]
+LOG_FORMAT = 'audio-features'
+LOG_SUFFIX = '.feat'
+
+_matrix_cache = {}
+
+# Function to build the (bins, bands) matrix that sums power into octave
+# (fraction=1) or third-octave (fraction=3) bands below Nyquist
+def band_matrix(freqs, sample_rate, fraction=1):
+    nominal = OCTAVE_CENTRES if fraction == 1 else THIRD_OCTAVE_CENTRES
+    half_band = 2 ** (1 / (2 * fraction))
+    centres = [c for c in nominal if c * half_band <= sample_rate / 2]
+    matrix = np.zeros((len(freqs), len(centres)), dtype=np.float32)
+    for band, centre in enumerate(centres):
+        matrix[(freqs >= centre / half_band) & (freqs < centre * half_band), band] = 1
+    return matrix, np.array(centres, dtype=np.float32)
+
+# Function to get the A-weighting (IEC 61672) of each frequency, in dB
+def a_weighting(freqs):
+    f2 = np.asarray(freqs, dtype=np.float64) ** 2
+    response = (12194 ** 2 * f2 ** 2) / ((f2 + 20.6 ** 2) * np.sqrt((f2 + 107.7 ** 2) * (f2 + 737.9 ** 2)) * (f2 + 12194 ** 2))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(response) + 2.0
+
+# Function to get the shared feature matrix for a stream setup. Returns
+# (matrix, band centres); the columns are the bands, then A-weighted, then
+# unweighted total power. Bands too narrow to hold an FFT bin are left out
+# (low third-octaves need a larger fft_size).
+def get_feature_matrix(sample_rate, fft_size, fraction=1):
+    key = (sample_rate, fft_size, fraction)
+    if key not in _matrix_cache:
+        stft = STFT(sample_rate, fft_size)
+        bands, centres = band_matrix(stft.freqs, sample_rate, fraction)
+        used = bands.any(axis=0)
+        a_gain = 10 ** (a_weighting(stft.freqs) / 10)
+        matrix = np.column_stack((bands[:, used], a_gain, stft.freqs > 0))
+        # Hann spreads a sine over several bins; dividing by the noise
+        # bandwidth makes summed bins read the sine's power
+        bandwidth = fft_size * float(np.dot(stft.window, stft.window)) / float(stft.window.sum()) ** 2
+        matrix /= bandwidth * FULL_SCALE ** 2
+        _matrix_cache[key] = (matrix.astype(np.float32), centres[used])
+    return _matrix_cache[key]
+
+# Function to name the columns of a feature row, in order
+def feature_columns(centres):
+    return ['laeq', 'leq', 'dominant_hz'] + [f"band_{centre:g}" for centre in centres]
+
+class FeatureExtractor:
+    def __init__(self, sample_rate, fft_size=FFT_SIZE, fraction=1, interval=INTERVAL_SECONDS, calibration=0.0):
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.calibration = calibration
+        self.stft = STFT(sample_rate, fft_size)
+        self.matrix, self.centres = get_feature_matrix(sample_rate, fft_size, fraction)
+        self.columns = feature_columns(self.centres)
+        self.frames_per_interval = max(int(round(interval * sample_rate / self.stft.hop_size)), 1)
+        self.interval = self.frames_per_interval * self.stft.hop_size / sample_rate
+        self.intervals = 0  # Rows produced so far
+        self._power = np.zeros((self.stft.max_frames, self.stft.n_bins), dtype=np.float32)
+        self._sum = np.zeros(self.stft.n_bins, dtype=np.float64)
+        self._count = 0
+        self._dc = None
+
+    # Function to feed samples; returns a (rows, columns) float32 array of
+    # the intervals they completed, often empty
+    def process(self, samples):
+        finished = []
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples):
+            mean = float(samples.mean())
+            if self._dc is None:
+                self._dc = mean
+            else:
+                self._dc += (1 - np.exp(-len(samples) / (DC_SECONDS * self.sample_rate))) * (mean - self._dc)
+            samples = samples - self._dc
+        magnitude = self.stft.process(samples)
+        # Capture-sized chunks square into the preallocated buffer
+        power = np.square(magnitude, out=self._power[:len(magnitude)] if len(magnitude) <= len(self._power) else None)
+        first = 0
+        while first < len(power):
+            take = min(len(power) - first, self.frames_per_interval - self._count)
+            self._sum += power[first:first + take].sum(axis=0)
+            self._count += take
+            first += take
+            if self._count == self.frames_per_interval:
+                finished.append(self._sum / self._count)
+                self._sum = np.zeros_like(self._sum)
+                self._count = 0
+        if not finished:
+            return np.zeros((0, len(self.columns)), dtype=np.float32)
+        return self._features(np.array(finished, dtype=np.float32))
+
+    def _features(self, spectra):
+        rows = np.empty((len(spectra), len(self.columns)), dtype=np.float32)
+        powers = spectra @ self.matrix  # Bands, A-weighted, unweighted: one multiply for every interval
+        levels = 10 * np.log10(np.maximum(powers, 10 ** (FLOOR_DB / 10))) + self.calibration
+        rows[:, 0] = levels[:, -2]
+        rows[:, 1] = levels[:, -1]
+        rows[:, 2] = self._dominant(spectra)
+        rows[:, 3:] = levels[:, :-2]
+        self.intervals += len(rows)
+        return rows
+
+    # Peak bin (DC excluded) refined by a parabola through its neighbours'
+    # log power, so the result is finer than the bin spacing
+    def _dominant(self, spectra):
+        peak = spectra[:, 1:-1].argmax(axis=1) + 1
+        rows = np.arange(len(spectra))
+        logs = np.log(np.maximum(spectra[rows[:, None], peak[:, None] + np.arange(-1, 2)], 1e-30))
+        curve = logs[:, 0] - 2 * logs[:, 1] + logs[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = np.where(curve < 0, 0.5 * (logs[:, 0] - logs[:, 2]) / curve, 0.0)
+        hertz = (peak + shift) * self.sample_rate / self.fft_size
+        return np.where(spectra[rows, peak] > 0, hertz, 0.0)
+
+# Append-only log of feature rows. Opening an existing log with the same
+# columns and interval continues it, so a restarted ingest keeps one file
+# per device.
+class FeatureLog:
+    def __init__(self, path, columns, interval, sample_rate, source=''):
+        self.path = path
+        self.header = {
+            'format': LOG_FORMAT,
+            'version': 1,
+            'columns': list(columns),
+            'interval': interval,
+            'sample_rate': sample_rate,
+            'source': source,
+        }
+        self.dtype = _record_dtype(columns)
+        self.rows_written = 0
+        self._file = None
+
+    def open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            header, _ = load_features(self.path, header_only=True)
+            if header['columns'] != self.header['columns'] or header['interval'] != self.header['interval']:
+                raise ValueError(f"{self.path}: existing log has different columns or interval")
+            self._file = open(self.path, 'ab')
+            self._trim_partial_record(header)
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(json.dumps(self.header).encode() + b'\n')
+        return self
+
+    # A crash can leave half a record; drop it so the next ones stay aligned
+    def _trim_partial_record(self, header):
+        excess = (os.path.getsize(self.path) - header['_offset']) % self.dtype.itemsize
+        if excess:
+            self._file.truncate(os.path.getsize(self.path) - excess)
+
+    def append(self, times, rows):
+        records = np.empty(len(rows), dtype=self.dtype)
+        records['time'] = times
+        for number, column in enumerate(self.header['columns']):
+            records[column] = rows[:, number]
+        self._file.write(records.tobytes())
+        self._file.flush()
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def _record_dtype(columns):
+    return np.dtype([('time', '<f8')] + [(column, '<f4') for column in columns])
+
+# Function to read a feature log; returns (header, records), records being
+# a structured array with a 'time' field and one field per column
+def load_features(path, header_only=False):
+    with open(path, 'rb') as f:
+        line = f.readline()
+        header = json.loads(line)
+        if header.get('format') != LOG_FORMAT:
+            raise ValueError(f"{path}: not a feature log")
+        header['_offset'] = len(line)
+        if header_only:
+            return header, None
+        dtype = _record_dtype(header['columns'])
+        count = (os.path.getsize(path) - len(line)) // dtype.itemsize
+        return header, np.fromfile(f, dtype=dtype, count=count)
+
+# Capture sink: extracts features from the samples it is given and appends
+# a row per interval. channel picks one column of multichannel input.
+class FeatureSink:
+    def __init__(self, path, sample_rate, fft_size=FFT_SIZE, fraction=1, interval=INTERVAL_SECONDS,
+                 calibration=0.0, channel=None, source=''):
+        self.extractor = FeatureExtractor(sample_rate, fft_size, fraction, interval, calibration)
+        self.log = FeatureLog(path, self.extractor.columns, self.extractor.interval, sample_rate, source)
+        self.channel = channel
+        self.start_time = None  # Wall clock of the first sample
+        self.last = None        # Latest row, for live displays
+
+    def open(self):
+        self.log.open()
+
+    def write(self, samples):
+        if self.start_time is None:
+            self.start_time = time.time() - len(samples) / self.extractor.sample_rate
+        if self.channel is not None:
+            samples = samples[:, self.channel]
+        rows = self.extractor.process(samples)
+        if len(rows):
+            first = self.extractor.intervals - len(rows)
+            times = self.start_time + np.arange(first, self.extractor.intervals) * self.extractor.interval
+            self.log.append(times, rows)
+            self.last = rows[-1]
+
+    def close(self):
+        self.log.close()
+
+    def stats(self):
+        stats = {'rows': self.log.rows_written}
+        if self.last is not None:
+            stats['laeq'] = float(self.last[0])
+            stats['dominant_hz'] = float(self.last[2])
+        return stats
+
+# Function to extract the features of a WAV file into a log
+def extract_wav(wav_path, path, fft_size=FFT_SIZE, fraction=1, interval=INTERVAL_SECONDS, calibration=0.0):
+    samples, sample_rate = map_wav(wav_path)
+    sink = FeatureSink(path, sample_rate, fft_size, fraction, interval, calibration, source=wav_path)
+    sink.start_time = os.path.getmtime(wav_path) - len(samples) / sample_rate  # Recordings end when last modified
+    sink.open()
+    block = int(30 * sample_rate)
+    for start in range(0, len(samples), block):
+        sink.write(np.asarray(samples[start:start + block, 0]))
+    sink.close()
+    return sink.log.rows_written
+
+def main():
+    parser = argparse.ArgumentParser(description='Show a feature log, or extract one from a WAV file.')
+    parser.add_argument('log')
+    parser.add_argument('--from-wav', metavar='WAV', help='extract the features of WAV into the log first')
+    parser.add_argument('--third-octave', action='store_true')
+    parser.add_argument('--fft-size', type=int, default=FFT_SIZE)
+    parser.add_argument('--interval', type=float, default=INTERVAL_SECONDS)
+    parser.add_argument('--calibration', type=float, default=0.0, help='dB added to every level, e.g. to get dB SPL')
+    parser.add_argument('--tail', type=int, default=20, help='rows to print')
+    args = parser.parse_args()
+
+    if args.from_wav:
+        started = time.perf_counter()
+        rows = extract_wav(args.from_wav, args.log, args.fft_size, 3 if args.third_octave else 1,
+                           args.interval, args.calibration)
+        print(f"Extracted {rows} rows in {time.perf_counter() - started:.2f} s")
+    header, records = load_features(args.log)
+    columns = header['columns']
+    print(f"{args.log}: {len(records)} rows of {header['interval']:g} s from {header['source'] or 'capture'}")
+    print('time                 ' + ' '.join(f"{column[5:] if column.startswith('band_') else column:>8}" for column in columns))
+    for record in records[-args.tail:]:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['time']))
+        print(stamp + '  ' + ' '.join(f"{record[column]:8.1f}" for column in columns))
+
+if __name__ == '__main__':
+    main()
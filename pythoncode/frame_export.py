@@ -0,0 +1,126 @@
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from PIL import Image, GifImagePlugin
+
+# Streaming export of rendered plot frames to an animation file.
+#
+# The GUI thread grabs the canvas pixels and hands them to submit(), which
+# only puts them on a small bounded queue. Palette quantisation, encoding and
+# file writes happen on the exporter's own thread, one frame at a time, so
+# memory stays at a few frames however long the recording runs. If the
+# encoder cannot keep up, new frames are dropped and counted rather than
+# queued without limit.
+QUEUE_FRAMES = 8
+
+# GIF writer that appends each frame to the file as it arrives. All frames
+# share the palette of the first one, which suits plots with a handful of
+# colours. Frame durations come from the capture timestamps, so playback
+# speed matches the recording even when renders were skipped.
+class GifStreamWriter:
+    def __init__(self, path, fps):
+        self.path = path
+        self.default_duration = 1000 / fps
+        self._file = None
+        self._palette = None
+        self._pending = None  # Frame waiting for the next timestamp
+
+    def write(self, image, timestamp):
+        if self._pending is not None:
+            previous, previous_time = self._pending
+            self._write_frame(previous, (timestamp - previous_time) * 1000)
+        self._pending = (image, timestamp)
+
+    def _write_frame(self, image, duration):
+        if self._file is None:
+            frame = image.quantize(colors=256)
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0, 'duration': duration})
+            self._palette = frame
+            self._file = open(self.path, 'wb')
+            for block in header:
+                self._file.write(block)
+        else:
+            frame = image.quantize(palette=self._palette, dither=0)
+        # GIF durations are in 1/100 s; never write 0, viewers treat it as "as fast as possible"
+        for block in GifImagePlugin.getdata(frame, duration=max(duration, 20)):
+            self._file.write(block)
+
+    def close(self):
+        if self._pending is not None:
+            self._write_frame(self._pending[0], self.default_duration)
+            self._pending = None
+        if self._file is not None:
+            self._file.write(b';')  # GIF trailer
+            self._file.close()
+            self._file = None
+
+# Pipes raw RGB frames to a local ffmpeg, e.g. for MP4 output
+class FfmpegWriter:
+    def __init__(self, path, fps, ffmpeg='ffmpeg'):
+        self.path = path
+        self.fps = fps
+        self.ffmpeg = shutil.which(ffmpeg)
+        if self.ffmpeg is None:
+            raise RuntimeError(f"{ffmpeg} not found on PATH")
+        self._process = None
+
+    def write(self, image, timestamp):
+        if self._process is None:
+            width, height = image.size
+            self._process = subprocess.Popen(
+                [self.ffmpeg, '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                 '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-',
+                 '-pix_fmt', 'yuv420p', self.path],
+                stdin=subprocess.PIPE)
+        self._process.stdin.write(image.tobytes())
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+class FrameExporter:
+    def __init__(self, writer, max_frames=QUEUE_FRAMES):
+        self.writer = writer
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.error = None
+        self._queue = queue.Queue(max_frames)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Called from the GUI thread with the canvas's RGBA buffer; copies it,
+    # never blocks
+    def submit_rgba(self, buffer, size):
+        image = Image.frombuffer('RGBA', size, bytes(buffer), 'raw', 'RGBA', 0, 1)
+        self.submit(image)
+
+    def submit(self, image):
+        try:
+            self._queue.put_nowait((image, time.monotonic()))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                image, timestamp = item
+                self.writer.write(image.convert('RGB'), timestamp)
+                self.frames_written += 1
+        except Exception as exc:
+            self.error = exc
+            # Keep draining so submit() and close() never block
+            while self._queue.get() is not None:
+                pass
+        finally:
+            self.writer.close()
@@ -0,0 +1,172 @@
+import struct
+import zlib
+import numpy as np
+from audio_codecs import decode_payloads, payload_size
+
+# Framed serial format, sent by the sketches when built with FRAMED_OUTPUT 1:
+#
+#   sync      2 bytes  0xA5 0x5A
+#   sequence  uint16   little-endian, wraps at 65536
+#   count     uint16   number of int16 samples in the payload
+#   payload   count * int16, little-endian
+#   crc       uint32   zlib/IEEE CRC-32 of sequence, count and payload
+#
+# A dropped or corrupted byte only costs the frame it falls in; the decoder
+# looks for the next sync word and carries on with correct sample alignment.
+#
+# Sketches built with OUTPUT_CODEC send compressed frames instead, with
+# their own sync word and a codec byte (see audio_codecs.py):
+#
+#   sync      2 bytes  0xA5 0x5C
+#   sequence  uint16
+#   count     uint16   number of samples once decoded
+#   codec     uint8
+#   payload   length set by codec and count
+#   crc       uint32   CRC-32 of sequence, count, codec and payload
+#
+# The decoder accepts both kinds, so the host needs no extra setting.
+SYNC = b'\xa5\x5a'
+COMPRESSED_SYNC = b'\xa5\x5c'
+HEADER_SIZE = 6
+COMPRESSED_HEADER_SIZE = 7
+CRC_SIZE = 4
+MAX_SAMPLES = 4096       # Larger counts are treated as corruption
+MAX_GAP_FILL = 64        # Most frames of silence inserted for one gap
+
+_FIELDS = struct.Struct('<HH')
+_CRC = struct.Struct('<I')
+_EMPTY = np.zeros(0, dtype=np.int16)
+
+# Function to build one frame, used by emulators and tests
+def encode_frame(sequence, samples):
+    payload = np.asarray(samples, dtype='<i2').tobytes()
+    body = _FIELDS.pack(sequence & 0xFFFF, len(payload) // 2) + payload
+    return SYNC + body + _CRC.pack(zlib.crc32(body))
+
+# Function to build one compressed frame around an encoded payload
+def encode_compressed_frame(sequence, count, codec, payload):
+    body = _FIELDS.pack(sequence & 0xFFFF, count) + bytes([codec]) + payload
+    return COMPRESSED_SYNC + body + _CRC.pack(zlib.crc32(body))
+
+# Incremental decoder for the framed format.
+#
+# feed() takes whatever bytes the port returned and gives back the samples of
+# every complete, valid frame. Partial frames stay buffered for the next call.
+# Sync search and CRC checks run in C (bytearray.find, zlib.crc32), so the
+# Python work is per frame rather than per byte. Compressed payloads are
+# collected and decoded together at the end of each feed().
+class FrameDecoder:
+    def __init__(self, max_samples=MAX_SAMPLES, fill_gaps=False):
+        self.max_samples = max_samples
+        self.fill_gaps = fill_gaps  # Insert silence for lost frames to keep timing
+        self._buffer = bytearray()
+        self._expected = None
+        self.last_sequence = None
+        self.frames_decoded = 0
+        self.frames_compressed = 0
+        self.frames_lost = 0
+        self.frames_corrupt = 0
+        self.bytes_skipped = 0
+
+    def stats(self):
+        return {
+            'decoded': self.frames_decoded,
+            'compressed': self.frames_compressed,
+            'lost': self.frames_lost,
+            'corrupt': self.frames_corrupt,
+            'skipped_bytes': self.bytes_skipped,
+        }
+
+    def reset(self):
+        self._buffer.clear()
+        self._expected = None
+        self.last_sequence = None
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        end = len(buf)
+        pos = 0
+        chunks = []
+        pending = {}  # (codec, count) -> [(chunk index, payload)]
+        with memoryview(buf) as view:
+            while True:
+                start = buf.find(SYNC[0], pos)
+                if start < 0:
+                    self.bytes_skipped += end - pos
+                    pos = end
+                    break
+                self.bytes_skipped += start - pos
+                pos = start
+                if end - pos < 2:
+                    break  # The second sync byte may be next
+                marker = buf[pos + 1]
+                if marker == SYNC[1]:
+                    header_size = HEADER_SIZE
+                elif marker == COMPRESSED_SYNC[1]:
+                    header_size = COMPRESSED_HEADER_SIZE
+                else:
+                    self.bytes_skipped += 1
+                    pos += 1
+                    continue
+                if end - pos < header_size:
+                    break
+                sequence, count = _FIELDS.unpack_from(buf, pos + 2)
+                codec = None
+                size = 2 * count
+                if header_size == COMPRESSED_HEADER_SIZE:
+                    codec = buf[pos + HEADER_SIZE]
+                    size = payload_size(codec, count)
+                if count == 0 or count > self.max_samples or size is None:
+                    self.frames_corrupt += 1
+                    pos += 1
+                    continue
+                crc_pos = pos + header_size + size
+                if crc_pos + CRC_SIZE > end:
+                    break
+                if zlib.crc32(view[pos + 2:crc_pos]) != _CRC.unpack_from(buf, crc_pos)[0]:
+                    self.frames_corrupt += 1
+                    pos += 1
+                    continue
+                if self._expected is not None:
+                    lost = (sequence - self._expected) & 0xFFFF
+                    if lost:
+                        self.frames_lost += lost
+                        if self.fill_gaps:
+                            chunks.append(np.zeros(min(lost, MAX_GAP_FILL) * count, dtype=np.int16))
+                if codec is None:
+                    chunks.append(np.frombuffer(view[pos + HEADER_SIZE:crc_pos], dtype='<i2').astype(np.int16))
+                else:
+                    pending.setdefault((codec, count), []).append((len(chunks), bytes(view[pos + header_size:crc_pos])))
+                    chunks.append(None)
+                    self.frames_compressed += 1
+                self._expected = (sequence + 1) & 0xFFFF
+                self.last_sequence = sequence
+                self.frames_decoded += 1
+                pos = crc_pos + CRC_SIZE
+        del buf[:pos]
+        for (codec, count), frames in pending.items():
+            decoded = decode_payloads(codec, count, b''.join(payload for _, payload in frames))
+            for (index, _), samples in zip(frames, decoded):
+                chunks[index] = samples
+        if not chunks:
+            return _EMPTY
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks)
+
+# Reads framed samples from anything with a read() method: a serial.Serial,
+# a pseudo-terminal opened as a file, or an io.BytesIO in tests.
+class FramedReader:
+    def __init__(self, port, block_size=4096, **decoder_args):
+        self.port = port
+        self.block_size = block_size
+        self.decoder = FrameDecoder(**decoder_args)
+
+    def read(self):
+        waiting = getattr(self.port, 'in_waiting', None)
+        if waiting is None:
+            size = self.block_size
+        else:
+            size = min(max(waiting, 1), self.block_size)
+        return self.decoder.feed(self.port.read(size))
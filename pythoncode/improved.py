@@ -1,116 +1,157 @@
-import serial
-from serial.tools import list_ports
-import wave
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import tkinter as tk
 from tkinter import ttk
-from threading import Thread
+from ringbuffer import RingBuffer
+from stft import STFT
+from waterfall import Waterfall
+from capture import CapturePipeline, FileSource, SerialSource, WavSink
+from resample import RateEstimator
+from event_capture import EventRecorder, make_trigger
+from segment_store import SegmentWriter
+from archive import ArchiveSink
+from metrics import Metrics
+from port_discovery import PortChooser
+from stats_panel import StatsPanel
 
-SERIAL_PORT = 'COM3'  # Change this to your serial port
 BAUD_RATE = 115200
+FRAMED = False  # Set to True when the sketch is built with FRAMED_OUTPUT 1
 WAV_FILENAME = 'recorded_audio.wav'
+SEGMENT_DIR = None  # Set to a directory to record rotating segments instead of WAV_FILENAME
+SEGMENT_SECONDS = 600
+ARCHIVE_FILE = None  # Set to a .audz path to record compressed on a background thread instead of WAV_FILENAME
+EVENTS_DIR = None  # Set to a directory to keep only triggered events instead of one continuous WAV
+TRIGGER = 'rms'  # What starts an event: 'rms', 'peak', 'band' or 'flux' (see event_capture.py)
 SAMPLE_RATE = 40000
+REPLAY_FILE = None  # Set to a recorded WAV, archive or segment directory to analyse it instead of the serial port
+REPLAY_SPEED = 1.0  # Times real time for REPLAY_FILE, None for as fast as possible
+MEASURE_RATE = True  # Write the rate the board really delivers into the WAV header
 CHANNELS = 1
 SAMPLE_WIDTH = 2  # 2 bytes for 16-bit audio
 BUFFER_SIZE = 512
-
-recording = False
-selected_port = None
-ser = None
-audio_data = []
-
-# Function to list available serial ports
-def list_serial_ports():
-    return [port.device for port in list_ports.comports()]
-
-# Function to read from serial and write to WAV file
-def record_audio():
-    global recording, ser, audio_data
-    audio_data = []
-    with wave.open(WAV_FILENAME, 'wb') as wf:
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(SAMPLE_WIDTH)
-        wf.setframerate(SAMPLE_RATE)
-        while recording:
-            data = ser.read(BUFFER_SIZE)
-            if data:
-                audio_data.extend(np.frombuffer(data, dtype=np.int16))
-                wf.writeframes(data)
-
-# Function to handle the record button click
-def start_recording():
-    global recording, ser
-    selected_port = port_var.get()
-    if selected_port:
-        ser = serial.Serial(selected_port, BAUD_RATE)
-        recording = True
-        record_button.config(state=tk.DISABLED)
-        stop_button.config(state=tk.NORMAL)
-        port_menu.config(state=tk.DISABLED)
-        thread = Thread(target=record_audio)
-        thread.start()
-        # thread_plot = Thread(target=plot_spectrum)
-        # thread_plot.start()
-        plot_spectrum()
-
-# Function to handle the stop button click
-def stop_recording():
-    global recording, ser
-    recording = False
-    ser.close()
-    record_button.config(state=tk.NORMAL)
-    stop_button.config(state=tk.DISABLED)
-    port_menu.config(state=tk.NORMAL)
-
-# Tkinter GUI setup
-root = tk.Tk()
-root.title('Audio Recorder with Spectrum Analyzer')
-
-frame = ttk.Frame(root, padding=10)
-frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-
-ports = list_serial_ports()
-port_var = tk.StringVar(value=ports[0] if ports else '')
-
-port_label = ttk.Label(frame, text="Select Serial Port:")
-port_label.grid(row=0, column=0, padx=5, pady=5)
-
-port_menu = ttk.OptionMenu(frame, port_var, *ports)
-port_menu.grid(row=0, column=1, padx=5, pady=5)
-
-record_button = ttk.Button(frame, text='Record', command=start_recording)
-record_button.grid(row=1, column=0, padx=5, pady=5)
-
-stop_button = ttk.Button(frame, text='Stop', command=stop_recording)
-stop_button.grid(row=1, column=1, padx=5, pady=5)
-stop_button.config(state=tk.DISABLED)
-
-# Plotting setup
-fig, ax = plt.subplots()
-x_data = np.linspace(0, SAMPLE_RATE // 2, BUFFER_SIZE // 2)
-y_data = np.zeros(BUFFER_SIZE // 2)
-line, = ax.plot(x_data, y_data)
-ax.set_xlim(0, SAMPLE_RATE // 2)
-ax.set_ylim(0, 1)
-ax.set_xlabel('Frequency (Hz)')
-ax.set_ylabel('Magnitude')
-
-# Function to update the plot
-def update_plot(frame):
-    global audio_data
-    if len(audio_data) >= BUFFER_SIZE:
-        sample = audio_data[-BUFFER_SIZE:]
-        audio_data = audio_data[-BUFFER_SIZE:]  # Keep the latest buffer size
-        spectrum = np.abs(np.fft.rfft(sample)) / BUFFER_SIZE
-        line.set_ydata(spectrum)
-        fig.canvas.draw_idle()  # Update the plot
-    return line,
-
-# Function to plot the spectrum analyzer
-def plot_spectrum():
-    ani = FuncAnimation(fig, update_plot, interval=50, blit=True)
-    plt.show()
-
-root.mainloop()
+HISTORY_SIZE = BUFFER_SIZE * 16  # Samples kept in memory for the plot
+SHOW_STATS = True  # Live capture timings in the control window; False removes the instrumentation
+WATERFALL_SECONDS = 10  # History shown in the spectrogram under the spectrum, 0 to hide it
+
+class SpectrumRecorderApp:
+    def __init__(self):
+        self.recorder = None  # Serial port -> WAV file and ring buffer
+        self.metrics = Metrics('recorder') if SHOW_STATS else None
+        self.audio_data = RingBuffer(HISTORY_SIZE)
+        self.stft = STFT(SAMPLE_RATE, fft_size=BUFFER_SIZE, averaging=0.5)
+        self.waterfall = None
+        if WATERFALL_SECONDS:
+            self.waterfall = Waterfall(self.stft, history=int(WATERFALL_SECONDS * SAMPLE_RATE / self.stft.hop_size))
+        self.plot_position = 0  # Ring buffer position the plot has consumed up to
+        self.animation = None
+
+        # Tkinter GUI setup
+        self.root = tk.Tk()
+        self.root.title('Audio Recorder with Spectrum Analyzer')
+        self.setup_ui()
+        self.setup_plot()
+
+    def run(self):
+        self.root.mainloop()
+
+    def setup_ui(self):
+        frame = ttk.Frame(self.root, padding=10)
+        frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        # Ports are listed and probed in the background; the window opens at once
+        self.port_var = tk.StringVar()
+
+        port_label = ttk.Label(frame, text="Select Serial Port:")
+        port_label.grid(row=0, column=0, padx=5, pady=5)
+
+        self.port_menu = ttk.Combobox(frame, textvariable=self.port_var, state='readonly')
+        self.port_menu.grid(row=0, column=1, padx=5, pady=5)
+        self.port_chooser = PortChooser(self.root, self.port_menu, port_label)
+
+        self.record_button = ttk.Button(frame, text='Record', command=self.start_recording)
+        self.record_button.grid(row=1, column=0, padx=5, pady=5)
+
+        self.stop_button = ttk.Button(frame, text='Stop', command=self.stop_recording)
+        self.stop_button.grid(row=1, column=1, padx=5, pady=5)
+        self.stop_button.config(state=tk.DISABLED)
+
+        if SHOW_STATS:
+            self.stats_panel = StatsPanel(frame, [self.metrics])
+            self.stats_panel.label.grid(row=2, column=0, columnspan=2, sticky=tk.W)
+            self.stats_panel.start()
+
+    # Plotting setup
+    def setup_plot(self):
+        if self.waterfall:
+            self.fig, (self.ax, self.waterfall_ax) = plt.subplots(2, 1, figsize=(6.4, 7.2))
+            self.waterfall.attach(self.waterfall_ax)
+        else:
+            self.fig, self.ax = plt.subplots()
+        self.line, = self.ax.plot(self.stft.freqs, np.zeros(self.stft.n_bins))
+        self.ax.set_xlim(0, SAMPLE_RATE // 2)
+        self.ax.set_ylim(0, 1)
+        self.ax.set_xlabel('Frequency (Hz)')
+        self.ax.set_ylabel('Magnitude')
+
+    # Function to handle the record button click
+    def start_recording(self):
+        selected_port = self.port_var.get()
+        if selected_port or REPLAY_FILE:
+            self.audio_data.clear()
+            self.stft.reset()
+            if self.waterfall:
+                self.waterfall.clear()
+            sinks = [self.audio_data]
+            stages = []
+            if REPLAY_FILE:
+                source = FileSource(REPLAY_FILE, BUFFER_SIZE, REPLAY_SPEED)
+            else:
+                source = SerialSource(selected_port, BAUD_RATE, SAMPLE_RATE, block_size=BUFFER_SIZE, framed=FRAMED)
+            if EVENTS_DIR:
+                sinks.insert(0, EventRecorder(EVENTS_DIR, SAMPLE_RATE, make_trigger(TRIGGER, SAMPLE_RATE)))
+            elif SEGMENT_DIR:
+                sinks.insert(0, SegmentWriter(SEGMENT_DIR, SAMPLE_RATE, SEGMENT_SECONDS))
+            elif ARCHIVE_FILE:
+                sinks.insert(0, ArchiveSink(ARCHIVE_FILE, SAMPLE_RATE))
+            elif not REPLAY_FILE:
+                # A replay is only analysed, not recorded again
+                estimator = RateEstimator() if MEASURE_RATE else None
+                if estimator:
+                    stages.append(estimator)  # Fed by the pipeline; the sink only reads it
+                sinks.insert(0, WavSink(WAV_FILENAME, SAMPLE_RATE, estimator))
+            self.recorder = CapturePipeline(source, sinks, stages, metrics=self.metrics)
+            self.recorder.start()
+            self.record_button.config(state=tk.DISABLED)
+            self.stop_button.config(state=tk.NORMAL)
+            self.port_menu.config(state=tk.DISABLED)
+            self.plot_spectrum()
+
+    # Function to handle the stop button click
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+        self.record_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        self.port_menu.config(state='readonly')
+
+    # Function to update the plot
+    def update_plot(self, frame):
+        samples, self.plot_position = self.audio_data.read_since(self.plot_position)
+        frames = self.stft.process(samples)
+        if not len(frames):
+            return ()
+        self.line.set_ydata(self.stft.current)
+        if self.waterfall:
+            self.waterfall.write(frames)
+            return self.line, self.waterfall.refresh()
+        return self.line,
+
+    # Function to plot the spectrum analyzer
+    def plot_spectrum(self):
+        self.animation = FuncAnimation(self.fig, self.update_plot, interval=50, blit=True)
+        plt.show()
+
+if __name__ == '__main__':
+    SpectrumRecorderApp().run()
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+import numpy as np
+from ringbuffer import RingBuffer
+from wavwriter import StreamingWavWriter
+from segment_store import SegmentWriter
+
+# Parameters, matching the ESP32 TCP sketch
+SAMPLE_RATE = 40000
+SAMPLE_WIDTH = 2
+READ_SIZE = 512 * SAMPLE_WIDTH * 16  # Bytes per read (16 sketch buffers)
+RING_SECONDS = 10                    # Audio kept in memory per device
+QUEUE_CHUNKS = 64                    # Reads buffered per device before backpressure
+BACKOFF_START = 0.5                  # Seconds before the first reconnect
+BACKOFF_MAX = 30.0
+STABLE_SECONDS = 10.0                # Connection time after which the backoff starts over
+STATS_INTERVAL = 5.0
+
+# One ESP32 board: keeps a TCP connection open, reconnecting with exponential
+# backoff, and hands received data to its sinks. The backoff also applies
+# after a connection closes, and only starts over once a connection has
+# stayed up for STABLE_SECONDS, so a board that accepts and hangs up at once
+# is not hammered in a tight loop.
+#
+# The reader coroutine puts raw chunks on a bounded queue. When the disk side
+# falls behind the queue fills, the reader stops awaiting the socket and TCP
+# flow control slows the board down instead of memory growing. Each new
+# connection queues RECONNECTED first, so an odd byte left over from the
+# previous connection is dropped instead of shifting every sample after it.
+RECONNECTED = None
+
+class DeviceStream:
+    def __init__(self, name, host, port, output_dir, sample_rate=SAMPLE_RATE, segment_seconds=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.segment_seconds = segment_seconds  # Rotate into a segment store when set
+        self.ring = RingBuffer(RING_SECONDS * sample_rate)
+        self.queue = asyncio.Queue(QUEUE_CHUNKS)
+        self.sink = None
+        self.connected = False
+        self.bytes_received = 0
+        self.reconnects = 0
+        self.backpressure_waits = 0
+        self._carry = b''
+        self._write_lock = threading.Lock()
+        self._in_flight = None  # The drain task's current write on the executor
+
+    async def run(self):
+        writer_task = asyncio.create_task(self._drain())
+        backoff = BACKOFF_START
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                except OSError:
+                    backoff = await self._back_off(backoff)
+                    continue
+                self.connected = True
+                connected_at = time.monotonic()
+                try:
+                    await self.queue.put(RECONNECTED)
+                    await self._receive(reader)
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    self.connected = False
+                    writer.close()
+                self.reconnects += 1
+                if time.monotonic() - connected_at >= STABLE_SECONDS:
+                    backoff = BACKOFF_START
+                backoff = await self._back_off(backoff)
+        finally:
+            # Cancelling the drain task does not stop a write it already
+            # handed to the executor; wait for that write, then flush what is
+            # still queued after it, so nothing lands out of order or after close
+            writer_task.cancel()
+            await asyncio.gather(writer_task, return_exceptions=True)
+            if self._in_flight is not None:
+                await asyncio.gather(self._in_flight, return_exceptions=True)
+            chunks = []
+            while not self.queue.empty():
+                chunks.append(self.queue.get_nowait())
+            self._write(chunks)
+            if self.sink:
+                self.sink.close()
+
+    # Function to wait before the next connection attempt; returns the next backoff
+    async def _back_off(self, backoff):
+        # Jitter keeps hundreds of boards from reconnecting in lockstep
+        await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+        return min(backoff * 2, BACKOFF_MAX)
+
+    async def _receive(self, reader):
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+            self.bytes_received += len(data)
+            if self.queue.full():
+                self.backpressure_waits += 1
+            await self.queue.put(data)
+
+    # Moves queued chunks to the sinks, batching whatever has piled up into a
+    # single call on the executor so disk writes never block the event loop.
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chunks = [await self.queue.get()]
+            while not self.queue.empty():
+                chunks.append(self.queue.get_nowait())
+            try:
+                self._in_flight = loop.run_in_executor(None, self._write, chunks)
+                # Shielded so cancelling this task leaves the future for run() to wait on
+                await asyncio.shield(self._in_flight)
+            finally:
+                for _ in chunks:
+                    self.queue.task_done()
+
+    def _write(self, chunks):
+        with self._write_lock:
+            pending = []
+            for chunk in chunks:
+                if chunk is RECONNECTED:
+                    if pending:
+                        self._write_locked(b''.join(pending))
+                        pending = []
+                    self._carry = b''
+                else:
+                    pending.append(chunk)
+            if pending:
+                self._write_locked(b''.join(pending))
+
+    def _write_locked(self, data):
+        if self.sink is None:
+            self.sink = self._open_sink()
+        # Keep sample alignment across odd-sized reads
+        if self._carry:
+            data = self._carry + data
+        usable = len(data) - len(data) % SAMPLE_WIDTH
+        samples = np.frombuffer(data, dtype='<i2', count=usable // SAMPLE_WIDTH)
+        self.sink.write(samples)
+        self.ring.write(samples)
+        self._carry = data[usable:]
+
+    def _open_sink(self):
+        if self.segment_seconds:
+            sink = SegmentWriter(os.path.join(self.output_dir, self.name), self.sample_rate, self.segment_seconds)
+            sink.open()
+            return sink
+        return StreamingWavWriter(os.path.join(self.output_dir, f"{self.name}.wav"), self.sample_rate)
+
+def parse_device(text):
+    host, _, port = text.rpartition(':')
+    return host, int(port)
+
+async def report(streams):
+    last_bytes = {s.name: 0 for s in streams}
+    last_time = time.monotonic()
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        now = time.monotonic()
+        elapsed = now - last_time
+        rates = []
+        for s in streams:
+            rates.append((s.bytes_received - last_bytes[s.name]) / SAMPLE_WIDTH / elapsed)
+            last_bytes[s.name] = s.bytes_received
+        last_time = now
+        connected = sum(s.connected for s in streams)
+        waits = sum(s.backpressure_waits for s in streams)
+        print(f"{connected}/{len(streams)} connected, "
+              f"{sum(rates):.0f} samples/s total, "
+              f"min {min(rates):.0f} / mean {sum(rates) / len(rates):.0f} samples/s per stream, "
+              f"{waits} backpressure waits")
+
+async def serve(devices, output_dir, sample_rate, segment_seconds=None):
+    streams = [DeviceStream(name, host, port, output_dir, sample_rate, segment_seconds)
+               for name, host, port in devices]
+    tasks = [asyncio.create_task(s.run()) for s in streams]
+    tasks.append(asyncio.create_task(report(streams)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Record many ESP32 TCP audio streams at once.')
+    parser.add_argument('devices', nargs='*', help='host:port of each board')
+    parser.add_argument('--range', dest='port_range', metavar='HOST:PORT:COUNT',
+                        help='COUNT boards on consecutive ports, e.g. the device emulator')
+    parser.add_argument('--output-dir', default='recordings')
+    parser.add_argument('--rate', type=int, default=SAMPLE_RATE)
+    parser.add_argument('--segment-seconds', type=float,
+                        help='write a rotating segment store per board instead of one WAV')
+    args = parser.parse_args()
+
+    devices = []
+    for text in args.devices:
+        host, port = parse_device(text)
+        devices.append((f"{host}_{port}", host, port))
+    if args.port_range:
+        host, start, count = args.port_range.rsplit(':', 2)
+        for port in range(int(start), int(start) + int(count)):
+            devices.append((f"{host}_{port}", host, port))
+    if not devices:
+        parser.error('no devices given')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    try:
+        asyncio.run(serve(devices, args.output_dir, args.rate, args.segment_seconds))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
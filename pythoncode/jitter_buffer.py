@@ -0,0 +1,295 @@
+import argparse
+import threading
+import time
+import numpy as np
+from capture import CapturePipeline, get_pyaudio, make_source, terminate_pyaudio
+from resample import RateEstimator
+from wavwriter import StreamingWavWriter
+
+# Serial-to-speaker monitoring with an adaptive jitter buffer.
+#
+# The capture thread write()s samples as they arrive; the output device
+# pulls fixed-size buffers from read() on its own clock. The two clocks
+# never agree exactly (the board's ADC timer against the sound card's
+# crystal), so read() resamples by linear interpolation at a ratio that
+# starts at input_rate / output_rate and is nudged by up to MAX_ADJUST
+# towards keeping the buffer at target_latency. Latency therefore stays put
+# instead of growing or running dry, and the pitch change needed to absorb
+# a few hundred ppm of drift is inaudible.
+#
+# When the buffer runs dry the missing audio is played as silence and the
+# buffer refills to the target before playing again (an underrun). When it
+# grows past max_latency the oldest audio is dropped back to the target (an
+# overrun). Both are counted, along with the current latency and ratio.
+TARGET_LATENCY = 0.1   # Seconds of audio kept buffered
+MAX_LATENCY = 0.5      # Seconds buffered before the oldest audio is dropped
+MAX_ADJUST = 0.005     # Largest drift correction, as a fraction of the rate
+ADJUST_GAIN = 0.05     # Correction per second of latency error
+SMOOTHING = 0.02       # Weight of each new fill level in the running average
+FRAMES_PER_BUFFER = 256
+
+class JitterBuffer:
+    def __init__(self, input_rate, output_rate=None, target_latency=TARGET_LATENCY, max_latency=MAX_LATENCY):
+        self.input_rate = input_rate
+        self.output_rate = output_rate or input_rate
+        self.target_latency = target_latency
+        self.max_latency = max_latency
+        self.target = int(target_latency * input_rate)
+        self.limit = max(int(max_latency * input_rate), 2 * self.target)
+        self.capacity = self.limit + input_rate  # Room for one late burst above the limit
+        # Mirrored like RingBuffer so any buffered span is one contiguous slice
+        self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._start = 0   # Absolute index of the oldest unplayed sample
+        self._end = 0     # Absolute index one past the newest sample
+        self._phase = 0.0  # Fractional read position past _start
+        self._priming = True
+        self._error = 0.0  # Smoothed latency error, seconds
+        self._lock = threading.Lock()
+        self.ratio = self.input_rate / self.output_rate
+        self.underruns = 0
+        self.overruns = 0
+        self.samples_in = 0
+        self.samples_out = 0
+        self.silent_samples = 0
+
+    @property
+    def latency(self):
+        return (self._end - self._start) / self.input_rate
+
+    # Function to change the nominal input rate, e.g. once it has been
+    # measured; the latency target and limit follow it, and the buffer grows
+    # (keeping what it holds) when the new limit no longer fits
+    def set_input_rate(self, rate):
+        with self._lock:
+            self.input_rate = rate
+            self.target = int(self.target_latency * rate)
+            self.limit = max(int(self.max_latency * rate), 2 * self.target)
+            if self.limit + rate > self.capacity:
+                held = self._data[self._start % self.capacity:][:self._end - self._start].copy()
+                self.capacity = self.limit + rate
+                self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+                self._data[:len(held)] = held
+                self._data[self.capacity:self.capacity + len(held)] = held
+                self._start = 0
+                self._end = len(held)
+            self.ratio = self.input_rate / self.output_rate
+
+    # Called from the capture thread
+    def write(self, samples):
+        samples = np.asarray(samples)
+        with self._lock:
+            if len(samples) > self.capacity:
+                samples = samples[-self.capacity:]
+            count = len(samples)
+            if self._end - self._start + count > self.limit:
+                # Too far behind; drop the oldest audio back to the target
+                self._start = self._end + count - self.target
+                self._phase = 0.0
+                self.overruns += 1
+            cap = self.capacity
+            position = self._end % cap
+            first = min(count, cap - position)
+            self._data[position:position + first] = samples[:first]
+            self._data[position + cap:position + cap + first] = samples[:first]
+            rest = count - first
+            if rest:
+                self._data[:rest] = samples[first:]
+                self._data[cap:cap + rest] = samples[first:]
+            self._end += count
+            self.samples_in += count
+
+    # Called from the output device's thread; always returns `frames` samples
+    def read(self, frames):
+        out = np.zeros(frames, dtype=np.int16)
+        with self._lock:
+            available = self._end - self._start
+            if self._priming:
+                if available < self.target:
+                    self.silent_samples += frames
+                    return out
+                self._priming = False
+            error = (available - self.target) / self.input_rate
+            self._error += SMOOTHING * (error - self._error)
+            adjust = min(max(self._error * ADJUST_GAIN, -MAX_ADJUST), MAX_ADJUST)
+            self.ratio = self.input_rate / self.output_rate * (1 + adjust)
+
+            positions = self._phase + self.ratio * np.arange(frames)
+            # Interpolation reads one sample past each position
+            playable = min(frames, int(np.searchsorted(positions, available - 1)))
+            positions = positions[:playable]
+            segment = self._data[self._start % self.capacity:][:available]
+            index = positions.astype(np.intp)
+            fraction = positions - index
+            values = segment[index] + fraction * (segment[index + 1] - segment[index])
+            np.clip(values, -32768, 32767, out=values)
+            out[:playable] = values
+
+            advance = self._phase + self.ratio * playable
+            consumed = min(int(advance), available)
+            self._phase = advance - consumed if playable == frames else 0.0
+            self._start += consumed
+            self.samples_out += playable
+            if playable < frames:
+                self.underruns += 1
+                self.silent_samples += frames - playable
+                self._priming = True
+        return out
+
+    def stats(self):
+        return {
+            'input_rate': self.input_rate,
+            'latency_ms': self.latency * 1000,
+            'target_ms': self.target / self.input_rate * 1000,
+            'ratio': self.ratio,
+            'underruns': self.underruns,
+            'overruns': self.overruns,
+            'silent_samples': self.silent_samples,
+        }
+
+# PyAudio output in callback mode: PortAudio asks for each buffer when the
+# device needs it, so playback timing follows the sound card's clock
+class CallbackOutput:
+    def __init__(self, rate, frames_per_buffer=FRAMES_PER_BUFFER, device_index=None):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.device_index = device_index
+        self.device_underflows = 0
+        self.stream = None
+
+    def start(self, pull):
+        import pyaudio
+        underflow = pyaudio.paOutputUnderflow
+
+        def callback(in_data, frame_count, time_info, status):
+            if status & underflow:
+                self.device_underflows += 1
+            return pull(frame_count).tobytes(), pyaudio.paContinue
+
+        self.stream = get_pyaudio().open(format=pyaudio.paInt16, channels=1, rate=self.rate, output=True,
+                                         output_device_index=self.device_index,
+                                         frames_per_buffer=self.frames_per_buffer, stream_callback=callback)
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def stats(self):
+        return {'device_underflows': self.device_underflows}
+
+# Stand-in output device for tests and headless checks: pulls buffers on
+# its own thread at `rate` x `speed` (e.g. speed=1.0002 for a card 200 ppm
+# fast) and writes what it would have played to a WAV file
+class FileOutput:
+    def __init__(self, path, rate, frames_per_buffer=FRAMES_PER_BUFFER, speed=1.0):
+        self.path = path
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.speed = speed
+        self._running = False
+        self._thread = None
+
+    def start(self, pull):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(pull,), daemon=True)
+        self._thread.start()
+
+    def _run(self, pull):
+        period = self.frames_per_buffer / (self.rate * self.speed)
+        with StreamingWavWriter(self.path, self.rate) as writer:
+            started = time.monotonic()
+            buffers = 0
+            while self._running:
+                writer.write(pull(self.frames_per_buffer))
+                buffers += 1
+                delay = started + buffers * period - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {}
+
+# Capture sink that plays what it receives through a jitter buffer; use it
+# in place of PyAudioSink for live monitoring. With a RateEstimator (fed as
+# a pipeline stage), input_rate is only the starting guess: the buffer
+# switches to the measured rate about once a second.
+class MonitorSink:
+    def __init__(self, input_rate, output_rate=None, target_latency=TARGET_LATENCY, output=None, rate_estimator=None):
+        self.jitter = JitterBuffer(input_rate, output_rate, target_latency)
+        self.output = output or CallbackOutput(self.jitter.output_rate)
+        self.rate_estimator = rate_estimator
+        self._since_update = 0
+
+    def open(self):
+        self.output.start(self.jitter.read)
+
+    def write(self, samples):
+        self.jitter.write(samples)
+        if self.rate_estimator:
+            self._since_update += len(samples)
+            if self._since_update >= self.jitter.input_rate:
+                self._since_update = 0
+                rate = self.rate_estimator.estimate()
+                if rate and abs(rate - self.jitter.input_rate) >= 1:
+                    self.jitter.set_input_rate(int(round(rate)))
+
+    def close(self):
+        self.output.stop()
+
+    def stats(self):
+        stats = self.jitter.stats()
+        stats.update(self.output.stats())
+        return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Play a capture source through the adaptive jitter buffer.')
+    parser.add_argument('source', choices=['serial', 'tcp', 'pyaudio', 'file'])
+    parser.add_argument('target', nargs='?', default='', help='serial port, host:port, WAV or archive path, or segment directory')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='N', help='replay a file at N times real time')
+    parser.add_argument('--replay-start', type=float, default=0.0, metavar='SECONDS', help='replay a file from here')
+    parser.add_argument('--rate', type=int, default=44100, help='sample rate the source delivers')
+    parser.add_argument('--measure-rate', action='store_true',
+                        help='start from --rate, then follow the rate the source really delivers')
+    parser.add_argument('--output-rate', type=int, help='sound card rate (default: --rate)')
+    parser.add_argument('--latency', type=float, default=TARGET_LATENCY, help='target latency in seconds')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--framed', action='store_true')
+    parser.add_argument('--fake-output', metavar='WAV', help='write to this file instead of a sound card')
+    parser.add_argument('--speed', type=float, default=1.0, help='clock speed of the fake output, e.g. 1.0002')
+    parser.add_argument('--duration', type=float)
+    args = parser.parse_args()
+
+    source = make_source(args.source, args.target, args)
+    rate = args.rate
+    if args.source == 'file':
+        source.open()
+        rate = source.sample_rate  # A file knows its own rate
+    output_rate = args.output_rate or rate
+    output = FileOutput(args.fake_output, output_rate, speed=args.speed) if args.fake_output else None
+    estimator = RateEstimator() if args.measure_rate and args.source != 'file' else None
+    sink = MonitorSink(rate, output_rate, args.latency, output, estimator)
+    pipeline = CapturePipeline(source, [sink], [estimator] if estimator else [])
+    pipeline.start()
+
+    try:
+        started = time.monotonic()
+        while pipeline.running and (args.duration is None or time.monotonic() - started < args.duration):
+            time.sleep(1.0)
+            stats = sink.stats()
+            print(f"input {stats['input_rate']} Hz, latency {stats['latency_ms']:.0f} ms (target {stats['target_ms']:.0f}), "
+                  f"ratio {stats['ratio']:.5f}, {stats['underruns']} underruns, {stats['overruns']} overruns")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        terminate_pyaudio()
+
+if __name__ == '__main__':
+    main()
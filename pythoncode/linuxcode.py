@@ -1,10 +1,20 @@
+import argparse
+import time
+import numpy as np
 import serial
-import wave
-import struct
+from framing import FramedReader
+from wavwriter import StreamingWavWriter
+from metrics import Metrics, MetricsReporter
+from resample import RateEstimator
+from capture import RawSamples
+from event_capture import DEFAULT_THRESHOLDS, EventRecorder, make_trigger
+from archive import OVERFLOW_POLICIES, ArchiveSink
+from features import FeatureSink
 
 # Serial port configuration
 serial_port = '/dev/ttyUSB0'  # Update this with your ESP32 serial port
 baud_rate = 115200
+framed = False  # Set to True when the sketch is built with FRAMED_OUTPUT 1
 
 # WAV file configuration
 output_wav_file = 'output.wav'
@@ -12,27 +22,161 @@ sample_width = 2  # 16-bit audio
 sample_rate = 44100
 channels = 1
 
-# Open serial port
-ser = serial.Serial(serial_port, baud_rate)
-
-# Open WAV file for writing
-wav_file = wave.open(output_wav_file, 'wb')
-wav_file.setnchannels(channels)
-wav_file.setsampwidth(sample_width)
-wav_file.setframerate(sample_rate)
-
-try:
-    while True:
-        # Read data from serial port
-        raw_data = ser.read(sample_width)
-        if len(raw_data) == sample_width:
-            # Unpack binary data to integer
-            audio_sample = struct.unpack('<h', raw_data)[0]
-            # Write audio sample to WAV file
-            wav_file.writeframesraw(raw_data)
-except KeyboardInterrupt:
-    pass
-
-# Close serial port and WAV file
-ser.close()
-wav_file.close()
+# Reader configuration
+block_size = 8192       # Bytes requested per read
+read_timeout = 0.1      # Seconds a read waits for a full block
+fixup_interval = 1.0    # Seconds between WAV header updates
+metrics_interval = 5.0  # Seconds between JSON stats lines with --metrics
+
+# Function to copy the serial stream into the WAV file until stopped.
+# Reads return either a full block or whatever arrived within read_timeout,
+# so the loop runs a few times per second instead of once per sample.
+def record(ser, wav_file, framed=False, duration=None, metrics=None, estimator=None):
+    reader = FramedReader(ser, block_size) if framed else None
+    if reader:
+        # Decoded frames are already sample-aligned
+        read = reader.read
+    else:
+        read = lambda: ser.read(block_size)
+    # Odd trailing bytes are held by the writer until the next block
+    write = wav_file.write
+    if metrics is not None:
+        if reader:
+            metrics.watch('framing', reader.decoder)
+        read, write = _instrument(ser, read, write, metrics)
+    deadline = None if duration is None else time.monotonic() + duration
+    while deadline is None or time.monotonic() < deadline:
+        data = read()
+        if len(data):
+            write(data)
+            if estimator:
+                estimator.add(len(memoryview(data).cast('B')) // sample_width)
+
+# Feeds the serial stream to sinks that take int16 samples, such as an
+# EventRecorder; framed reads are already samples
+class SampleAdapter:
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink is not None]
+        self._raw = RawSamples()
+
+    def write(self, data):
+        if not isinstance(data, np.ndarray):
+            data = self._raw.convert(data)
+        for sink in self.sinks:
+            sink.write(data)
+
+# Function to wrap the read and write steps with timers, a byte rate and
+# the serial backlog; only used when metrics are requested
+def _instrument(ser, read, write, metrics):
+    clock = time.perf_counter
+    read_timer = metrics.timer('serial.read')
+    write_timer = metrics.timer('wav.write')
+    byte_rate = metrics.rate('bytes')
+
+    def timed_read():
+        started = clock()
+        data = read()
+        read_timer.record(clock() - started)
+        metrics.gauge('serial.in_waiting', ser.in_waiting)
+        return data
+
+    def timed_write(data):
+        started = clock()
+        write(data)
+        write_timer.record(clock() - started)
+        byte_rate.add(len(memoryview(data).cast('B')))
+
+    return timed_read, timed_write
+
+def main():
+    parser = argparse.ArgumentParser(description='Record the board\'s int16 serial stream to a WAV file.')
+    parser.add_argument('--port', default=serial_port)
+    parser.add_argument('--baud', type=int, default=baud_rate)
+    parser.add_argument('--output', default=output_wav_file)
+    parser.add_argument('--rate', type=int, default=sample_rate, help='sample rate written to the WAV header')
+    parser.add_argument('--framed', action='store_true', default=framed, help='decode FRAMED_OUTPUT packets')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--archive', metavar='FILE',
+                        help='write a compressed archive from a background thread instead of --output')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='drop_newest',
+                        help='what the archive writer does when the disk falls behind')
+    parser.add_argument('--events', metavar='DIR', help='write only triggered events to DIR instead of --output')
+    parser.add_argument('--trigger', choices=sorted(DEFAULT_THRESHOLDS), default='rms')
+    parser.add_argument('--threshold', type=float,
+                        help='dBFS for rms/peak/band, multiple of the running average for flux')
+    parser.add_argument('--features', metavar='FILE', help='also log per-second band levels, loudness and dominant frequency')
+    parser.add_argument('--measure-rate', action='store_true',
+                        help='write the measured incoming rate to the WAV header instead of --rate')
+    parser.add_argument('--metrics', nargs='?', const='-', metavar='FILE',
+                        help='append a JSON stats line every few seconds (to stderr without FILE)')
+    args = parser.parse_args()
+
+    # Open serial port
+    ser = serial.Serial(args.port, args.baud, timeout=read_timeout)
+
+    # Open WAV file for writing, or the event directory or archive
+    wav_file = events = archive = features = None
+    if args.events:
+        events = EventRecorder(args.events, args.rate, make_trigger(args.trigger, args.rate, args.threshold))
+        events.open()
+    elif args.archive:
+        archive = ArchiveSink(args.archive, args.rate, overflow=args.overflow)
+        archive.open()
+    else:
+        wav_file = StreamingWavWriter(args.output, args.rate, channels, sample_width, fixup_interval)
+    if args.features:
+        features = FeatureSink(args.features, args.rate, source=args.port)
+        features.open()
+    # The WAV writer takes the raw bytes as they are; the others want samples
+    output = wav_file if wav_file and not features else SampleAdapter(wav_file, events, archive, features)
+
+    metrics = reporter = None
+    if args.metrics:
+        metrics = Metrics('linuxcode')
+        reporter = MetricsReporter(metrics, None if args.metrics == '-' else args.metrics, metrics_interval)
+        reporter.start()
+        if events is not None:
+            metrics.watch('events', events)
+        if archive is not None:
+            metrics.watch('archive', archive)
+        if features is not None:
+            metrics.watch('features', features)
+
+    estimator = RateEstimator() if args.measure_rate and wav_file is not None else None
+
+    started = time.monotonic()
+    try:
+        record(ser, output, args.framed, args.duration, metrics, estimator)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if reporter:
+            reporter.stop()
+        # Close serial port and WAV file
+        ser.close()
+        if features is not None:
+            features.close()
+        if events is not None:
+            events.close()
+        elif archive is not None:
+            archive.close()
+        else:
+            if estimator and estimator.estimate():
+                wav_file.sample_rate = int(round(estimator.estimate()))
+            wav_file.close()
+
+    elapsed = time.monotonic() - started
+    if events is not None:
+        stats = events.stats()
+        print(f"Wrote {stats['events']} events to {args.events} ({stats['kept_fraction']:.1%} of {events.position} samples)")
+        return
+    if archive is not None:
+        stats = archive.stats()
+        print(f"Wrote {archive.position - stats['dropped_samples']} samples to {args.archive} "
+              f"({stats['compression_ratio']:.2f}x, {stats['dropped_blocks']} blocks dropped)")
+        return
+    print(f"Wrote {wav_file.frames_written} samples to {args.output} "
+          f"({wav_file.frames_written / max(elapsed, 1e-9):.0f} samples/s, header rate {wav_file.sample_rate})")
+
+if __name__ == '__main__':
+    main()
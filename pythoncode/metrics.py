@@ -0,0 +1,175 @@
+import json
+import sys
+import threading
+import time
+
+# Lightweight instrumentation for the capture and render loops.
+#
+# Nothing here is called unless a Metrics object is passed in: a
+# CapturePipeline without one runs its original loop, so disabled costs
+# nothing. When enabled, each stage costs two perf_counter() calls and a
+# few integer updates per chunk, i.e. microseconds per 10-20 ms chunk.
+# Timings go into log2 histograms (1 us, 2 us, 4 us, ... buckets), so
+# percentiles are cheap and memory is fixed however long the run is.
+BUCKETS = 32
+REPORT_INTERVAL = 5.0
+
+class StageTimer:
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Function to get the upper bound of the bucket holding percentile p, in ms
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return (1 << bucket) / 1000
+        return self.max * 1000
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max * 1000,
+            'busy_fraction': 0.0,  # Filled in by Metrics.snapshot()
+        }
+
+# Counts something and reports its rate since the previous snapshot
+class RateCounter:
+    def __init__(self):
+        self.total = 0
+        self._last_total = 0
+        self._last_time = time.monotonic()
+
+    def add(self, amount):
+        self.total += amount
+
+    def rate(self):
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        rate = (self.total - self._last_total) / elapsed if elapsed > 0 else 0.0
+        self._last_total = self.total
+        self._last_time = now
+        return rate
+
+class Metrics:
+    def __init__(self, name='capture'):
+        self.name = name
+        self.timers = {}
+        self.counters = {}
+        self.rates = {}
+        self.gauges = {}  # name -> (last, max)
+        self.providers = {}  # name -> object with stats(), polled at snapshot time
+        self.started = time.monotonic()
+
+    def timer(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = StageTimer()
+        return timer
+
+    def rate(self, name):
+        counter = self.rates.get(name)
+        if counter is None:
+            counter = self.rates[name] = RateCounter()
+        return counter
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        _, peak = self.gauges.get(name, (0, value))
+        self.gauges[name] = (value, max(peak, value))
+
+    # Function to include another object's stats() in every snapshot, e.g. a
+    # source's overflow counters or a RenderScheduler. A later provider under
+    # the same name replaces the earlier one, so reusing one Metrics across
+    # recordings reports (and keeps alive) only the latest source and sinks.
+    def watch(self, name, provider):
+        if hasattr(provider, 'stats'):
+            self.providers[name] = provider
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        timers = {}
+        for name, timer in list(self.timers.items()):
+            stats = timer.stats()
+            stats['busy_fraction'] = timer.total / elapsed
+            timers[name] = stats
+        snapshot = {
+            'name': self.name,
+            'time': time.time(),
+            'uptime': elapsed,
+            'timers': timers,
+            'rates': {name: counter.rate() for name, counter in list(self.rates.items())},
+            'counters': dict(self.counters),
+            'gauges': {name: {'last': last, 'max': peak} for name, (last, peak) in list(self.gauges.items())},
+        }
+        for name, provider in list(self.providers.items()):
+            snapshot[name] = provider.stats()
+        return snapshot
+
+# Function to format a snapshot as short lines for a stats panel or console
+def format_snapshot(snapshot):
+    lines = []
+    for name, rate in snapshot['rates'].items():
+        lines.append(f"{name}: {rate:,.0f}/s")
+    for name, stats in snapshot['timers'].items():
+        lines.append(f"{name}: p50 {stats['p50_ms']:.2f} ms  p99 {stats['p99_ms']:.2f} ms  "
+                     f"max {stats['max_ms']:.1f} ms  busy {stats['busy_fraction']:.1%}")
+    for name, gauge in snapshot['gauges'].items():
+        lines.append(f"{name}: {gauge['last']} (max {gauge['max']})")
+    extras = dict(snapshot['counters'])
+    for key, value in snapshot.items():
+        if isinstance(value, dict) and key not in ('timers', 'rates', 'counters', 'gauges'):
+            extras.update({f"{key}.{k}": v for k, v in value.items()})
+    if extras:
+        lines.append('  '.join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in extras.items()))
+    return '\n'.join(lines)
+
+# Writes a JSON line per interval for headless runs, to a file or stderr
+class MetricsReporter:
+    def __init__(self, metrics, path=None, interval=REPORT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._dump()  # Final numbers
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._dump()
+
+    def _dump(self):
+        line = json.dumps(self.metrics.snapshot())
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+        else:
+            print(line, file=sys.stderr)
@@ -0,0 +1,303 @@
+import argparse
+import os
+import selectors
+import threading
+import time
+import numpy as np
+from capture import RawSamples
+from framing import FrameDecoder
+from resample import RateEstimator
+from segment_store import SegmentWriter
+from archive import ArchiveSink
+from features import LOG_SUFFIX, FeatureSink
+from wavwriter import StreamingWavWriter
+
+# Captures N serial ports at once into one time-aligned multichannel stream.
+#
+# One thread serves every port. On POSIX the ports' file descriptors go into
+# a selector and each ready port gets a single non-blocking os.read(); other
+# platforms poll in_waiting. Each pass then sleeps out the rest of
+# CYCLE_SECONDS, so data collects in the kernel buffers and a pass does a few
+# large reads: CPU grows with the bytes received, not with wakeups per port.
+#
+# Every read is timestamped on arrival and fed to the port's RateEstimator.
+# Its least-squares line (samples received against host time) gives both the
+# board's real rate and when its first sample arrived. Output frame n is
+# host time T0 + n / sample_rate; for each port that time maps to a
+# fractional input position on its line, read by linear interpolation. Boards
+# that start at different moments are lined up, and boards whose clocks
+# run fast or slow are stretched onto the host clock, so they never slip
+# apart however long the recording. Alignment is as good as the transport
+# latency is equal between ports (typically within a millisecond on USB).
+#
+# Output starts once every port has a rate estimate (a few seconds). A port
+# that stops delivering for STALL_SECONDS is filled with silence so the
+# others keep recording.
+SAMPLE_RATE = 40000
+CYCLE_SECONDS = 0.01   # Shortest time between passes over the ports
+READ_SIZE = 65536      # Most bytes taken from one port per pass
+STALL_SECONDS = 1.0    # A port silent this long no longer holds the others back
+MAX_BUFFER_SECONDS = 30
+
+class PortChannel:
+    def __init__(self, port, baudrate=115200, sample_rate=SAMPLE_RATE, framed=False, clock=time.monotonic):
+        self.port = port
+        self.baudrate = baudrate
+        self.sample_rate = sample_rate
+        self.framed = framed
+        self.serial = None
+        self.estimator = RateEstimator(clock=clock)  # Same time base as the capture's arrival stamps
+        self._decoder = FrameDecoder(fill_gaps=True) if framed else None  # Lost frames keep their time
+        self._raw = RawSamples()
+        self._data = np.zeros(sample_rate, dtype=np.float32)
+        self._base = 0   # Absolute index of _data[0]
+        self._count = 0  # Valid samples in _data
+        self.received = 0
+        self.last_arrival = None
+        self.errors = 0
+        self.fit = None
+
+    def open(self):
+        import serial
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=0)
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+    def fileno(self):
+        return self.serial.fileno()
+
+    # Function to take bytes that arrived at `now`
+    def feed(self, data, now):
+        samples = self._decoder.feed(data) if self._decoder else self._raw.convert(data)
+        if not len(samples):
+            return
+        end = self._count + len(samples)
+        if end > len(self._data):
+            grown = np.zeros(max(end, 2 * len(self._data)), dtype=np.float32)
+            grown[:self._count] = self._data[:self._count]
+            self._data = grown
+        self._data[self._count:end] = samples
+        self._count = end
+        self.received += len(samples)
+        self.last_arrival = now
+        self.estimator.add(len(samples), now)
+
+    @property
+    def end(self):
+        return self._base + self._count
+
+    # Function to read the samples at absolute fractional positions; zero
+    # where nothing was received
+    def sample_at(self, positions):
+        local = positions - self._base
+        index = np.floor(local).astype(np.intp)
+        valid = (index >= 0) & (index + 1 < self._count)
+        out = np.zeros(len(positions), dtype=np.float32)
+        index = index[valid]
+        fraction = (local[valid] - index).astype(np.float32)
+        data = self._data
+        out[valid] = data[index] + fraction * (data[index + 1] - data[index])
+        return out
+
+    # Function to drop samples before an absolute position
+    def discard_before(self, position):
+        drop = min(max(int(position) - self._base, 0), self._count)
+        if drop:
+            self._data[:self._count - drop] = self._data[drop:self._count]
+            self._count -= drop
+            self._base += drop
+
+    def stats(self):
+        rate = self.fit[0] if self.fit else None
+        return {
+            'received': self.received,
+            'rate': rate or 0.0,
+            'drift_ppm': (rate / self.sample_rate - 1) * 1e6 if rate else 0.0,
+            'buffered': self._count,
+            'errors': self.errors,
+        }
+
+class MultiPortCapture:
+    def __init__(self, ports, sinks, baudrate=115200, sample_rate=SAMPLE_RATE, framed=False, clock=time.monotonic):
+        self.channels = [PortChannel(port, baudrate, sample_rate, framed, clock) for port in ports]
+        self.sinks = sinks
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self.frames_written = 0
+        self.start_time = None  # Host time of output frame 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def run(self, duration=None):
+        self._running = True
+        # Only what did open gets closed, so a port that fails to open
+        # still releases the ports and sinks opened before it
+        opened_channels = []
+        opened_sinks = []
+        selector = None
+        try:
+            for channel in self.channels:
+                channel.open()
+                opened_channels.append(channel)
+            for sink in self.sinks:
+                if hasattr(sink, 'open'):
+                    sink.open()
+                opened_sinks.append(sink)
+            if os.name == 'posix':
+                selector = selectors.DefaultSelector()
+                for channel in self.channels:
+                    selector.register(channel.fileno(), selectors.EVENT_READ, channel)
+            deadline = None if duration is None else self.clock() + duration
+            while self._running and (deadline is None or self.clock() < deadline):
+                started = self.clock()
+                if selector:
+                    self._read_ready(selector)
+                else:
+                    self._read_polled()
+                self._emit()
+                delay = started + CYCLE_SECONDS - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            self._running = False
+            if selector:
+                selector.close()
+            for channel in opened_channels:
+                channel.close()
+            for sink in opened_sinks:
+                if hasattr(sink, 'close'):
+                    sink.close()
+
+    def _read_ready(self, selector):
+        for key, _ in selector.select(CYCLE_SECONDS):
+            channel = key.data
+            try:
+                data = os.read(key.fd, READ_SIZE)
+            except OSError:
+                channel.errors += 1
+                continue
+            channel.feed(data, self.clock())
+
+    def _read_polled(self):
+        for channel in self.channels:
+            try:
+                waiting = channel.serial.in_waiting
+                if waiting:
+                    channel.feed(channel.serial.read(min(waiting, READ_SIZE)), self.clock())
+            except OSError:
+                channel.errors += 1
+
+    # Function to write every output frame all live ports have data for
+    def _emit(self):
+        now = self.clock()
+        for channel in self.channels:
+            fit = channel.estimator.fit()
+            if fit:
+                channel.fit = fit
+        if any(channel.fit is None for channel in self.channels):
+            self._trim_unaligned()
+            return
+        if self.start_time is None:
+            # Host time at which the last board to start sent its first sample
+            self.start_time = max(time_ - count / rate for rate, time_, count in (c.fit for c in self.channels))
+        live = [c for c in self.channels if c.last_arrival is not None and now - c.last_arrival < STALL_SECONDS]
+        if not live:
+            return
+        # Frames every live port can fill, from the latest host time each one covers
+        end_time = min(self._time_at(c, c.end - 2) for c in live)  # Interpolation reads one past
+        end = int((end_time - self.start_time) * self.sample_rate)
+        if end <= self.frames_written:
+            return
+        times = self.start_time + np.arange(self.frames_written, end) / self.sample_rate
+        out = np.empty((len(times), len(self.channels)), dtype=np.int16)
+        for column, channel in enumerate(self.channels):
+            positions = self._position_at(channel, times)
+            values = channel.sample_at(positions)
+            np.clip(np.rint(values), -32768, 32767, out=values)
+            out[:, column] = values
+            channel.discard_before(positions[-1] - 1)
+        self.frames_written = end
+        for sink in self.sinks:
+            sink.write(out)
+
+    # Until every port is measured, keep the buffers from growing without bound
+    def _trim_unaligned(self):
+        limit = MAX_BUFFER_SECONDS * self.sample_rate
+        for channel in self.channels:
+            if channel.end - channel._base > limit:
+                channel.discard_before(channel.end - limit)
+
+    def _position_at(self, channel, times):
+        rate, time_, count = channel.fit
+        return count + (times - time_) * rate
+
+    def _time_at(self, channel, position):
+        rate, time_, count = channel.fit
+        return time_ + (position - count) / rate
+
+    def stats(self):
+        stats = {'frames_written': self.frames_written}
+        for number, channel in enumerate(self.channels):
+            for key, value in channel.stats().items():
+                stats[f"{number}.{key}"] = value
+        return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Record several serial boards into one time-aligned multichannel file.')
+    parser.add_argument('ports', nargs='+')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--rate', type=int, default=SAMPLE_RATE, help='nominal rate of every board')
+    parser.add_argument('--framed', action='store_true')
+    parser.add_argument('--wav', default='multiport.wav')
+    parser.add_argument('--segments', metavar='DIR', help='write rotating segments to DIR instead of one WAV')
+    parser.add_argument('--segment-seconds', type=float, default=600)
+    parser.add_argument('--archive', metavar='FILE', help='write a compressed archive instead of one WAV')
+    parser.add_argument('--features', metavar='DIR', help='also log per-second band levels and loudness, one file per port')
+    parser.add_argument('--duration', type=float)
+    args = parser.parse_args()
+
+    if args.segments:
+        sink = SegmentWriter(args.segments, args.rate, args.segment_seconds, channels=len(args.ports))
+    elif args.archive:
+        sink = ArchiveSink(args.archive, args.rate, len(args.ports))
+    else:
+        sink = StreamingWavWriter(args.wav, args.rate, len(args.ports))
+    sinks = [sink]
+    if args.features:
+        os.makedirs(args.features, exist_ok=True)
+        for number, port in enumerate(args.ports):
+            path = os.path.join(args.features, os.path.basename(port) + LOG_SUFFIX)
+            sinks.append(FeatureSink(path, args.rate, channel=number, source=port))
+    capture = MultiPortCapture(args.ports, sinks, args.baud, args.rate, args.framed)
+    started = time.monotonic()
+    try:
+        capture.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - started
+    print(f"Wrote {capture.frames_written} frames of {len(args.ports)} channels in {elapsed:.1f} s "
+          f"to {args.segments or args.archive or args.wav}")
+    for port, channel in zip(args.ports, capture.channels):
+        stats = channel.stats()
+        print(f"{port}: {stats['rate']:.1f} samples/s ({stats['drift_ppm']:+.0f} ppm), {stats['errors']} read errors")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import threading
+import numpy as np
+
+# Multi-resolution min/max (peak) pyramid for drawing long waveforms.
+#
+# Level 0 stores the min and max of every base_block samples, and every level
+# above it combines `factor` entries of the one below. Each level is a ring
+# sized to cover `capacity` samples and is updated incrementally as chunks
+# arrive, so a write costs O(chunk). envelope() picks the coarsest level that
+# still gives about one min/max pair per pixel for the requested range, so a
+# redraw costs O(pixels) whether the range is one second or several hours.
+
+def _ring_put(array, start, values):
+    size = len(array)
+    start %= size
+    first = min(len(values), size - start)
+    array[start:start + first] = values[:first]
+    array[:len(values) - first] = values[first:]
+
+def _ring_get(array, start, count):
+    size = len(array)
+    start %= size
+    if start + count <= size:
+        return array[start:start + count]
+    return np.concatenate((array[start:], array[:start + count - size]))
+
+class _Level:
+    def __init__(self, block, size):
+        self.block = block  # Samples per entry
+        self.mins = np.zeros(size, dtype=np.int16)
+        self.maxs = np.zeros(size, dtype=np.int16)
+        self.count = 0      # Entries completed since the start
+
+    @property
+    def oldest(self):
+        return max(self.count - len(self.mins), 0)
+
+    def append(self, mins, maxs):
+        _ring_put(self.mins, self.count, mins)
+        _ring_put(self.maxs, self.count, maxs)
+        self.count += len(mins)
+
+    def get(self, first, last):
+        return _ring_get(self.mins, first, last - first), _ring_get(self.maxs, first, last - first)
+
+class PeakPyramid:
+    def __init__(self, capacity, base_block=16, factor=4, top_entries=64, raw_reader=None):
+        self.capacity = capacity
+        self.base_block = base_block
+        self.factor = factor
+        self.raw_reader = raw_reader  # Optional (start, count) -> samples, for zoomed-in views
+        self.levels = []
+        block = base_block
+        while True:
+            # One spare entry so a range that straddles the ring start still fits
+            self.levels.append(_Level(block, capacity // block + 2))
+            if capacity // block <= top_entries:
+                break
+            block *= factor
+        self.total_written = 0
+        self._partial = np.zeros(base_block, dtype=np.int16)
+        self._partial_len = 0
+        self._lock = threading.Lock()
+
+    # Builds a pyramid over a whole SegmentStore, e.g. for browsing a long
+    # recording; zoomed-in views read the raw samples back from the store.
+    # A multichannel store (such as multiport.py writes) is drawn one
+    # channel at a time.
+    @classmethod
+    def from_store(cls, store, chunk=1 << 20, channel=0, **kwargs):
+        channels = getattr(store, 'channels', 1)
+        if not 0 <= channel < channels:
+            raise ValueError(f"channel {channel} not in a {channels}-channel store")
+        if channels > 1:
+            def reader(start, count):
+                return np.ascontiguousarray(store.read(start, count)[:, channel])
+        else:
+            reader = store.read
+        pyramid = cls(max(store.total_samples, 1), raw_reader=reader, **kwargs)
+        for start in range(0, store.total_samples, chunk):
+            pyramid.write(reader(start, chunk))
+        return pyramid
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.int16)
+        with self._lock:
+            # Keep each step well inside the rings so no entry is overwritten
+            # before the level above has consumed it
+            step = max(self.capacity // 2, self.base_block)
+            for offset in range(0, len(samples), step):
+                self._write(samples[offset:offset + step])
+
+    def _write(self, samples):
+        block = self.base_block
+        self.total_written += len(samples)
+        if self._partial_len:
+            take = min(block - self._partial_len, len(samples))
+            self._partial[self._partial_len:self._partial_len + take] = samples[:take]
+            self._partial_len += take
+            samples = samples[take:]
+            if self._partial_len < block:
+                return
+            self.levels[0].append(self._partial.min(keepdims=True), self._partial.max(keepdims=True))
+            self._partial_len = 0
+        whole = len(samples) - len(samples) % block
+        if whole:
+            blocks = samples[:whole].reshape(-1, block)
+            self.levels[0].append(blocks.min(axis=1), blocks.max(axis=1))
+        rest = len(samples) - whole
+        self._partial[:rest] = samples[whole:]
+        self._partial_len = rest
+        for lower, upper in zip(self.levels, self.levels[1:]):
+            ready = lower.count // self.factor - upper.count
+            if ready <= 0:
+                break
+            first = upper.count * self.factor
+            mins, maxs = lower.get(first, first + ready * self.factor)
+            upper.append(mins.reshape(-1, self.factor).min(axis=1),
+                         maxs.reshape(-1, self.factor).max(axis=1))
+
+    # Collects (block, first entry, mins, maxs) runs covering [start, end),
+    # from `level` for the bulk of the range and finer levels for the most
+    # recent part that the coarse level has not completed yet
+    def _runs(self, start, end, level_number):
+        runs = []
+        position = start
+        for level in reversed(self.levels[:level_number + 1]):
+            first = max(position // level.block, level.oldest)
+            last = min(-(-end // level.block), level.count)
+            if last > first:
+                mins, maxs = level.get(first, last)
+                runs.append((level.block, first, mins, maxs))
+                position = last * level.block
+            if position >= end:
+                break
+        return runs
+
+    def _level_for(self, span, points):
+        for number, level in enumerate(self.levels):
+            if span / level.block <= points:
+                return number
+        return len(self.levels) - 1
+
+    # Function to get plot data for samples [start, end) using at most about
+    # max_points min/max pairs. Returns x (absolute sample positions) and y.
+    def envelope(self, start, end, max_points):
+        with self._lock:
+            start = max(start, 0)
+            end = min(end, self.total_written)
+            span = end - start
+            if span <= 0:
+                return np.zeros(0), np.zeros(0, dtype=np.int16)
+            if self.raw_reader is not None and span <= 2 * max_points:
+                return np.arange(start, end), self.raw_reader(start, span)
+            runs = self._runs(start, end, self._level_for(span, max_points))
+        xs = []
+        ys = []
+        for block, first, mins, maxs in runs:
+            centres = (np.arange(first, first + len(mins)) + 0.5) * block
+            xs.append(np.repeat(centres, 2))
+            pairs = np.empty(2 * len(mins), dtype=np.int16)
+            pairs[0::2] = mins
+            pairs[1::2] = maxs
+            ys.append(pairs)
+        if not xs:
+            return np.zeros(0), np.zeros(0, dtype=np.int16)
+        return np.concatenate(xs), np.concatenate(ys)
+
+    # Function to get the (min, max) over [start, end) from a few coarse
+    # entries, for setting axis limits; may be slightly wider than exact
+    def peaks(self, start, end, entries=32):
+        with self._lock:
+            start = max(start, 0)
+            end = min(end, self.total_written)
+            if end <= start:
+                return None
+            runs = self._runs(start, end, self._level_for(end - start, entries))
+        if not runs:
+            return None
+        low = min(int(mins.min()) for _, _, mins, _ in runs)
+        high = max(int(maxs.max()) for _, _, _, maxs in runs)
+        return low, high
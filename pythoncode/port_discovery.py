@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from framing import FrameDecoder
+
+# Background serial port discovery for the GUIs.
+#
+# Listing ports and opening each one can take seconds (USB enumeration, and
+# boards that reset when the port opens), so the GUIs show their window at
+# once with whatever the cache remembers and let PortDiscovery fill in the
+# rest from a background thread. Every port is probed in parallel: opened
+# without asserting DTR/RTS where the driver allows it, read for
+# PROBE_SECONDS, and classified as
+#
+#   framed    FRAMED_OUTPUT or compressed frames that pass their CRC
+#   int16     the sketches' raw little-endian int16 stream
+#   fft_text  fftretriver's spectrum lines, [ "bin":value, ... ]
+#   text      other printable output, e.g. debug messages
+#   silent    opened but sent nothing
+#   busy      could not be opened (in use, or no permission)
+#
+# with the measured byte rate. Results are cached by device and hardware id,
+# so a board seen before is preselected immediately on the next start.
+PROBE_SECONDS = 0.6
+PROBE_BAUD = 115200
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.arduino_audio_ports.json')
+AUDIO_KINDS = ('framed', 'int16')  # What the recorders can use, best first
+MIN_BINS = 8  # Bins per line before text counts as a spectrum
+
+# Function to classify bytes read from a port
+def classify(data):
+    if not data:
+        return 'silent'
+    decoder = FrameDecoder()
+    decoder.feed(data)
+    if decoder.frames_decoded:
+        return 'framed'
+    raw = np.frombuffer(data, dtype=np.uint8)
+    printable = np.count_nonzero(((raw >= 32) & (raw < 127)) | (raw == 10) | (raw == 13) | (raw == 9))
+    if printable > 0.95 * len(raw):
+        lines = data.decode('ascii', 'replace').splitlines()[1:-1]  # The ends may be cut
+        for line in lines:
+            line = line.strip()
+            if not (line.startswith('[') and line.endswith(']')):
+                continue
+            values = line[1:-1].replace(':', ',').split(',')[1::2]
+            if len(values) >= MIN_BINS and all(_is_number(value) for value in values):
+                return 'fft_text'
+        return 'text'
+    return 'int16' if _looks_like_samples(raw) else 'unknown'
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+# Audio is smooth: neighbouring int16 samples are closer than random pairs.
+# Tried at both byte alignments since the read may start mid-sample.
+def _looks_like_samples(raw):
+    for offset in (0, 1):
+        usable = (len(raw) - offset) // 2 * 2
+        if usable < 64:
+            return False
+        samples = raw[offset:offset + usable].view('<i2').astype(np.float64)
+        steps = np.abs(np.diff(samples)).mean()
+        spread = np.abs(samples - samples.mean()).mean()
+        if steps < spread or steps < 16:
+            return True
+    return False
+
+# Function to open one port, read for `seconds` and classify what it sends
+def probe_port(device, baudrate=PROBE_BAUD, seconds=PROBE_SECONDS):
+    import serial
+    result = {'device': device, 'kind': 'busy', 'bytes_per_second': 0.0, 'probed': time.time()}
+    port = serial.Serial()
+    port.port = device
+    port.baudrate = baudrate
+    port.timeout = 0.05
+    port.dtr = False  # Many boards reset when DTR is asserted on open
+    port.rts = False
+    try:
+        port.open()
+    except (OSError, serial.SerialException):
+        return result
+    chunks = []
+    try:
+        started = time.monotonic()
+        while time.monotonic() - started < seconds:
+            chunks.append(port.read(max(port.in_waiting, 1)))
+        elapsed = time.monotonic() - started
+    except (OSError, serial.SerialException):
+        return result
+    finally:
+        port.close()
+    data = b''.join(chunks)
+    result['kind'] = classify(data)
+    result['bytes_per_second'] = len(data) / elapsed
+    return result
+
+def load_cache(path=CACHE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache, path=CACHE_FILE):
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass  # A read-only home only costs the next start its head start
+
+# Function to pick the port to preselect: the first whose kind is wanted,
+# in order of preference, else (with fallback) the first port
+def best_port(results, kinds=AUDIO_KINDS, fallback=True):
+    for kind in kinds:
+        for device, result in results.items():
+            if result.get('kind') == kind:
+                return device
+    return next(iter(results), None) if fallback else None
+
+class PortDiscovery:
+    def __init__(self, baudrate=PROBE_BAUD, cache_path=CACHE_FILE, skip=()):
+        self.baudrate = baudrate
+        self.cache_path = cache_path
+        self.skip = set(skip)  # Ports this program already has open
+        self.results = {}      # device -> result, cached first, then probed
+        self.version = 0       # Bumped whenever results change, for polling UIs
+        self.done = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        from serial.tools import list_ports
+        cache = load_cache(self.cache_path)
+        ports = list_ports.comports()
+        # Cached results first, where the same hardware is still on that port
+        known = {}
+        for port in ports:
+            cached = cache.get(port.device)
+            known[port.device] = dict(cached) if cached and cached.get('hwid') == port.hwid else {'device': port.device}
+            known[port.device]['description'] = port.description
+        self._publish(known)
+
+        targets = [port for port in ports if port.device not in self.skip]
+        if targets:
+            with ThreadPoolExecutor(len(targets)) as pool:
+                probed = list(pool.map(lambda port: probe_port(port.device, self.baudrate), targets))
+            for port, result in zip(targets, probed):
+                result['hwid'] = port.hwid
+                result['description'] = port.description
+                if result['kind'] == 'busy' and known[port.device].get('kind'):
+                    continue  # Keep what it was last time rather than "busy"
+                known[port.device] = result
+                cache[port.device] = result
+            save_cache(cache, self.cache_path)
+        self._publish(known, done=True)
+
+    def _publish(self, results, done=False):
+        with self._lock:
+            self.results = dict(results)
+            self.done = done  # Set before the version, so a poller that sees it sees both
+            self.version += 1
+
+    # Function to describe a port for a label, e.g. "COM3 (int16, 11520 B/s)"
+    def describe(self, device):
+        result = self.results.get(device, {})
+        if not result.get('kind'):
+            return device
+        if result.get('bytes_per_second'):
+            return f"{device} ({result['kind']}, {result['bytes_per_second']:.0f} B/s)"
+        return f"{device} ({result['kind']})"
+
+# Helper for the Tk GUIs: fills a ttk.Combobox as results arrive and
+# preselects the best port unless the user already chose one. on_select is
+# called with the device when the user picks a port, or once probing is done
+# for the port chosen for them, so a GUI never opens a port mid-probe.
+class PortChooser:
+    POLL_MS = 100
+
+    def __init__(self, root, widget, label=None, kinds=AUDIO_KINDS, on_select=None, discovery=None):
+        self.root = root
+        self.widget = widget
+        self.label = label
+        self.kinds = kinds
+        self.on_select = on_select
+        self.discovery = discovery or PortDiscovery().start()
+        self._seen = 0
+        self._chosen_by_user = False
+        widget.bind('<<ComboboxSelected>>', self.user_selected)
+        if label is not None:
+            label.config(text="Searching for serial ports...")
+        root.after(0, self._poll)
+
+    def user_selected(self, event=None):
+        self._chosen_by_user = True
+        self._update_label()
+        if self.on_select:
+            self.on_select(self.widget.get())
+
+    def _poll(self):
+        discovery = self.discovery
+        if discovery.version != self._seen:
+            self._seen = discovery.version
+            done = discovery.done
+            results = discovery.results
+            self.widget.configure(values=list(results))
+            if not self._chosen_by_user:
+                # Cached guesses only preselect a port of the right kind
+                best = best_port(results, self.kinds, fallback=done)
+                if best:
+                    self.widget.set(best)
+                if done and best and self.on_select:
+                    self.on_select(best)
+            self._update_label()
+            if done:
+                return
+        self.root.after(self.POLL_MS, self._poll)
+
+    def _update_label(self):
+        if self.label is None:
+            return
+        device = self.widget.get()
+        if not self.discovery.results:
+            text = "No serial ports found" if self.discovery.done else "Searching for serial ports..."
+        elif not self.discovery.done:
+            text = "Select Serial Port: (checking ports...)"
+        else:
+            text = f"Select Serial Port: {self.discovery.describe(device)}" if device else "Select Serial Port:"
+        self.label.config(text=text)
+
+# Function to probe every port and print what each one is sending
+def main():
+    parser = argparse.ArgumentParser(description='Probe serial ports for the sketches\' audio or spectrum output.')
+    parser.add_argument('--baud', type=int, default=PROBE_BAUD)
+    args = parser.parse_args()
+    started = time.monotonic()
+    discovery = PortDiscovery(args.baud)
+    discovery.run()
+    for device in discovery.results:
+        print(discovery.describe(device))
+    if not discovery.results:
+        print("No serial ports found")
+    print(f"Probed in {time.monotonic() - started:.2f} s; audio port: {best_port(discovery.results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+_NOTHING = object()
+
+# Runs plot updates on the Tk main loop at a capped frame rate.
+#
+# Capture threads call publish() with the newest data and return straight
+# away; they never touch Tk or Matplotlib. The scheduler polls with
+# root.after() and hands only the most recent published frame to the render
+# callback, so frames that arrive faster than the cap are coalesced and
+# counted as dropped instead of queueing up behind a slow redraw.
+class RenderScheduler:
+    def __init__(self, root, render, fps=20, timer=None):
+        self.root = root
+        self.render = render
+        self.fps = fps
+        self.timer = timer  # Optional metrics.StageTimer for render durations
+        self._lock = threading.Lock()
+        self._pending = _NOTHING
+        self._after_id = None
+        self.frames_published = 0
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+        self.last_render_time = 0.0  # Seconds spent in the last render call
+
+    @property
+    def interval_ms(self):
+        return max(1, int(1000 / self.fps))
+
+    @property
+    def running(self):
+        return self._after_id is not None
+
+    # Called from any thread
+    def publish(self, frame):
+        with self._lock:
+            if self._pending is not _NOTHING:
+                self.frames_dropped += 1
+            self._pending = frame
+            self.frames_published += 1
+
+    # The methods below must be called from the Tk main thread
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        with self._lock:
+            self._pending = _NOTHING
+
+    def stats(self):
+        return {
+            'published': self.frames_published,
+            'rendered': self.frames_rendered,
+            'dropped': self.frames_dropped,
+            'last_render_ms': self.last_render_time * 1000,
+        }
+
+    def _tick(self):
+        with self._lock:
+            frame = self._pending
+            self._pending = _NOTHING
+        if frame is not _NOTHING:
+            started = time.perf_counter()
+            try:
+                self.render(frame)
+            finally:
+                self.last_render_time = time.perf_counter() - started
+                self.frames_rendered += 1
+                if self.timer:
+                    self.timer.record(self.last_render_time)
+        # The callback may have stopped the scheduler
+        if self._after_id is not None:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
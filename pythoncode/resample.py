@@ -0,0 +1,170 @@
+import threading
+import time
+from fractions import Fraction
+import numpy as np
+
+# Measuring the real incoming sample rate and converting between rates.
+#
+# The sketches are built for 40000 or 44100 Hz, but at 115200 baud a serial
+# link carries at most about 5760 int16 samples per second, and even a fast
+# link runs on the board's clock rather than the nominal rate. RateEstimator
+# fits a line through (arrival time, samples received) points, so it settles
+# on the rate the board actually delivers whatever the baud rate or USB-CDC
+# transfer size. With framed input and fill_gaps=True lost frames are
+# counted as silence, so losses do not bias the estimate.
+#
+# PolyphaseResampler converts a stream between two rates with a windowed-
+# sinc filter bank: each output sample is one dot product of TAPS input
+# samples, computed for a whole chunk at once.
+STANDARD_RATES = (8000, 11025, 16000, 22050, 32000, 40000, 44100, 48000, 96000)
+WINDOW_SECONDS = 30.0   # Arrival history used for the fit
+POINT_INTERVAL = 0.05   # Seconds between stored arrival points
+WARMUP_SECONDS = 2.0    # Arrivals ignored at the start (buffers filling, port settling)
+MIN_SPAN = 3.0          # Seconds of points needed before estimate() answers
+TAPS = 16               # Filter taps per output sample
+MAX_DENOMINATOR = 1000  # Limits the filter bank to at most this many phases
+
+# Function to snap a measured rate to a standard one within tolerance
+def nearest_standard_rate(rate, tolerance=0.01):
+    best = min(STANDARD_RATES, key=lambda r: abs(r - rate))
+    return best if abs(best - rate) <= tolerance * best else None
+
+class RateEstimator:
+    def __init__(self, window_seconds=WINDOW_SECONDS, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        size = int(window_seconds / POINT_INTERVAL) + 1
+        self._times = np.zeros(size)
+        self._counts = np.zeros(size)
+        self._points = 0
+        self._started = None
+        self._last_point = None
+        self._lock = threading.Lock()
+        self.samples_seen = 0
+
+    # Capture sink interface; also usable as a stage that passes samples on
+    def write(self, samples):
+        self.add(len(samples))
+
+    def __call__(self, samples):
+        self.add(len(samples))
+        return samples
+
+    # Function to record that count samples have just arrived, or arrived at
+    # `now` (on the estimator's clock) when the caller stamped them already
+    def add(self, count, now=None):
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self.samples_seen += count
+            if self._started is None:
+                self._started = now
+            if now - self._started < WARMUP_SECONDS:
+                return
+            if self._last_point is not None and now - self._last_point < POINT_INTERVAL:
+                return
+            slot = self._points % len(self._times)
+            self._times[slot] = now
+            self._counts[slot] = self.samples_seen
+            self._points += 1
+            self._last_point = now
+
+    # Function to get the measured rate in samples/s, or None until enough
+    # data has arrived
+    def estimate(self):
+        fit = self.fit()
+        return fit[0] if fit else None
+
+    # Function to get the least-squares line through the arrivals as (rate,
+    # time, count): `count` samples had arrived at clock time `time`, and
+    # more arrive at `rate` per second. None until enough data has arrived.
+    def fit(self):
+        with self._lock:
+            used = min(self._points, len(self._times))
+            if used < 3:
+                return None
+            times = self._times[:used].copy()
+            counts = self._counts[:used].copy()
+        if times.max() - times.min() < MIN_SPAN:
+            return None
+        # Samples arrive in bursts, after the board sent them; the slope of
+        # a least-squares line is far steadier than first-to-last
+        mean_time = times.mean()
+        mean_count = counts.mean()
+        times -= mean_time
+        counts -= mean_count
+        return float(np.dot(times, counts) / np.dot(times, times)), float(mean_time), float(mean_count)
+
+    def stats(self):
+        rate = self.estimate()
+        return {'measured_rate': rate or 0.0, 'standard_rate': nearest_standard_rate(rate) if rate else None}
+
+# Function to build the filter bank for converting by up/down; row p holds
+# the taps, newest sample last, for outputs at phase p
+def _filter_bank(up, down, taps):
+    length = up * taps
+    cutoff = 0.5 / max(up, down) * 0.9  # Cycles per upsampled sample, with a little guard band
+    n = np.arange(length) - (length - 1) / 2
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0)
+    prototype *= up / prototype.sum()
+    return np.ascontiguousarray(prototype.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+
+class PolyphaseResampler:
+    def __init__(self, input_rate, output_rate, taps=TAPS):
+        ratio = Fraction(output_rate / input_rate).limit_denominator(MAX_DENOMINATOR)
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        self.taps = taps
+        self._bank = _filter_bank(self.up, self.down, taps)
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._consumed = 0  # Input samples seen
+        self._produced = 0  # Output samples produced
+
+    # Function to convert the next chunk; returns int16 samples. Works as a
+    # CapturePipeline stage.
+    def process(self, samples):
+        buffer = np.concatenate((self._history, np.asarray(samples, dtype=np.float32)))
+        total = self._consumed + len(samples)
+        end = -(-total * self.up // self.down)
+        outputs = np.arange(self._produced, end, dtype=np.int64)
+        positions = outputs * self.down
+        bases = positions // self.up - self._consumed
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)[bases]
+        result = np.einsum('ij,ij->i', windows, self._bank[positions % self.up])
+        self._history = buffer[len(buffer) - (self.taps - 1):]
+        self._consumed = total
+        self._produced = end
+        return np.clip(np.rint(result), -32768, 32767).astype(np.int16)
+
+    __call__ = process
+
+# Stage that resamples to output_rate from whatever rate the estimator
+# measures, starting from the nominal rate until the estimate settles.
+# The resampler is rebuilt only when the measured rate moves by more than
+# `tolerance`, so normal jitter never changes the conversion.
+class AdaptiveResampler:
+    def __init__(self, nominal_rate, output_rate, estimator, tolerance=0.002):
+        self.output_rate = output_rate
+        self.estimator = estimator
+        self.tolerance = tolerance
+        self.resampler = PolyphaseResampler(nominal_rate, output_rate)
+        self._checked = 0
+
+    def __call__(self, samples):
+        self.estimator.write(samples)
+        self._checked += len(samples)
+        if self._checked >= self.resampler.input_rate:  # About once a second
+            self._checked = 0
+            rate = self.estimator.estimate()
+            if rate and abs(rate - self.resampler.input_rate) > self.tolerance * self.resampler.input_rate:
+                previous = self.resampler
+                self.resampler = PolyphaseResampler(rate, self.output_rate)
+                self.resampler._history = previous._history  # Carry on from the same input
+        return self.resampler.process(samples)
+
+    def stats(self):
+        stats = self.estimator.stats()
+        stats['resampling_from'] = self.resampler.input_rate
+        return stats
@@ -0,0 +1,85 @@
+import threading
+import numpy as np
+
+# Fixed-capacity ring buffer for audio samples.
+#
+# The storage is allocated once at twice the capacity and every sample is
+# written to both halves, so the most recent N samples are always one
+# contiguous slice. latest() can then hand out a view instead of copying the
+# window, and a write costs O(chunk) no matter how long the window is.
+# With a shape, each entry is a row of that shape instead of one sample,
+# e.g. shape=(n_bins,) keeps a history of spectra.
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.int16, shape=()):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self._data = np.zeros((2 * self.capacity,) + self.shape, dtype=self.dtype)
+        self._cursor = 0         # Index of the next write inside the first half
+        self._total_written = 0  # Samples written since creation or clear()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._total_written, self.capacity)
+
+    @property
+    def total_written(self):
+        # Absolute write cursor, used by readers to track what they have seen
+        return self._total_written
+
+    def write(self, samples):
+        samples = np.asarray(samples)
+        if samples.dtype != self.dtype:
+            samples = samples.astype(self.dtype)
+        count = len(samples)
+        if count == 0:
+            return
+        with self._lock:
+            if count > self.capacity:
+                self._total_written += count - self.capacity
+                samples = samples[-self.capacity:]
+                count = self.capacity
+            cap = self.capacity
+            start = self._cursor
+            first = min(count, cap - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[start + cap:start + cap + first] = samples[:first]
+            rest = count - first
+            if rest:
+                self._data[:rest] = samples[first:]
+                self._data[cap:cap + rest] = samples[first:]
+            self._cursor = (start + count) % cap
+            self._total_written += count
+
+    # Function to get the most recent n samples (zero-copy by default).
+    # The view is overwritten by later writes; pass copy=True for a snapshot.
+    def latest(self, n=None, copy=False):
+        with self._lock:
+            if n is None or n > self.capacity:
+                n = self.capacity
+            end = self._cursor + self.capacity
+            view = self._data[end - n:end]
+            return view.copy() if copy else view
+
+    # Function to get everything written after an absolute position.
+    # Returns the samples and the new position; samples that have already been
+    # overwritten are skipped.
+    def read_since(self, position, copy=True):
+        with self._lock:
+            total = self._total_written
+            if position > total:
+                position = 0  # The buffer was cleared since the last read
+            available = min(total - position, self.capacity)
+            if available <= 0:
+                return self._data[:0], total
+            end = self._cursor + self.capacity
+            view = self._data[end - available:end]
+            return (view.copy() if copy else view), total
+
+    def clear(self):
+        with self._lock:
+            self._data.fill(0)
+            self._cursor = 0
+            self._total_written = 0
@@ -0,0 +1,199 @@
+import bisect
+import json
+import os
+import time
+import numpy as np
+from wavwriter import StreamingWavWriter
+
+# Segmented recording store for long captures.
+#
+# SegmentWriter is a capture sink that writes a directory of WAV files,
+# starting a new one every segment_seconds (or max_segment_bytes), and keeps
+# index.json with each segment's wall-clock start, absolute sample offset,
+# length and peak/RMS level. Recordings from later runs append to the same
+# index. With channels > 1 it takes (frames, channels) arrays and reads
+# return the same shape. SegmentStore reads any sample or time range across segments through
+# np.memmap, so only the pages touched are loaded.
+INDEX_FILENAME = 'index.json'
+SEGMENT_SECONDS = 600
+HEADER_SIZE = StreamingWavWriter.HEADER_SIZE
+SAMPLE_WIDTH = 2
+
+def _load_index(directory):
+    path = os.path.join(directory, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return {'segments': []}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_index(directory, index):
+    path = os.path.join(directory, INDEX_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + '.tmp', path)  # Readers never see a half-written index
+
+# Function to get how many frames of a segment are on disk. The segment
+# being recorded is only indexed when it starts and finishes, so after a
+# crash, or while it is still open, its file size is the better count.
+def _samples_on_disk(directory, segment, channels):
+    path = os.path.join(directory, segment['file'])
+    if not os.path.exists(path):
+        return segment['samples']
+    return max(segment['samples'], (os.path.getsize(path) - HEADER_SIZE) // (SAMPLE_WIDTH * channels))
+
+class SegmentWriter:
+    def __init__(self, directory, sample_rate, segment_seconds=SEGMENT_SECONDS, max_segment_bytes=None, prefix='segment',
+                 channels=1):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.prefix = prefix
+        self.segment_samples = int(segment_seconds * sample_rate)
+        if max_segment_bytes:
+            self.segment_samples = min(self.segment_samples, (max_segment_bytes - HEADER_SIZE) // (SAMPLE_WIDTH * channels))
+        self.index = None
+        self._writer = None
+        self._entry = None
+        self._sum_squares = 0.0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index = _load_index(self.directory)
+        if index['segments']:
+            # Appending must not change what the earlier segments mean
+            if index.get('sample_rate', self.sample_rate) != self.sample_rate or index.get('channels', 1) != self.channels:
+                raise ValueError(f"{self.directory} holds {index.get('channels', 1)} channel(s) at "
+                                 f"{index.get('sample_rate')} Hz, not {self.channels} at {self.sample_rate} Hz")
+            # A run that crashed left its last segment indexed with samples: 0
+            last = index['segments'][-1]
+            last['samples'] = _samples_on_disk(self.directory, last, self.channels)
+        index['sample_rate'] = self.sample_rate
+        index['channels'] = self.channels
+        self.index = index
+        _save_index(self.directory, self.index)
+
+    @property
+    def next_sample(self):
+        segments = self.index['segments']
+        if not segments:
+            return 0
+        return segments[-1]['start_sample'] + segments[-1]['samples']
+
+    def write(self, samples):
+        offset = 0
+        while offset < len(samples):
+            if self._writer is None:
+                self._start_segment()
+            space = self.segment_samples - self._entry['samples']
+            part = samples[offset:offset + space]
+            self._writer.write(part)
+            self._update_levels(part)
+            offset += len(part)
+            if self._entry['samples'] >= self.segment_samples:
+                self._finish_segment()
+
+    def close(self):
+        if self._writer is not None:
+            self._finish_segment()
+
+    def _start_segment(self):
+        number = len(self.index['segments'])
+        start_time = time.time()
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(start_time))
+        filename = f"{self.prefix}_{stamp}_{number:06d}.wav"
+        self._writer = StreamingWavWriter(os.path.join(self.directory, filename), self.sample_rate, self.channels)
+        self._entry = {
+            'file': filename,
+            'start_time': start_time,
+            'start_sample': self.next_sample,
+            'samples': 0,
+            'peak': 0,
+            'rms': 0.0,
+        }
+        self._sum_squares = 0.0
+        self.index['segments'].append(self._entry)
+        _save_index(self.directory, self.index)
+
+    def _update_levels(self, samples):
+        if not len(samples):
+            return
+        self._entry['samples'] += len(samples)
+        peak = max(int(samples.max()), -int(samples.min()))
+        self._entry['peak'] = max(self._entry['peak'], peak)
+        as_float = samples.astype(np.float32)
+        self._sum_squares += float(np.vdot(as_float, as_float))
+
+    def _finish_segment(self):
+        self._writer.close()
+        self._writer = None
+        if self._entry['samples']:
+            self._entry['rms'] = (self._sum_squares / (self._entry['samples'] * self.channels)) ** 0.5
+        _save_index(self.directory, self.index)
+        self._entry = None
+
+class SegmentStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = {}
+        self.reload()
+
+    # Function to pick up segments written since the store was opened
+    def reload(self):
+        self.index = _load_index(self.directory)
+        self.segments = self.index['segments']
+        self.sample_rate = self.index.get('sample_rate', 0)
+        self.channels = self.index.get('channels', 1)
+        self._frame_shape = () if self.channels == 1 else (self.channels,)
+        if self.segments:
+            last = self.segments[-1]
+            last['samples'] = _samples_on_disk(self.directory, last, self.channels)
+            self._maps.pop(last['file'], None)
+        self._starts = [s['start_sample'] for s in self.segments]
+
+    @property
+    def total_samples(self):
+        if not self.segments:
+            return 0
+        return self.segments[-1]['start_sample'] + self.segments[-1]['samples']
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    def _map(self, segment):
+        mapped = self._maps.get(segment['file'])
+        if mapped is None or len(mapped) < segment['samples']:
+            path = os.path.join(self.directory, segment['file'])
+            mapped = np.memmap(path, dtype='<i2', mode='r', offset=HEADER_SIZE, shape=(segment['samples'],) + self._frame_shape)
+            self._maps[segment['file']] = mapped
+        return mapped
+
+    # Function to read count samples starting at an absolute sample offset
+    def read(self, start, count):
+        start = max(start, 0)
+        count = max(min(count, self.total_samples - start), 0)
+        out = np.empty((count,) + self._frame_shape, dtype=np.int16)
+        filled = 0
+        number = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        while filled < count and number < len(self.segments):
+            segment = self.segments[number]
+            local = start + filled - segment['start_sample']
+            part = min(segment['samples'] - local, count - filled)
+            if part > 0:
+                out[filled:filled + part] = self._map(segment)[local:local + part]
+                filled += part
+            number += 1
+        return out[:filled]
+
+    # Function to read by seconds from the start of the store
+    def read_seconds(self, start, duration):
+        return self.read(int(start * self.sample_rate), int(duration * self.sample_rate))
+
+    # Function to find the segments that overlap a wall-clock time range
+    def segments_between(self, start_time, end_time):
+        found = []
+        for segment in self.segments:
+            segment_end = segment['start_time'] + segment['samples'] / self.sample_rate
+            if segment['start_time'] < end_time and segment_end > start_time:
+                found.append(segment)
+        return found
@@ -0,0 +1,47 @@
+import argparse
+import matplotlib.pyplot as plt
+from segment_store import SegmentStore
+from peak_pyramid import PeakPyramid
+
+# Waveform browser for a SegmentWriter directory.
+#
+# Builds a peak pyramid over the whole recording once, then redraws from it
+# whenever the view changes, so panning and zooming with the matplotlib
+# toolbar stays fast even for recordings several hours long. Zoomed in far
+# enough, the raw samples are read back from the segment files.
+
+def main():
+    parser = argparse.ArgumentParser(description='Browse a segmented recording.')
+    parser.add_argument('directory', help='directory written by SegmentWriter')
+    parser.add_argument('--channel', type=int, default=0, help='channel to draw from a multichannel store')
+    args = parser.parse_args()
+
+    store = SegmentStore(args.directory)
+    if not store.total_samples:
+        parser.error(f"no recorded samples in {args.directory}")
+    rate = store.sample_rate or 1
+    if not 0 <= args.channel < store.channels:
+        parser.error(f"{args.directory} has {store.channels} channel(s)")
+    pyramid = PeakPyramid.from_store(store, channel=args.channel)
+
+    fig, ax = plt.subplots()
+    line, = ax.plot([], [], linewidth=0.8)
+    ax.set_title(args.directory if store.channels == 1 else f"{args.directory} (channel {args.channel})")
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Amplitude")
+
+    # Function to redecimate the visible range after a pan, zoom or resize
+    def redraw(*_):
+        start, end = ax.get_xlim()
+        x, y = pyramid.envelope(int(start * rate), int(end * rate) + 1, int(ax.bbox.width))
+        line.set_data(x / rate, y)
+        fig.canvas.draw_idle()
+
+    ax.callbacks.connect('xlim_changed', redraw)
+    fig.canvas.mpl_connect('resize_event', redraw)
+    ax.set_ylim(-32768, 32768)
+    ax.set_xlim(0, store.duration)
+    plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -1,149 +1,191 @@
-import serial
-import serial.tools.list_ports
 import tkinter as tk
 from tkinter import ttk
 import wave
-import pyaudio
-import threading
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-def toggle_recording():
-    global is_recording
-    is_recording = not is_recording
-    if is_recording:
-        my_port.write(b'R')  # Send start recording command
-        tk_canvas.itemconfig(circle, fill="red")
-        start_recording()
-        play_audio()  # Start playing audio simultaneously
-    else:
-        my_port.write(b'S')  # Send stop recording command
-        tk_canvas.itemconfig(circle, fill="green")
-        stop_recording()
-        stop_audio()  # Stop playing audio
-
-def start_recording():
-    global audio_stream, wave_file
-    wave_file = wave.open("recorded_audio.wav", 'wb')
-    wave_file.setnchannels(1)  # Mono
-    wave_file.setsampwidth(2)   # 2 bytes (16-bit)
-    wave_file.setframerate(44100)  # Sample rate
-    audio_stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
-    stream_thread = threading.Thread(target=record_audio)
-    stream_thread.start()
-
-def stop_recording():
-    global audio_stream, wave_file
-    if audio_stream:
-        audio_stream.stop_stream()
-        audio_stream.close()
-        audio_stream = None
-    if wave_file:
-        wave_file.close()
-        wave_file = None
-
-def record_audio():
-    while is_recording:
-        data = audio_stream.read(1024)  # Read audio data from PyAudio stream
-        wave_file.writeframes(data)
-        update_spectrum(data)
-
-def play_audio():
-    global playback_stream
-    playback_stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, output=True)
-    play_thread = threading.Thread(target=play_audio_thread)
-    play_thread.start()
-
-def play_audio_thread():
-    while is_recording:
-        data = my_port.read(1024)  # Read audio data from serial port
-        playback_stream.write(data)
-
-def stop_audio():
-    global playback_stream
-    if playback_stream:
-        playback_stream.stop_stream()
-        playback_stream.close()
-        playback_stream = None
-
-def on_closing():
-    global is_recording
-    if is_recording:
-        my_port.write(b'S')  # Send stop recording command
-        is_recording = False
-        stop_recording()
-        stop_audio()
-    my_port.close()
-    audio.terminate()
-    root.destroy()
+from render_scheduler import RenderScheduler
+from metrics import Metrics
+from stats_panel import StatsPanel
+from jitter_buffer import MonitorSink
+from resample import RateEstimator
+from stft import STFT
+from ringbuffer import RingBuffer
+from waterfall import Waterfall
+from event_capture import EventRecorder, make_trigger
+from port_discovery import PortChooser
+from capture import CapturePipeline, FileSource, PyAudioSource, SerialSource, WavSink, AnalyzerSink, terminate_pyaudio
+
+RENDER_FPS = 20  # Maximum spectrum redraws per second
+FRAMED = False  # Set to True when the sketch is built with FRAMED_OUTPUT 1
+WATERFALL_SECONDS = 10  # History shown in the spectrogram under the spectrum, 0 to hide it
+SAMPLE_RATE = 44100
+SERIAL_SAMPLE_RATE = 5760  # Starting guess for the serial rate (115200 baud carries at most ~5760 int16 samples/s); the monitor follows the measured rate
+MONITOR_LATENCY = 0.1  # Seconds of serial audio buffered before the speakers
+WAV_FILENAME = "recorded_audio.wav"
+EVENTS_DIR = None  # Set to a directory to keep only triggered events instead of one continuous WAV
+TRIGGER = 'rms'  # What starts an event: 'rms', 'peak', 'band' or 'flux' (see event_capture.py)
+REPLAY_FILE = None  # Set to a recorded WAV, archive or segment directory to analyse it instead of the microphone
+REPLAY_SPEED = 1.0  # Times real time for REPLAY_FILE, None for as fast as possible
+SHOW_STATS = True  # Live capture and render timings under the plot; False removes the instrumentation
 
 def create_dummy_wav():
-    with wave.open("recorded_audio.wav", 'wb') as dummy_wave:
+    with wave.open(WAV_FILENAME, 'wb') as dummy_wave:
         dummy_wave.setnchannels(1)  # Mono
         dummy_wave.setsampwidth(2)   # 2 bytes (16-bit)
-        dummy_wave.setframerate(44100)  # Sample rate
-        dummy_wave.writeframes(b'\x00\x00' * 44100)  # 1 second of silence
-
-def select_port(event):
-    global my_port
-    selected_port = port_combobox.get()
-    if my_port.is_open:
-        my_port.close()
-    my_port = serial.Serial(selected_port, 115200)
-
-def update_spectrum(data):
-    global spectrum_line
-    audio_data = np.frombuffer(data, dtype=np.int16)
-    fft_result = np.fft.rfft(audio_data)
-    freqs = np.fft.rfftfreq(len(audio_data), 1 / 44100)
-    spectrum_line.set_ydata(np.abs(fft_result))
-    spectrum_line.set_xdata(freqs)
-    ax.set_xlim(0, freqs[-1])
-    ax.set_ylim(0, np.max(np.abs(fft_result)))
-    fig_canvas.draw()
-
-# Create a dummy .wav file
-create_dummy_wav()
-
-# List available ports
-ports = list(serial.tools.list_ports.comports())
-port_names = [port.device for port in ports]
-
-# Setup PyAudio for recording and playback
-audio = pyaudio.PyAudio()
-
-# Setup the UI
-root = tk.Tk()
-root.title("Audio Recorder")
-root.protocol("WM_DELETE_WINDOW", on_closing)
-
-port_label = tk.Label(root, text="Select Serial Port:")
-port_label.pack()
-
-port_combobox = ttk.Combobox(root, values=port_names)
-port_combobox.bind("<<ComboboxSelected>>", select_port)
-port_combobox.pack()
-port_combobox.current(0)
-
-my_port = serial.Serial(port_names[0], 115200)
-is_recording = False
-
-# Setup Tkinter Canvas
-tk_canvas = tk.Canvas(root, width=200, height=200)
-tk_canvas.pack()
-
-circle = tk_canvas.create_oval(75, 75, 125, 125, fill="green")
-
-tk_canvas.bind("<Button-1>", lambda e: toggle_recording())
-
-# Setup the spectrum analyzer
-fig, ax = plt.subplots()
-spectrum_line, = ax.plot([], [])
-ax.set_title("Spectrum Analyzer")
-ax.set_xlabel("Frequency (Hz)")
-ax.set_ylabel("Amplitude")
-fig_canvas = FigureCanvasTkAgg(fig, master=root)
-fig_canvas.get_tk_widget().pack()
-
-root.mainloop()
+        dummy_wave.setframerate(SAMPLE_RATE)  # Sample rate
+        dummy_wave.writeframes(b'\x00\x00' * SAMPLE_RATE)  # 1 second of silence
+
+class SpectrumAnalyzerApp:
+    def __init__(self):
+        self.root = tk.Tk()
+        self.root.title("Audio Recorder")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+        self.is_recording = False
+        self.my_port = None   # Serial source, also used for the R/S commands
+        self.recorder = None  # Microphone -> WAV file and spectrum
+        self.player = None    # Serial port -> speakers
+        self.recorder_metrics = Metrics('recorder') if SHOW_STATS else None
+        self.player_metrics = Metrics('player') if SHOW_STATS else None
+        self.stft = STFT(SAMPLE_RATE, fft_size=1024, hop_size=512, averaging=0.5)
+        self.waterfall = None
+        self.frame_queue = None  # STFT frames from the capture thread, written to the waterfall on the Tk thread
+        self.frame_position = 0
+        if WATERFALL_SECONDS:
+            self.waterfall = Waterfall(self.stft, history=int(WATERFALL_SECONDS * SAMPLE_RATE / self.stft.hop_size))
+            self.frame_queue = RingBuffer(self.waterfall.history, dtype=np.float32, shape=(self.stft.n_bins,))
+
+        self.setup_ui()
+
+    def run(self):
+        self.root.mainloop()
+
+    def setup_ui(self):
+        self.setup_serial_ports()
+        self.setup_record_canvas()
+        self.setup_canvas()
+
+    # Ports are listed and probed in the background; the window opens at once
+    # and the port is opened when probing picks it or the user does
+    def setup_serial_ports(self):
+        self.port_label = tk.Label(self.root, text="Select Serial Port:")
+        self.port_label.pack()
+
+        self.port_combobox = ttk.Combobox(self.root, state='readonly')
+        self.port_combobox.pack()
+        self.port_chooser = PortChooser(self.root, self.port_combobox, self.port_label, on_select=self.select_port)
+
+    def setup_record_canvas(self):
+        self.tk_canvas = tk.Canvas(self.root, width=200, height=200)
+        self.tk_canvas.pack()
+        self.circle = self.tk_canvas.create_oval(75, 75, 125, 125, fill="green")
+        self.tk_canvas.bind("<Button-1>", lambda e: self.toggle_recording())
+
+    def setup_canvas(self):
+        if self.waterfall:
+            self.fig, (self.ax, self.waterfall_ax) = plt.subplots(2, 1, figsize=(6.4, 7.2))
+            self.waterfall.attach(self.waterfall_ax)
+        else:
+            self.fig, self.ax = plt.subplots()
+        self.spectrum_line, = self.ax.plot(self.stft.freqs, np.zeros(self.stft.n_bins))
+        self.ax.set_xlim(0, self.stft.freqs[-1])
+        self.ax.set_title("Spectrum Analyzer")
+        self.ax.set_xlabel("Frequency (Hz)")
+        self.ax.set_ylabel("Amplitude")
+        self.fig_canvas = FigureCanvasTkAgg(self.fig, master=self.root)
+        self.fig_canvas.get_tk_widget().pack()
+        self.render_scheduler = RenderScheduler(self.root, self.update_spectrum, fps=RENDER_FPS)
+        if SHOW_STATS:
+            self.render_scheduler.timer = self.recorder_metrics.timer('render')
+            self.recorder_metrics.watch('scheduler', self.render_scheduler)
+            self.stats_panel = StatsPanel(self.root, [self.recorder_metrics, self.player_metrics])
+            self.stats_panel.label.pack(fill=tk.X)
+            self.stats_panel.start()
+
+    def select_port(self, device):
+        if self.is_recording:
+            return  # The running capture keeps its port
+        if self.my_port:
+            self.my_port.close()
+        self.my_port = SerialSource(device, 115200, SERIAL_SAMPLE_RATE, framed=FRAMED)
+        self.my_port.open()
+
+    def toggle_recording(self):
+        if self.my_port is None and not REPLAY_FILE:
+            return  # No port chosen yet
+        self.is_recording = not self.is_recording
+        if self.is_recording:
+            if self.my_port:
+                self.my_port.send(b'R')  # Send start recording command
+            self.tk_canvas.itemconfig(self.circle, fill="red")
+            self.start_recording()
+            self.play_audio()  # Start playing audio simultaneously
+        else:
+            if self.my_port:
+                self.my_port.send(b'S')  # Send stop recording command
+            self.tk_canvas.itemconfig(self.circle, fill="green")
+            self.stop_recording()
+            self.stop_audio()  # Stop playing audio
+
+    def start_recording(self):
+        if self.waterfall:
+            self.waterfall.clear()
+            self.frame_queue.clear()
+            self.frame_position = 0
+        on_frames = self.frame_queue.write if self.waterfall else None
+        sinks = [AnalyzerSink(self.stft, self.publish_spectrum, on_frames)]
+        if EVENTS_DIR:
+            sinks.insert(0, EventRecorder(EVENTS_DIR, SAMPLE_RATE, make_trigger(TRIGGER, SAMPLE_RATE)))
+        elif not REPLAY_FILE:
+            sinks.insert(0, WavSink(WAV_FILENAME, SAMPLE_RATE))  # A replay is only analysed, not recorded again
+        source = FileSource(REPLAY_FILE, 1024, REPLAY_SPEED) if REPLAY_FILE else PyAudioSource(SAMPLE_RATE, 1024)
+        self.recorder = CapturePipeline(source, sinks, metrics=self.recorder_metrics)
+        self.recorder.start()
+        self.render_scheduler.start()
+
+    def stop_recording(self):
+        self.render_scheduler.stop()
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+
+    # Runs on the capture thread
+    def publish_spectrum(self, spectrum):
+        self.render_scheduler.publish(spectrum.copy())  # Drawn on the Tk main loop by update_spectrum
+
+    # Called by the render scheduler on the Tk main thread
+    def update_spectrum(self, spectrum):
+        self.spectrum_line.set_ydata(spectrum)
+        self.ax.set_ylim(0, max(np.max(spectrum), 1))
+        if self.waterfall:
+            frames, self.frame_position = self.frame_queue.read_since(self.frame_position)
+            self.waterfall.write(frames)
+            self.waterfall.refresh()
+        self.fig_canvas.draw_idle()
+
+    def play_audio(self):
+        if self.my_port is None:
+            return  # Replaying without a board
+        estimator = RateEstimator()
+        monitor = MonitorSink(SERIAL_SAMPLE_RATE, SAMPLE_RATE, MONITOR_LATENCY, rate_estimator=estimator)
+        self.player = CapturePipeline(self.my_port, [monitor], [estimator], metrics=self.player_metrics)
+        self.player.start()
+
+    def stop_audio(self):
+        if self.player:
+            self.player.stop()
+            self.player = None
+
+    def on_closing(self):
+        if self.is_recording:
+            self.toggle_recording()
+        if self.my_port:
+            self.my_port.close()
+        terminate_pyaudio()
+        self.root.destroy()
+
+if __name__ == "__main__":
+    # Create a dummy .wav file
+    create_dummy_wav()
+    SpectrumAnalyzerApp().run()
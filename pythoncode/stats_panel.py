@@ -0,0 +1,28 @@
+import tkinter as tk
+from metrics import format_snapshot
+
+# Live view of one or more Metrics objects, refreshed from the Tk main loop.
+# Snapshots only read counters the capture threads update, so showing the
+# panel never blocks capture.
+class StatsPanel:
+    def __init__(self, master, metrics, interval_ms=1000):
+        self.master = master
+        self.metrics = list(metrics)
+        self.interval_ms = interval_ms
+        self.label = tk.Label(master, justify=tk.LEFT, anchor='w', font='TkFixedFont')
+        self._after_id = None
+
+    # Call after placing self.label with pack() or grid()
+    def start(self):
+        if self._after_id is None:
+            self._tick()
+
+    def _tick(self):
+        text = '\n\n'.join(f"[{m.name}]\n{format_snapshot(m.snapshot())}" for m in self.metrics)
+        self.label.config(text=text)
+        self._after_id = self.master.after(self.interval_ms, self._tick)
+
+    def close(self):
+        if self._after_id is not None:
+            self.master.after_cancel(self._after_id)
+            self._after_id = None
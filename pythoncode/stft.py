@@ -0,0 +1,154 @@
+import numpy as np
+
+WINDOWS = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'bartlett': np.bartlett,
+    'rect': np.ones,
+}
+
+# np.fft functions accept out= from NumPy 2.0 onwards
+_FFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+_window_cache = {}
+_freq_cache = {}
+
+def get_window(name, size):
+    key = (name, size)
+    if key not in _window_cache:
+        _window_cache[key] = WINDOWS[name](size).astype(np.float32)
+    return _window_cache[key]
+
+def get_freqs(fft_size, sample_rate):
+    key = (fft_size, sample_rate)
+    if key not in _freq_cache:
+        _freq_cache[key] = np.fft.rfftfreq(fft_size, 1 / sample_rate)
+    return _freq_cache[key]
+
+# Short-time Fourier transform over a stream of int16 samples.
+#
+# Samples fed to process() are appended to a preallocated input buffer and
+# every complete, overlapping frame (fft_size long, hop_size apart) is
+# windowed and transformed in batches of up to max_frames. All intermediate
+# and output arrays are allocated once in __init__ and reused, so the
+# returned magnitudes are views that stay valid until the next call; only a
+# call that completes more than max_frames frames gets a new array.
+class STFT:
+    def __init__(self, sample_rate, fft_size=1024, hop_size=None, window='hann',
+                 log_magnitude=False, averaging=0.0, max_frames=32):
+        if hop_size is None:
+            hop_size = fft_size // 2
+        if not 0 < hop_size <= fft_size:
+            raise ValueError("hop_size must be between 1 and fft_size")
+        if not 0.0 <= averaging < 1.0:
+            raise ValueError("averaging must be in [0, 1)")
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        self.log_magnitude = log_magnitude
+        self.averaging = averaging  # Weight of the previous average per frame
+        self.max_frames = max_frames
+        self.n_bins = fft_size // 2 + 1
+
+        self.window = get_window(window, fft_size)
+        self.freqs = get_freqs(fft_size, sample_rate)
+        # Single-sided amplitude: a full-scale sine reads as its peak value
+        self.scale = np.float32(2.0 / self.window.sum())
+
+        # A full input buffer holds exactly max_frames frames
+        self._input = np.zeros(fft_size + (max_frames - 1) * hop_size, dtype=np.float32)
+        self._filled = 0
+        self._windowed = np.zeros((max_frames, fft_size), dtype=np.float32)
+        self._spectrum = np.zeros((max_frames, self.n_bins), dtype=np.complex64)
+        self._magnitude = np.zeros((max_frames, self.n_bins), dtype=np.float32)
+        self._decay = averaging ** np.arange(max_frames - 1, -1, -1, dtype=np.float32)
+        self.latest = np.zeros(self.n_bins, dtype=np.float32)
+        self.average = np.zeros(self.n_bins, dtype=np.float32)
+        self.frames_processed = 0
+
+    @property
+    def current(self):
+        # What a live display should show
+        return self.average if self.averaging else self.latest
+
+    def reset(self):
+        self._filled = 0
+        self.latest.fill(0)
+        self.average.fill(0)
+        self.frames_processed = 0
+
+    # Function to feed new samples, in chunks of any size; returns the
+    # magnitudes of every frame they completed, shape (frames, n_bins)
+    def process(self, samples):
+        samples = np.asarray(samples)
+        result = self._magnitude[:0]
+        batches = []
+        offset = 0
+        while offset < len(samples):
+            space = len(self._input) - self._filled
+            take = min(space, len(samples) - offset)
+            self._input[self._filled:self._filled + take] = samples[offset:offset + take]
+            self._filled += take
+            offset += take
+            if self._filled < self.fft_size:
+                break
+            count = (self._filled - self.fft_size) // self.hop_size + 1
+            if len(result):
+                batches.append(result.copy())  # The next batch reuses the output buffer
+            result = self._transform(self._input[:self._filled], count)
+            # Keep the samples the next frame still needs
+            consumed = count * self.hop_size
+            remaining = self._filled - consumed
+            self._input[:remaining] = self._input[consumed:self._filled]
+            self._filled = remaining
+        if batches:
+            batches.append(result)
+            return np.concatenate(batches)
+        return result
+
+    # Function to analyze a whole recording at once; returns an array of shape
+    # (frames, n_bins). Does not touch the streaming state.
+    def analyze(self, signal):
+        signal = np.asarray(signal)
+        if len(signal) < self.fft_size:
+            return np.zeros((0, self.n_bins), dtype=np.float32)
+        total = (len(signal) - self.fft_size) // self.hop_size + 1
+        out = np.empty((total, self.n_bins), dtype=np.float32)
+        for start in range(0, total, self.max_frames):
+            count = min(self.max_frames, total - start)
+            first = start * self.hop_size
+            last = first + (count - 1) * self.hop_size + self.fft_size
+            out[start:start + count] = self._compute(signal[first:last], count)
+        return out
+
+    def _compute(self, data, count):
+        frames = np.lib.stride_tricks.sliding_window_view(data, self.fft_size)[::self.hop_size][:count]
+        windowed = self._windowed[:count]
+        np.multiply(frames, self.window, out=windowed)
+        if _FFT_HAS_OUT:
+            spectrum = np.fft.rfft(windowed, axis=1, out=self._spectrum[:count])
+        else:
+            spectrum = np.fft.rfft(windowed, axis=1)
+        magnitude = self._magnitude[:count]
+        np.abs(spectrum, out=magnitude)
+        magnitude *= self.scale
+        if self.log_magnitude:
+            np.maximum(magnitude, 1e-6, out=magnitude)
+            np.log10(magnitude, out=magnitude)
+            magnitude *= 20
+        return magnitude
+
+    def _transform(self, data, count):
+        magnitude = self._compute(data, count)
+        self.latest[:] = magnitude[-1]
+        if self.averaging:
+            # Exponential average over the whole batch in one step:
+            # avg = a^n * avg + (1 - a) * sum(a^(n-1-k) * frame_k)
+            weights = self._decay[-count:]
+            self.average *= self.averaging ** count
+            self.average += (1 - self.averaging) * (weights @ magnitude)
+        else:
+            self.average[:] = self.latest
+        self.frames_processed += count
+        return magnitude
@@ -0,0 +1,60 @@
+import numpy as np
+from ringbuffer import RingBuffer
+
+# Scrolling spectrogram for the live analyzers.
+#
+# Every STFT frame is converted to dB in a preallocated scratch array and
+# written as one row of a mirrored RingBuffer, so the last `history` frames
+# are always a single contiguous view. refresh() hands that view, transposed,
+# to the existing image; matplotlib copies it on every call, so a redraw
+# costs one history-sized copy, but no image or array is created per frame.
+#
+# write() and refresh() both belong on the GUI thread. A capture thread
+# should queue its frames (e.g. in a RingBuffer) for the render side to
+# write, as spectrum_analysis.py does.
+HISTORY_FRAMES = 400
+DB_RANGE = (0, 90)  # dB relative to one LSB; a full-scale sine is about 90 dB
+
+class Waterfall:
+    def __init__(self, stft, history=HISTORY_FRAMES, db_range=DB_RANGE):
+        self.stft = stft
+        self.history = history
+        self.db_range = db_range
+        self.rows = RingBuffer(history, dtype=np.float32, shape=(stft.n_bins,))
+        self._scratch = np.zeros((stft.max_frames, stft.n_bins), dtype=np.float32)
+        self.image = None
+
+    # Function to add a batch of STFT magnitudes, shape (frames, n_bins);
+    # only the newest `history` frames can show, so older ones are skipped
+    def write(self, magnitudes):
+        magnitudes = magnitudes[-self.history:]
+        if self.stft.log_magnitude:
+            self.rows.write(magnitudes)
+            return
+        step = len(self._scratch)
+        for start in range(0, len(magnitudes), step):
+            part = magnitudes[start:start + step]
+            rows = self._scratch[:len(part)]
+            np.maximum(part, 1.0, out=rows)
+            np.log10(rows, out=rows)
+            rows *= 20
+            self.rows.write(rows)
+
+    def clear(self):
+        self.rows.clear()
+
+    # Function to create the image on an axes; time runs left to right, in
+    # seconds before now
+    def attach(self, ax, cmap='magma'):
+        seconds = self.history * self.stft.hop_size / self.stft.sample_rate
+        self.image = ax.imshow(self.rows.latest().T, origin='lower', aspect='auto', cmap=cmap,
+                               extent=(-seconds, 0, 0, self.stft.freqs[-1]),
+                               vmin=self.db_range[0], vmax=self.db_range[1], interpolation='nearest')
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Frequency (Hz)")
+        return self.image
+
+    # Function to show the newest history; call on the GUI thread
+    def refresh(self):
+        self.image.set_data(self.rows.latest().T)
+        return self.image
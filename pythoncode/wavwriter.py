@@ -0,0 +1,117 @@
+import os
+import struct
+import time
+import numpy as np
+
+# WAV writer for long, open-ended recordings.
+#
+# Data is appended as it arrives and the RIFF/data lengths in the header are
+# rewritten every fixup_interval seconds, so a crash or power loss leaves a
+# playable file holding everything up to the last fixup. Writes that do not
+# end on a whole sample frame keep the trailing bytes until the next call.
+# sample_rate may be changed while recording, e.g. once the real rate has
+# been measured; the next fixup writes it.
+class StreamingWavWriter:
+    HEADER_SIZE = 44
+
+    def __init__(self, filename, sample_rate, channels=1, sample_width=2, fixup_interval=1.0):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.fixup_interval = fixup_interval
+        self.frame_size = channels * sample_width
+        self.data_bytes = 0
+        self._partial = bytearray()
+        self._file = open(filename, 'wb')
+        self._file.write(self._header())
+        self._last_fixup = time.monotonic()
+
+    @property
+    def frames_written(self):
+        return self.data_bytes // self.frame_size
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def _header(self):
+        byte_rate = self.sample_rate * self.frame_size
+        return struct.pack('<4sI4s4sIHHIIHH4sI',
+                           b'RIFF', 36 + self.data_bytes, b'WAVE',
+                           b'fmt ', 16, 1, self.channels, self.sample_rate,
+                           byte_rate, self.frame_size, self.sample_width * 8,
+                           b'data', self.data_bytes)
+
+    # Accepts bytes, bytearray, memoryview or a NumPy array
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        if self._partial:
+            self._partial += data
+            data = memoryview(bytes(self._partial))
+            self._partial.clear()
+        usable = len(data) - len(data) % self.frame_size
+        if usable:
+            self._file.write(data[:usable])
+            self.data_bytes += usable
+        if usable < len(data):
+            self._partial += data[usable:]
+        if time.monotonic() - self._last_fixup >= self.fixup_interval:
+            self.fixup()
+
+    # Function to rewrite the header to match the data written so far
+    def fixup(self):
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.seek(0, 2)
+        self._file.flush()
+        self._last_fixup = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.fixup()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Function to map the samples of a 16-bit PCM WAV file without reading it.
+# Returns (samples, sample_rate); samples has shape (frames, channels) and
+# only the pages that are touched get loaded. Works on files whose header
+# lengths were never fixed up, e.g. after a crash, by trusting the file size.
+def map_wav(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            raise ValueError(f"{path}: not a WAV file")
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"{path}: no data chunk")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+    if fmt is None:
+        raise ValueError(f"{path}: no fmt chunk")
+    audio_format, channels, sample_rate, _, _, bits = fmt
+    if audio_format not in (1, 0xFFFE) or bits != 16:  # PCM or WAVE_FORMAT_EXTENSIBLE
+        raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+    available = size - offset
+    if 0 < chunk_size < available:
+        available = chunk_size
+    frames = available // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype='<i2'), sample_rate
+    samples = np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(frames, channels))
+    return samples, sample_rate